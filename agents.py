@@ -1,12 +1,25 @@
 import os
 import json
-import requests
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional
-from recommendation_engine import RecommendationEngine, get_recommendation_engine
+from typing import List, Dict, Any, Optional, Iterator, NamedTuple
+from recommendation_engine import RecommendationEngine, get_recommendation_engine, parse_price
+from llm_client import get_llm_client
+from intent_classifier import IntentClassifier
+from cache import SemanticCache
+from history import history_window
+from metrics import span, record_usage, STAGE_SECONDS
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+NO_RESPONSE_REPLY = "Sorry, I couldn't generate a proper response. Please try again"
+
 class Agent:
     def __init__(self, name: str, role: str):
         self.name = name
@@ -14,19 +27,17 @@ class Agent:
         self.api_key = os.getenv('OPENAI_API_KEY')
         self.api_base = os.getenv('OPENAI_API_BASE')
         self.model = os.getenv('MODEL')
+        # Opt-in: not every OpenAI-compatible server accepts stream_options.
+        self.stream_usage = os.getenv('LLM_STREAM_USAGE', '0') == '1'
         
-    def call_openai_api(self, messages: List[Dict[str, str]], model: str = None, temperature: float = 0.7, max_tokens: int = 500) -> Optional[Dict[str, Any]]:
+    def call_openai_api(self, messages: List[Dict[str, str]], model: str = None, temperature: float = 0.7, max_tokens: int = 500,
+                        stream: bool = False, stage: str = 'llm') -> Optional[Any]:
         if not self.api_key or not self.api_base:
             raise ValueError("API key or base URL not configured")
         
         if model is None:
             model = self.model
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
         data = {
             "model": model,
             "messages": messages,
@@ -35,33 +46,58 @@ class Agent:
         }
         
         try:
-            print(f"DEBUG: Calling API at {self.api_base}/chat/completions")
-            print(f"DEBUG: Model: {self.model}")
-            print(f"DEBUG: API key exists: {bool(self.api_key)}")
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result
-            else:
-                print(f"API request failed, status code: {response.status_code}")
-                print(f"Error message: {response.text}")
-                return None
+            logger.debug("Calling API at %s/chat/completions", self.api_base)
+            logger.debug("Model: %s", self.model)
+            client = get_llm_client(self.api_base, self.api_key)
+            if stream:
+                # Returns an iterator of content deltas instead of the full completion.
+                data["stream"] = True
+                if self.stream_usage:
+                    data["stream_options"] = {"include_usage": True}
+                return self._timed_stream(client.stream_chat_completion(data, lambda usage: record_usage(stage, usage)), stage)
+            with span(stage):
+                result = client.chat_completion(data)
+            if result:
+                record_usage(stage, result.get('usage'))
+            return result
                 
         except Exception as e:
-            print(f"Error calling OpenAI API: {e}")
+            logger.error("Error calling OpenAI API: %s", e)
             return None
 
+    def _timed_stream(self, tokens: Iterator[str], stage: str) -> Iterator[str]:
+        start = time.perf_counter()
+        first = True
+        try:
+            for token in tokens:
+                if first:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage=f"{stage}_first_token")
+                    first = False
+                yield token
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
 class IntentUnderstandingAgent(Agent):
-    def __init__(self):
+    def __init__(self, classifier: Optional[IntentClassifier] = None):
         super().__init__("IntentUnderstandingAgent", "Analyze user queries to determine intent, extract parameters, and understand context")
+        self.classifier = classifier
+        self.history_budget = (int(os.getenv('INTENT_HISTORY_TOKENS', '400')), int(os.getenv('INTENT_HISTORY_MESSAGES', '4')))
         
     def analyze_intent(self, user_question: str, conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
+        # Obvious queries are classified locally; only the rest pay for an LLM round trip.
+        if self.classifier is not None:
+            with span('intent_local'):
+                intent_data = self.classifier.classify(user_question, conversation_history)
+            if intent_data is not None:
+                return intent_data
+        
+        messages = self._build_intent_messages(user_question, conversation_history)
+        
+        result = self.call_openai_api(messages, stage='intent_llm')
+        
+        return self._parse_intent_result(result)
+
+    def _build_intent_messages(self, user_question: str, conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
         messages = [
             {
                 "role": "system", 
@@ -110,17 +146,17 @@ class IntentUnderstandingAgent(Agent):
             }
         ]
         
-        if conversation_history:
-            for msg in conversation_history:
-                messages.append(msg)
+        # The intent only needs the last few messages; the response agent gets a larger window.
+        messages.extend(history_window(conversation_history, *self.history_budget, current_question=user_question))
         
         messages.append({
             "role": "user", 
             "content": user_question
         })
         
-        result = self.call_openai_api(messages)
-        
+        return messages
+
+    def _parse_intent_result(self, result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
         if result:
             try:
                 content = result['choices'][0]['message']['content'].strip()
@@ -132,8 +168,8 @@ class IntentUnderstandingAgent(Agent):
                 intent_data = json.loads(content)
                 return intent_data
             except (json.JSONDecodeError, KeyError) as e:
-                print(f"Error parsing intent data: {e}")
-                print(f"Raw content: {result['choices'][0]['message']['content']}")
+                logger.error("Error parsing intent data: %s", e)
+                logger.warning("Raw content: %s", result['choices'][0]['message']['content'])
         
         return {
             "intent": "product_recommendation",
@@ -146,28 +182,65 @@ class RecommendationAgent(Agent):
         super().__init__("RecommendationAgent", "Generate product recommendations based on user intent and preferences")
         self.recommendation_engine = recommendation_engine
         
+    def prefetch_recommendations(self, user_question: str) -> List[Dict[str, Any]]:
+        """The first-pass retrieval, which only depends on the raw question and can run before the intent is known."""
+        return self.recommendation_engine.recommend_by_text(user_question, top_k=10)
+
+    def uses_prefetch(self, intent_data: Dict[str, Any], last_recommendations: Optional[list] = None) -> bool:
+        """Whether get_recommendations would start from the prefetched results: not for price
+        inquiries about known products, nor when the intent's filters call for another search."""
+        if intent_data.get('intent') == 'price_inquiry' and \
+                ((intent_data.get('parameters') or {}).get('product_ids') or last_recommendations):
+            return False
+        return not self._intent_filters(intent_data)
+
     def get_recommendations(self, user_question: str, intent_data: Dict[str, Any], 
-                          conversation_history: List[Dict[str, str]], last_recommendations: Optional[list]=None) -> List[Dict[str, Any]]:
+                          conversation_history: List[Dict[str, str]], last_recommendations: Optional[list]=None,
+                          prefetched: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
         if intent_data.get('intent') == 'price_inquiry':
             product_ids = intent_data.get('parameters', {}).get('product_ids') or last_recommendations
             if product_ids:
-                matched = [p for p in self.recommendation_engine.products if p.get('id') in product_ids]
+                matched = self.recommendation_engine.get_products_by_ids(product_ids)
                 if matched:
-                    print(f"DEBUG: Returning price inquiry recommendations: {[p['name'] for p in matched]}")
+                    logger.debug("Returning price inquiry recommendations: %s", [p['name'] for p in matched])
                     return matched
 
-        raw_recommendations = self.recommendation_engine.recommend_by_text(
-            user_question, top_k=10
-        )
-        print(f"DEBUG: Raw recommendations: {[p['product']['name'] for p in raw_recommendations]}")
+        filters = self._intent_filters(intent_data)
+        if filters:
+            # Price, brand and category constraints are applied inside the vector search; when none of
+            # them narrows the catalog this is the same cached search the prefetch ran.
+            raw_recommendations = self.recommendation_engine.recommend_by_text(user_question, top_k=10, filters=filters)
+        else:
+            raw_recommendations = prefetched if prefetched is not None else self.prefetch_recommendations(user_question)
+        logger.debug("Raw recommendations: %s", [p['product']['name'] for p in raw_recommendations])
         
         product_recommendations = [p['product'] for p in raw_recommendations]
         
         refined_recommendations = self._refine_recommendations(product_recommendations, intent_data, user_question, conversation_history)
-        print(f"DEBUG: Refined recommendations: {[p['name'] for p in refined_recommendations]}")
+        logger.debug("Refined recommendations: %s", [p['name'] for p in refined_recommendations])
         
         return refined_recommendations
     
+    def _intent_filters(self, intent_data: Dict[str, Any]) -> Dict[str, Any]:
+        params = intent_data.get('parameters') or {}
+        filters = {}
+        price_range = params.get('price_range')
+        if isinstance(price_range, dict):
+            for bound, name in (('min', 'price_min'), ('max', 'price_max')):
+                value = parse_price(price_range.get(bound))
+                if not math.isnan(value):
+                    filters[name] = value
+        for name in ('brands', 'categories'):
+            values = params.get(name)
+            if isinstance(values, str):
+                values = [values]
+            if isinstance(values, (list, tuple)):
+                # The LLM's output is free-form; the engine rejects anything but strings.
+                values = [value for value in values if isinstance(value, str) and value.strip()]
+                if values:
+                    filters[name] = values
+        return filters
+
     def _refine_recommendations(self, recommendations: List[Dict[str, Any]], 
                                intent_data: Dict[str, Any], user_question: str, conversation_history: List[Dict[str, str]]) -> List[Dict[str, Any]]:
         if recommendations:
@@ -183,7 +256,7 @@ class RecommendationAgent(Agent):
                 refined_recommendations = [p['product'] for p in raw_recommendations]
                 
                 if refined_recommendations:
-                    print(f"DEBUG: Refined recommendations after category filtering: {[p['name'] for p in refined_recommendations]}")
+                    logger.debug("Refined recommendations after category filtering: %s", [p['name'] for p in refined_recommendations])
                     return refined_recommendations
         
         if intent_data['intent'] == 'product_details':
@@ -223,32 +296,130 @@ class RecommendationAgent(Agent):
 
 class CoordinationAgent(Agent):
     def __init__(self, intent_agent: IntentUnderstandingAgent, 
-                 recommendation_agent: RecommendationAgent):
+                 recommendation_agent: RecommendationAgent,
+                 response_cache: Optional[SemanticCache] = None):
         super().__init__("CoordinationAgent", "Manage communication between intent and recommendation agents and generate final responses")
         self.intent_agent = intent_agent
         self.recommendation_agent = recommendation_agent
+        self.response_cache = response_cache
+        self.history_budget = (int(os.getenv('RESPONSE_HISTORY_TOKENS', '1500')), int(os.getenv('RESPONSE_HISTORY_MESSAGES', '12')))
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    def _retrieval_executor(self) -> ThreadPoolExecutor:
+        # Worker threads don't survive fork, so each process gets its own pool.
+        if self._executor_pid != os.getpid():
+            with self._executor_lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=int(os.getenv('RETRIEVAL_WORKERS', '4')),
+                                                        thread_name_prefix='speculative-retrieval')
+                    self._executor_pid = os.getpid()
+        return self._executor
         
     def handle_user_query(self, user_question: str, 
                          conversation_history: List[Dict[str, str]],
                          user_id: Optional[str] = None,
                          last_recommendations: Optional[list] = None) -> Dict[str, Any]:
+        intent_data, recommendations = self._prepare_turn(user_question, conversation_history, last_recommendations)
+        
+        cache_entry = self._response_cache_entry(user_question, intent_data, recommendations, conversation_history)
+        reply = self.response_cache.get(*cache_entry) if cache_entry else None
+        if reply is None:
+            response_data = self._generate_response(user_question, intent_data, recommendations, conversation_history)
+            reply = response_data.get('reply', 'Sorry, I couldn\'t process your request.')
+            self._store_response(cache_entry, reply, recommendations)
+        
+        return self._build_result(reply, intent_data, recommendations)
+
+    def handle_user_query_stream(self, user_question: str,
+                                 conversation_history: List[Dict[str, str]],
+                                 user_id: Optional[str] = None,
+                                 last_recommendations: Optional[list] = None) -> Iterator[Dict[str, Any]]:
+        """Yield {'type': 'token'} events as the reply streams in, then one {'type': 'done'} event
+        carrying the same result handle_user_query returns."""
+        intent_data, recommendations = self._prepare_turn(user_question, conversation_history, last_recommendations)
+        
+        cache_entry = self._response_cache_entry(user_question, intent_data, recommendations, conversation_history)
+        reply = self.response_cache.get(*cache_entry) if cache_entry else None
+        if reply is not None:
+            yield {'type': 'token', 'text': reply}
+        else:
+            messages = self._build_response_messages(user_question, intent_data, recommendations, conversation_history)
+            
+            chunks = []
+            tokens = self.call_openai_api(messages, stream=True, stage='response_llm')
+            for token in tokens or []:
+                chunks.append(token)
+                yield {'type': 'token', 'text': token}
+            
+            reply = ''.join(chunks).strip()
+            if not reply:
+                reply = NO_RESPONSE_REPLY
+                yield {'type': 'token', 'text': reply}
+            self._store_response(cache_entry, reply, recommendations)
+        
+        yield {'type': 'done', **self._build_result(reply, intent_data, recommendations)}
+
+    def _prepare_turn(self, user_question: str, conversation_history: List[Dict[str, str]],
+                      last_recommendations: Optional[list] = None):
+        # Start the vector search speculatively so it overlaps the intent LLM round trip.
+        prefetch = self._retrieval_executor().submit(self.recommendation_agent.prefetch_recommendations, user_question)
+        
         intent_data = self.intent_agent.analyze_intent(user_question, conversation_history)
-        print(f"DEBUG: Intent data: {intent_data}")
+        logger.debug("Intent data: %s", intent_data)
 
-        if intent_data.get('intent') == 'price_inquiry':
-            params = intent_data.setdefault('parameters', {})
-            if not params.get('product_names') and not params.get('product_ids') and last_recommendations:
-                params['product_ids'] = last_recommendations
+        self._apply_last_recommendations(intent_data, last_recommendations)
         
         recommendation_intents = ['product_recommendation', 'category_exploration', 'comparison', 'price_inquiry']
         if intent_data.get('intent') in recommendation_intents:
-            recommendations = self.recommendation_agent.get_recommendations(user_question, intent_data, conversation_history, last_recommendations)
+            prefetched = None
+            if self.recommendation_agent.uses_prefetch(intent_data, last_recommendations):
+                try:
+                    prefetched = prefetch.result()
+                except Exception as e:
+                    logger.warning("Speculative retrieval failed, retrying inline: %s", e)
+            else:
+                # Don't wait for a search whose result would be thrown away.
+                prefetch.cancel()
+            recommendations = self.recommendation_agent.get_recommendations(user_question, intent_data, conversation_history,
+                                                                            last_recommendations, prefetched)
         else:
+            prefetch.cancel()
             recommendations = []
         
-        response_data = self._generate_response(user_question, intent_data, recommendations, conversation_history)
-        reply = response_data.get('reply', 'Sorry, I couldn\'t process your request.')
-        
+        return intent_data, recommendations
+
+    def _response_cache_entry(self, user_question: str, intent_data: Dict[str, Any],
+                              recommendations: List[Dict[str, Any]],
+                              conversation_history: List[Dict[str, str]]) -> Optional[tuple]:
+        """(key, query vector) for the semantic response cache, or None if this turn can't be cached."""
+        if self.response_cache is None or self.response_cache.max_size <= 0:
+            return None
+        # Only standalone questions: once there are earlier turns the right reply depends on them.
+        if any(msg.get('content') != user_question for msg in conversation_history):
+            return None
+        key = (intent_data.get('intent'), tuple(p['id'] for p in recommendations))
+        try:
+            vector = self.recommendation_agent.recommendation_engine.encode_query(user_question)
+        except Exception as e:
+            logger.error("Error embedding query for response cache: %s", e)
+            return None
+        return key, vector
+
+    def _store_response(self, cache_entry: Optional[tuple], reply: str, recommendations: List[Dict[str, Any]]) -> None:
+        if cache_entry and reply != NO_RESPONSE_REPLY:
+            key, vector = cache_entry
+            self.response_cache.set(key, vector, reply, tags=[p['id'] for p in recommendations])
+
+    def _apply_last_recommendations(self, intent_data: Dict[str, Any], last_recommendations: Optional[list]) -> None:
+        if intent_data.get('intent') == 'price_inquiry':
+            params = intent_data.setdefault('parameters', {})
+            if not params.get('product_names') and not params.get('product_ids') and last_recommendations:
+                params['product_ids'] = last_recommendations
+
+    def _build_result(self, reply: str, intent_data: Dict[str, Any], recommendations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        recommendation_intents = ['product_recommendation', 'category_exploration', 'comparison', 'price_inquiry']
         filtered_products = []
         if recommendations and intent_data.get('intent') in recommendation_intents:
             reply_lower = reply.lower()
@@ -257,9 +428,9 @@ class CoordinationAgent(Agent):
                 if product_name in reply_lower:
                     filtered_products.append(product)
             
-            print(f"DEBUG: Reply: {reply}")
-            print(f"DEBUG: Original recommendations: {[p['name'] for p in recommendations]}")
-            print(f"DEBUG: Filtered products: {[p['name'] for p in filtered_products]}")
+            logger.debug("Reply: %s", reply)
+            logger.debug("Original recommendations: %s", [p['name'] for p in recommendations])
+            logger.debug("Filtered products: %s", [p['name'] for p in filtered_products])
         
         return {
             'reply': reply,
@@ -271,6 +442,28 @@ class CoordinationAgent(Agent):
     def _generate_response(self, user_question: str, intent_data: Dict[str, Any],
                           recommendations: List[Dict[str, Any]],
                           conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
+        messages = self._build_response_messages(user_question, intent_data, recommendations, conversation_history)
+        
+        result = self.call_openai_api(messages, stage='response_llm')
+        
+        if result:
+            try:
+                content = result['choices'][0]['message']['content'].strip()
+                
+                return {
+                    'reply': content
+                }
+            except KeyError as e:
+                logger.error("Error accessing response content: %s", e)
+                logger.warning("Raw result: %s", result)
+        
+        return {
+            'reply': NO_RESPONSE_REPLY,
+        }
+
+    def _build_response_messages(self, user_question: str, intent_data: Dict[str, Any],
+                                 recommendations: List[Dict[str, Any]],
+                                 conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
         formatted_recommendations = self.recommendation_agent.format_recommendations(recommendations)
         
         messages = [
@@ -302,9 +495,7 @@ class CoordinationAgent(Agent):
             }
         ]
         
-        if conversation_history:
-            for msg in conversation_history:
-                messages.append(msg)
+        messages.extend(history_window(conversation_history, *self.history_budget, current_question=user_question))
         
         intent_info = f"User intent: {intent_data['intent']}\nIntent parameters: {intent_data['parameters']}\n"
         
@@ -326,27 +517,104 @@ class CoordinationAgent(Agent):
             "content": user_question
         })
         
-        result = self.call_openai_api(messages)
-        
-        if result:
+        return messages
+
+class AgentSystem(NamedTuple):
+    recommendation_engine: RecommendationEngine
+    intent_agent: IntentUnderstandingAgent
+    recommendation_agent: RecommendationAgent
+    response_cache: SemanticCache
+    coordination_agent: CoordinationAgent
+
+_agents: Optional[AgentSystem] = None
+_agents_lock = threading.Lock()
+# cold -> loading -> loaded (model, catalog and index in memory) -> warming -> ready; failed is retried.
+_warmup_state: Dict[str, Any] = {'state': 'cold', 'error': None, 'load_seconds': None, 'warmup_seconds': None}
+_warmup_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
+_warmup_thread_lock = threading.Lock()
+
+def _build_agents() -> AgentSystem:
+    recommendation_engine = get_recommendation_engine()
+    intent_agent = IntentUnderstandingAgent(IntentClassifier(recommendation_engine))
+    recommendation_agent = RecommendationAgent(recommendation_engine)
+    response_cache = SemanticCache(
+        int(os.getenv('RESPONSE_CACHE_SIZE', '1024')),
+        float(os.getenv('RESPONSE_CACHE_TTL', '600')) or None,
+        float(os.getenv('RESPONSE_CACHE_THRESHOLD', '0.95'))
+    )
+    # Cached replies quote product names and prices, so drop them when those products change.
+    recommendation_engine.add_catalog_listener(response_cache.invalidate)
+    coordination_agent = CoordinationAgent(intent_agent, recommendation_agent, response_cache)
+    return AgentSystem(recommendation_engine, intent_agent, recommendation_agent, response_cache, coordination_agent)
+
+def get_agents() -> AgentSystem:
+    """The engine and agents, built on first use rather than at import. Concurrent first callers
+    wait for a single build."""
+    global _agents
+    if _agents is None:
+        with _agents_lock:
+            if _agents is None:
+                _warmup_state.update(state='loading', error=None)
+                start = time.time()
+                try:
+                    agents = _build_agents()
+                except Exception as e:
+                    _warmup_state.update(state='failed', error=str(e))
+                    raise
+                _warmup_state.update(state='loaded', load_seconds=time.time() - start)
+                _agents = agents
+    return _agents
+
+def agents_loaded() -> bool:
+    return _agents is not None
+
+def _warm_up(agents: AgentSystem) -> None:
+    # Run the model once and embed the intent examples so the first query doesn't pay for it.
+    start = time.time()
+    _warmup_state['state'] = 'warming'
+    try:
+        agents.recommendation_engine.encode_texts(['warm up'])
+        agents.intent_agent.classifier.warm_up()
+    except Exception as e:
+        _warmup_state.update(state='failed', error=str(e))
+        raise
+    _warmup_state.update(state='ready', warmup_seconds=time.time() - start)
+
+def preload(warm_up: bool = True) -> AgentSystem:
+    """Load the model, catalog and index now, e.g. in a server's master process before it forks
+    workers so they share the weights copy-on-write.
+
+    Pass warm_up=False in that case: inference thread pools don't survive fork, so each worker
+    should run its own warm-up (start_warmup()) after forking.
+    """
+    agents = get_agents()
+    if warm_up:
+        with _warmup_lock:
+            if _warmup_state['state'] != 'ready':
+                _warm_up(agents)
+    return agents
+
+def start_warmup() -> None:
+    """Load and warm up in a background thread, unless already ready or under way."""
+    global _warmup_thread
+    with _warmup_thread_lock:
+        if _warmup_state['state'] == 'ready' or (_warmup_thread is not None and _warmup_thread.is_alive()):
+            return
+
+        def run():
             try:
-                content = result['choices'][0]['message']['content'].strip()
-                
-                return {
-                    'reply': content
-                }
-            except KeyError as e:
-                print(f"Error accessing response content: {e}")
-                print(f"Raw result: {result}")
-        
-        return {
-            'reply': "Sorry, I couldn't generate a proper response. Please try again",
-        }
+                preload()
+            except Exception as e:
+                logger.exception("Warm-up failed: %s", e)
 
-intent_agent = IntentUnderstandingAgent()
-recommendation_engine = get_recommendation_engine()
-recommendation_agent = RecommendationAgent(recommendation_engine)
-coordination_agent = CoordinationAgent(intent_agent, recommendation_agent)
+        _warmup_thread = threading.Thread(target=run, name='agents-warmup', daemon=True)
+        _warmup_thread.start()
+
+def warmup_status() -> Dict[str, Any]:
+    status = dict(_warmup_state)
+    status['ready'] = status['state'] == 'ready'
+    return status
 
 def process_query(user_question: str, conversation_history: Optional[List[Dict[str, str]]] = None, 
                  user_id: Optional[str] = None, last_recommendations: Optional[list]=None) -> Dict[str, Any]:
@@ -354,7 +622,7 @@ def process_query(user_question: str, conversation_history: Optional[List[Dict[s
         if conversation_history is None:
             conversation_history = []
             
-        result = coordination_agent.handle_user_query(user_question, conversation_history, user_id, last_recommendations)
+        result = get_agents().coordination_agent.handle_user_query(user_question, conversation_history, user_id, last_recommendations)
         
         return {
             'reply': result['reply'],
@@ -362,9 +630,26 @@ def process_query(user_question: str, conversation_history: Optional[List[Dict[s
         }
         
     except Exception as e:
-        print(f"Error processing query with multi-agent system: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing query with multi-agent system: %s", e)
         return {
             'reply': "Sorry, an error occurred while processing your request. Please try again later."
-        }
\ No newline at end of file
+        }
+
+def process_query_stream(user_question: str, conversation_history: Optional[List[Dict[str, str]]] = None,
+                         user_id: Optional[str] = None, last_recommendations: Optional[list] = None) -> Iterator[Dict[str, Any]]:
+    try:
+        if conversation_history is None:
+            conversation_history = []
+        
+        for event in get_agents().coordination_agent.handle_user_query_stream(user_question, conversation_history, user_id, last_recommendations):
+            if event['type'] == 'done':
+                yield {'type': 'done', 'reply': event['reply'], 'products': event.get('products', [])}
+            else:
+                yield event
+    
+    except Exception as e:
+        logger.exception("Error processing streamed query with multi-agent system: %s", e)
+        yield {
+            'type': 'error',
+            'reply': "Sorry, an error occurred while processing your request. Please try again later."
+        }
@@ -1,21 +1,96 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
 import json
+import logging
 import os
 import time
 import threading
 from dotenv import load_dotenv
-from agents import process_query
 
 from uuid import uuid4
 
 load_dotenv()
 
+# 日志级别由LOG_LEVEL控制，在导入其他模块之前配置，以便记录它们初始化时的日志
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+from agents import process_query, process_query_stream, get_agents, agents_loaded, start_warmup, warmup_status
+
 app = Flask(__name__)
 
-app.secret_key = str(uuid4())
+# 所有worker必须使用同一个密钥，否则会话cookie在worker之间无法校验
+app.secret_key = os.getenv('FLASK_SECRET_KEY')
+if not app.secret_key:
+    logger.warning("FLASK_SECRET_KEY not set, using a random key; sessions won't survive restarts or span workers")
+    app.secret_key = str(uuid4())
 
 # 导入数据库模块
-from database import create_tables, log_conversation, get_all_conversations, get_conversation_history, delete_conversation
+from database import create_tables, get_all_conversations, get_conversation_history, delete_conversation, get_pool_stats
+from write_behind import enqueue_turn, get_turn_queue
+from recommendation_engine import get_recommendation_engine, recommendation_engine_loaded, normalize_filters
+from history import compact_history
+from session_store import create_session_store, ServerSideSessionInterface
+from metrics import registry, stats_collector, REQUEST_SECONDS
+
+# 会话数据保存在服务端存储中，cookie里只有签名后的会话ID
+session_store = create_session_store()
+app.session_interface = ServerSideSessionInterface(session_store)
+
+# 各组件已有的stats()在抓取/metrics时读取，作为gauge导出；模型尚未加载时不触发加载
+def _cache_stats():
+    if not agents_loaded():
+        return {}
+    agents = get_agents()
+    stats = agents.recommendation_engine.cache_stats()
+    stats.pop('batcher', None)
+    stats['responses'] = agents.response_cache.stats()
+    return stats
+
+def _batcher_stats():
+    if not recommendation_engine_loaded():
+        return {}
+    return get_recommendation_engine().cache_stats().get('batcher', {})
+
+registry.register_collector(stats_collector('chat_cache', 'Cache statistics', _cache_stats, label='cache'))
+registry.register_collector(stats_collector('embedding_batcher', 'Embedding micro-batcher statistics', _batcher_stats))
+registry.register_collector(stats_collector('intent_classifier', 'Local intent classifier statistics',
+                                            lambda: get_agents().intent_agent.classifier.stats() if agents_loaded() else {}))
+registry.register_collector(stats_collector('db_pool', 'MySQL connection pool statistics', get_pool_stats))
+registry.register_collector(stats_collector('write_behind', 'Write-behind queue statistics',
+                                            lambda: get_turn_queue().stats()))
+
+# 以下会话辅助函数接收任意dict形式的会话，供Flask视图和ASGI入口（asgi.py）共用
+def start_turn(session_data, user_question):
+    if 'conversation_history' not in session_data:
+        session_data['conversation_history'] = []
+        session_data['user_id'] = str(uuid4())
+    
+    session_data['conversation_history'].append({
+        'role': 'user',
+        'content': user_question
+    })
+
+def record_assistant_reply(session_data, reply, product_ids):
+    session_data['conversation_history'].append({
+        'role': 'assistant',
+        'content': reply
+    })
+
+    session_data['last_recommendations'] = product_ids
+    
+    # 只保留最近几轮原文，更早的消息折叠进开头的摘要消息
+    session_data['conversation_history'] = compact_history(session_data['conversation_history'])
+
+def save_streamed_reply(session_id, user_id, reply, product_ids):
+    # 开始推流时会话已经保存，回复生成完毕后直接写回服务端存储
+    session_data = session_store.get(session_id)
+    if session_data is not None and session_data.get('user_id') == user_id:
+        record_assistant_reply(session_data, reply, product_ids)
+        session_store.set(session_id, session_data)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @app.route('/')
 def index():
@@ -32,37 +107,20 @@ def chat():
         if not user_question:
             return jsonify({'reply': 'Please enter your question'})
         
-        if 'conversation_history' not in session:
-            session['conversation_history'] = []
-            session['user_id'] = str(uuid4())
-        
-        session['conversation_history'].append({
-            'role': 'user',
-            'content': user_question
-        })
+        start_turn(session, user_question)
 
         result = process_query(user_question, session['conversation_history'], session['user_id'], session.get('last_recommendations'))
 
-        session['conversation_history'].append({
-            'role': 'assistant',
-            'content': result['reply']
-        })
-
-        # 记录对话到数据库
-        log_conversation(session['user_id'], 'user', user_question, session['user_id'])
-        
-        # 保存推荐商品信息
+        # 本轮对话及推荐商品信息交给后台线程批量写库，不阻塞响应
         products = result.get('products', [])
-        log_conversation(session['user_id'], 'assistant', result['reply'], session['user_id'], products)
+        enqueue_turn(session['user_id'], user_question, result['reply'], session['user_id'], products)
 
-        session['last_recommendations'] = [p['id'] for p in products]
-        
-        if len(session['conversation_history']) > 40:
-            session['conversation_history'] = session['conversation_history'][-40:]
+        record_assistant_reply(session, result['reply'], [p['id'] for p in products])
         
         response_time = time.time() - start_time
 
         success = result['reply'] != "Sorry, an error occurred while processing your request. Please try again later."
+        REQUEST_SECONDS.observe(response_time, endpoint='chat', outcome='success' if success else 'error')
         
         return jsonify({
             'reply': result['reply'],
@@ -71,18 +129,73 @@ def chat():
         })
         
     except Exception as e:
-        print(f"API error: {e}")
+        logger.error("API error: %s", e)
+        REQUEST_SECONDS.observe(time.time() - start_time, endpoint='chat', outcome='error')
         return jsonify({'reply': 'Sorry, an error occurred while processing your request. Please try again later.'})
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    user_question = data.get('question', '') or data.get('query', '') or data.get('user_question', '')
+    
+    if not user_question:
+        return jsonify({'reply': 'Please enter your question'})
+    
+    start_turn(session, user_question)
+    session.modified = True
+
+    session_id = session.sid
+    user_id = session['user_id']
+    conversation_history = list(session['conversation_history'])
+    last_recommendations = session.get('last_recommendations')
+
+    start_time = time.time()
+
+    def generate():
+        # 客户端中途断开时记为cancelled
+        outcome = 'cancelled'
+        try:
+            for event in process_query_stream(user_question, conversation_history, user_id, last_recommendations):
+                if event['type'] == 'token':
+                    yield sse_event('token', {'text': event['text']})
+                elif event['type'] == 'error':
+                    outcome = 'error'
+                    yield sse_event('error', {'reply': event['reply']})
+                else:
+                    products = event.get('products', [])
+                    enqueue_turn(user_id, user_question, event['reply'], user_id, products)
+                    save_streamed_reply(session_id, user_id, event['reply'], [p['id'] for p in products])
+                    outcome = 'success'
+                    yield sse_event('done', {
+                        'reply': event['reply'],
+                        'conversation_id': user_id,
+                        'products': products
+                    })
+        finally:
+            REQUEST_SECONDS.observe(time.time() - start_time, endpoint='chat_stream', outcome=outcome)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
-    conversations = get_all_conversations()
-    return jsonify(conversations)
+    conversations, next_cursor = get_all_conversations(
+        user_id=request.args.get('user_id'),
+        limit=request.args.get('limit'),
+        cursor_token=request.args.get('cursor')
+    )
+    return jsonify({'conversations': conversations, 'next_cursor': next_cursor})
 
 @app.route('/api/conversations/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
-    history = get_conversation_history(conversation_id)
-    return jsonify(history)
+    messages, next_cursor = get_conversation_history(
+        conversation_id,
+        limit=request.args.get('limit'),
+        cursor_token=request.args.get('cursor')
+    )
+    return jsonify({'messages': messages, 'next_cursor': next_cursor})
 
 @app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
 def delete_conversation_api(conversation_id):
@@ -92,6 +205,127 @@ def delete_conversation_api(conversation_id):
     else:
         return jsonify({'error': 'Failed to delete conversation'}), 500
 
+@app.route('/api/db/pool', methods=['GET'])
+def get_db_pool_stats():
+    return jsonify(get_pool_stats())
+
+@app.route('/api/db/write-behind', methods=['GET'])
+def get_write_behind_stats():
+    return jsonify(get_turn_queue().stats())
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    # 就绪探针：模型、商品目录和索引加载并预热完成前返回503，同时在后台开始预热
+    status = warmup_status()
+    if not status['ready']:
+        start_warmup()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus文本格式；每个worker进程各自计数
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# 统计接口同样不触发模型加载，加载完成前返回空对象
+@app.route('/api/intent/stats', methods=['GET'])
+def get_intent_stats():
+    if not agents_loaded():
+        return jsonify({})
+    return jsonify(get_agents().intent_agent.classifier.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    if not agents_loaded():
+        return jsonify({})
+    agents = get_agents()
+    stats = agents.recommendation_engine.cache_stats()
+    stats['responses'] = agents.response_cache.stats()
+    return jsonify(stats)
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+def recommend_batch():
+    data = request.get_json() or {}
+    product_ids = data.get('product_ids')
+    queries = data.get('queries')
+    items = product_ids if product_ids is not None else queries
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Provide a non-empty product_ids or queries list'}), 400
+
+    max_items = int(os.getenv('RECOMMENDATION_BATCH_MAX', '10000'))
+    if len(items) > max_items:
+        return jsonify({'error': f'At most {max_items} items per request'}), 400
+    try:
+        top_k = min(max(int(data.get('top_k', 5)), 1), 100)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k must be an integer'}), 400
+
+    filters = data.get('filters')
+    if filters is not None and not isinstance(filters, dict):
+        return jsonify({'error': 'filters must be an object'}), 400
+    # 按商品ID取的是预计算的相似商品，不支持过滤；拒绝而不是悄悄忽略
+    if product_ids is not None and filters:
+        return jsonify({'error': 'filters are only supported with queries'}), 400
+    try:
+        filters = normalize_filters(filters)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid filters: {e}'}), 400
+
+    if product_ids is not None:
+        # 与get_products_by_ids一致，接受"12"这样的字符串ID
+        try:
+            if any(isinstance(item, bool) for item in product_ids):
+                raise TypeError('bool')
+            product_ids = [int(item) for item in product_ids]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'product_ids must be integers'}), 400
+
+    engine = get_recommendation_engine()
+    if product_ids is not None:
+        batches = engine.recommend_products_batch(product_ids, top_k)
+    else:
+        batches = engine.recommend_by_texts([str(q) for q in queries], top_k, filters)
+
+    # 默认只返回商品ID和相似度，整批预计算时响应体更小
+    include_products = bool(data.get('include_products'))
+    results = []
+    for item, recommendations in zip(items, batches):
+        entry = {'product_id' if product_ids is not None else 'query': item}
+        if recommendations is None:
+            entry['error'] = 'Product not found'
+        else:
+            entry['recommendations'] = [
+                dict({'id': r['product']['id'], 'similarity': float(r['similarity'])},
+                     **({'product': r['product']} if include_products else {}))
+                for r in recommendations
+            ]
+        results.append(entry)
+    return jsonify({'results': results})
+
+@app.route('/api/admin/catalog', methods=['POST'])
+def update_catalog():
+    admin_token = os.getenv('ADMIN_TOKEN')
+    if not admin_token or request.headers.get('X-Admin-Token') != admin_token:
+        return jsonify({'error': 'Forbidden'}), 403
+
+    data = request.get_json() or {}
+    engine = get_recommendation_engine()
+    try:
+        if data.get('reload'):
+            # 重新读取products.json，只对变化的商品重新编码
+            summary = engine.reload_catalog()
+        else:
+            summary = {'added': 0, 'updated': 0, 'removed': 0}
+            if data.get('remove'):
+                summary.update(engine.remove_products(data['remove']))
+            if data.get('upsert'):
+                summary.update(engine.upsert_products(data['upsert']))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid catalog update: {e}'}), 400
+
+    summary['total'] = len(engine.products)
+    summary['version'] = engine.version
+    return jsonify(summary)
+
 if __name__ == '__main__':
     if not os.path.exists('data'):
         os.makedirs('data')
@@ -0,0 +1,144 @@
+"""ASGI entry point: the chat endpoints run on the async agent pipeline, everything else is
+served by the Flask app through a WSGI adapter.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 3000
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, session_store, start_turn, record_assistant_reply, save_streamed_reply, sse_event
+from agents import start_warmup
+from async_agents import process_query_async, process_query_stream_async
+from metrics import REQUEST_SECONDS
+from write_behind import enqueue_turn
+
+logger = logging.getLogger(__name__)
+
+ERROR_REPLY = 'Sorry, an error occurred while processing your request. Please try again later.'
+
+async def run_blocking(fn, *args):
+    # 会话存储（sqlite/redis）的读写、写后队列满时的落盘都是同步IO，放到线程池执行，不阻塞事件循环
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+# 复用Flask的服务端会话存储和会话cookie，两个入口之间的会话互通
+async def load_session(request: Request):
+    session_interface = flask_app.session_interface
+    session_id = session_interface.sid_from_cookie(flask_app, request.cookies.get(flask_app.config['SESSION_COOKIE_NAME']))
+    session_data = await run_blocking(session_store.get, session_id) if session_id else None
+    if session_data is None:
+        return session_interface.new_sid(), {}
+    return session_id, session_data
+
+async def save_session(response, session_id: str, session_data: dict) -> None:
+    await run_blocking(session_store.set, session_id, session_data)
+    response.set_cookie(
+        flask_app.config['SESSION_COOKIE_NAME'],
+        flask_app.session_interface.cookie_value(flask_app, session_id),
+        path=flask_app.config['SESSION_COOKIE_PATH'] or '/',
+        httponly=flask_app.config['SESSION_COOKIE_HTTPONLY'],
+        secure=flask_app.config['SESSION_COOKIE_SECURE'],
+        samesite=flask_app.config['SESSION_COOKIE_SAMESITE']
+    )
+
+async def read_question(request: Request) -> str:
+    try:
+        data = await request.json()
+    except ValueError:
+        return ''
+    if not isinstance(data, dict):
+        return ''
+    return data.get('question', '') or data.get('query', '') or data.get('user_question', '')
+
+async def chat(request: Request):
+    start_time = time.time()
+    try:
+        user_question = await read_question(request)
+        if not user_question:
+            return JSONResponse({'reply': 'Please enter your question'})
+
+        session_id, session_data = await load_session(request)
+        start_turn(session_data, user_question)
+
+        result = await process_query_async(user_question, session_data['conversation_history'],
+                                           session_data['user_id'], session_data.get('last_recommendations'))
+
+        products = result.get('products', [])
+        await run_blocking(enqueue_turn, session_data['user_id'], user_question, result['reply'],
+                           session_data['user_id'], products)
+        record_assistant_reply(session_data, result['reply'], [p['id'] for p in products])
+
+        response = JSONResponse({
+            'reply': result['reply'],
+            'conversation_id': session_data['user_id'],
+            'products': products
+        })
+        await save_session(response, session_id, session_data)
+        REQUEST_SECONDS.observe(time.time() - start_time, endpoint='chat',
+                                outcome='error' if result['reply'] == ERROR_REPLY else 'success')
+        return response
+
+    except Exception as e:
+        logger.error("API error: %s", e)
+        REQUEST_SECONDS.observe(time.time() - start_time, endpoint='chat', outcome='error')
+        return JSONResponse({'reply': ERROR_REPLY})
+
+async def chat_stream(request: Request):
+    user_question = await read_question(request)
+    if not user_question:
+        return JSONResponse({'reply': 'Please enter your question'})
+
+    session_id, session_data = await load_session(request)
+    start_turn(session_data, user_question)
+    user_id = session_data['user_id']
+    conversation_history = list(session_data['conversation_history'])
+    last_recommendations = session_data.get('last_recommendations')
+
+    start_time = time.time()
+
+    async def generate():
+        outcome = 'cancelled'
+        try:
+            async for event in process_query_stream_async(user_question, conversation_history, user_id, last_recommendations):
+                if event['type'] == 'token':
+                    yield sse_event('token', {'text': event['text']})
+                elif event['type'] == 'error':
+                    outcome = 'error'
+                    yield sse_event('error', {'reply': event['reply']})
+                else:
+                    products = event.get('products', [])
+                    await run_blocking(enqueue_turn, user_id, user_question, event['reply'], user_id, products)
+                    await run_blocking(save_streamed_reply, session_id, user_id, event['reply'],
+                                       [p['id'] for p in products])
+                    outcome = 'success'
+                    yield sse_event('done', {
+                        'reply': event['reply'],
+                        'conversation_id': user_id,
+                        'products': products
+                    })
+        finally:
+            REQUEST_SECONDS.observe(time.time() - start_time, endpoint='chat_stream', outcome=outcome)
+
+    response = StreamingResponse(generate(), media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    await save_session(response, session_id, session_data)
+    return response
+
+@asynccontextmanager
+async def lifespan(app):
+    # 启动时在后台加载并预热模型，/api/ready无需等到第一个请求
+    start_warmup()
+    yield
+
+application = Starlette(routes=[
+    Route('/api/chat', chat, methods=['POST']),
+    Route('/api/chat/stream', chat_stream, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app))
+], lifespan=lifespan)
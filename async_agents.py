@@ -0,0 +1,247 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+from agents import Agent, IntentUnderstandingAgent, CoordinationAgent, NO_RESPONSE_REPLY, get_agents
+from llm_client import get_async_llm_client
+from metrics import span, record_usage, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class AsyncAgent(Agent):
+    async def call_openai_api(self, messages: List[Dict[str, str]], model: str = None, temperature: float = 0.7, max_tokens: int = 500,
+                              stream: bool = False, stage: str = 'llm') -> Optional[Any]:
+        if not self.api_key or not self.api_base:
+            raise ValueError("API key or base URL not configured")
+
+        if model is None:
+            model = self.model
+
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+
+        try:
+            client = get_async_llm_client(self.api_base, self.api_key)
+            if stream:
+                # Returns an async iterator of content deltas instead of the full completion.
+                if self.stream_usage:
+                    data["stream_options"] = {"include_usage": True}
+                return self._timed_stream(client.stream_chat_completion(data, lambda usage: record_usage(stage, usage)), stage)
+            with span(stage):
+                result = await client.chat_completion(data)
+            if result:
+                record_usage(stage, result.get('usage'))
+            return result
+
+        except Exception as e:
+            logger.error("Error calling OpenAI API: %s", e)
+            return None
+
+    async def _timed_stream(self, tokens: AsyncIterator[str], stage: str) -> AsyncIterator[str]:
+        start = time.perf_counter()
+        first = True
+        try:
+            async for token in tokens:
+                if first:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage=f"{stage}_first_token")
+                    first = False
+                yield token
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+class AsyncIntentUnderstandingAgent(AsyncAgent, IntentUnderstandingAgent):
+    async def analyze_intent(self, user_question: str, conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
+        if self.classifier is not None:
+            # The embedding tier can block on the encoder, so keep it off the event loop.
+            with span('intent_local'):
+                intent_data = await asyncio.get_running_loop().run_in_executor(
+                    None, self.classifier.classify, user_question, conversation_history)
+            if intent_data is not None:
+                return intent_data
+
+        messages = self._build_intent_messages(user_question, conversation_history)
+
+        result = await self.call_openai_api(messages, stage='intent_llm')
+
+        return self._parse_intent_result(result)
+
+class AsyncCoordinationAgent(AsyncAgent, CoordinationAgent):
+    """Same pipeline as CoordinationAgent, but the LLM round trips are awaited instead of holding a
+    thread, and the CPU-bound embedding search runs in the default thread pool executor."""
+    async def handle_user_query(self, user_question: str,
+                                conversation_history: List[Dict[str, str]],
+                                user_id: Optional[str] = None,
+                                last_recommendations: Optional[list] = None) -> Dict[str, Any]:
+        intent_data, recommendations = await self._prepare_turn(user_question, conversation_history, last_recommendations)
+
+        cache_entry = await self._response_cache_entry_async(user_question, intent_data, recommendations, conversation_history)
+        reply = self.response_cache.get(*cache_entry) if cache_entry else None
+        if reply is None:
+            response_data = await self._generate_response(user_question, intent_data, recommendations, conversation_history)
+            reply = response_data.get('reply', 'Sorry, I couldn\'t process your request.')
+            self._store_response(cache_entry, reply, recommendations)
+
+        return self._build_result(reply, intent_data, recommendations)
+
+    async def handle_user_query_stream(self, user_question: str,
+                                       conversation_history: List[Dict[str, str]],
+                                       user_id: Optional[str] = None,
+                                       last_recommendations: Optional[list] = None) -> AsyncIterator[Dict[str, Any]]:
+        intent_data, recommendations = await self._prepare_turn(user_question, conversation_history, last_recommendations)
+
+        cache_entry = await self._response_cache_entry_async(user_question, intent_data, recommendations, conversation_history)
+        reply = self.response_cache.get(*cache_entry) if cache_entry else None
+        if reply is not None:
+            yield {'type': 'token', 'text': reply}
+        else:
+            messages = self._build_response_messages(user_question, intent_data, recommendations, conversation_history)
+
+            chunks = []
+            tokens = await self.call_openai_api(messages, stream=True, stage='response_llm')
+            if tokens is not None:
+                async for token in tokens:
+                    chunks.append(token)
+                    yield {'type': 'token', 'text': token}
+
+            reply = ''.join(chunks).strip()
+            if not reply:
+                reply = NO_RESPONSE_REPLY
+                yield {'type': 'token', 'text': reply}
+            self._store_response(cache_entry, reply, recommendations)
+
+        yield {'type': 'done', **self._build_result(reply, intent_data, recommendations)}
+
+    @staticmethod
+    def _discard(future: asyncio.Future) -> None:
+        """Drop a speculative result without waiting; its exception is retrieved so it isn't reported as unhandled."""
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        future.cancel()
+
+    async def _prepare_turn(self, user_question: str, conversation_history: List[Dict[str, str]],
+                            last_recommendations: Optional[list] = None):
+        loop = asyncio.get_running_loop()
+        # Start the vector search speculatively so it overlaps the intent LLM round trip.
+        prefetch = loop.run_in_executor(None, self.recommendation_agent.prefetch_recommendations, user_question)
+
+        intent_data = await self.intent_agent.analyze_intent(user_question, conversation_history)
+        logger.debug("Intent data: %s", intent_data)
+
+        self._apply_last_recommendations(intent_data, last_recommendations)
+
+        recommendation_intents = ['product_recommendation', 'category_exploration', 'comparison', 'price_inquiry']
+        if intent_data.get('intent') in recommendation_intents:
+            prefetched = None
+            if self.recommendation_agent.uses_prefetch(intent_data, last_recommendations):
+                try:
+                    prefetched = await prefetch
+                except Exception as e:
+                    logger.warning("Speculative retrieval failed, retrying inline: %s", e)
+            else:
+                self._discard(prefetch)
+            recommendations = await loop.run_in_executor(None, functools.partial(
+                self.recommendation_agent.get_recommendations,
+                user_question, intent_data, conversation_history, last_recommendations, prefetched
+            ))
+        else:
+            self._discard(prefetch)
+            recommendations = []
+
+        return intent_data, recommendations
+
+    async def _response_cache_entry_async(self, user_question: str, intent_data: Dict[str, Any],
+                                          recommendations: List[Dict[str, Any]],
+                                          conversation_history: List[Dict[str, str]]) -> Optional[tuple]:
+        # Embedding the query may block on the encoder.
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+            self._response_cache_entry, user_question, intent_data, recommendations, conversation_history
+        ))
+
+    async def _generate_response(self, user_question: str, intent_data: Dict[str, Any],
+                                 recommendations: List[Dict[str, Any]],
+                                 conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
+        messages = self._build_response_messages(user_question, intent_data, recommendations, conversation_history)
+
+        result = await self.call_openai_api(messages, stage='response_llm')
+
+        if result:
+            try:
+                content = result['choices'][0]['message']['content'].strip()
+
+                return {
+                    'reply': content
+                }
+            except KeyError as e:
+                logger.error("Error accessing response content: %s", e)
+                logger.warning("Raw result: %s", result)
+
+        return {
+            'reply': NO_RESPONSE_REPLY,
+        }
+
+_async_coordination_agent: Optional[AsyncCoordinationAgent] = None
+_async_agents_lock = threading.Lock()
+
+def get_async_coordination_agent() -> AsyncCoordinationAgent:
+    """Async counterparts of the shared agents, sharing their engine, classifier and caches; built on first use."""
+    global _async_coordination_agent
+    if _async_coordination_agent is None:
+        with _async_agents_lock:
+            if _async_coordination_agent is None:
+                agents = get_agents()
+                async_intent_agent = AsyncIntentUnderstandingAgent(agents.intent_agent.classifier)
+                _async_coordination_agent = AsyncCoordinationAgent(async_intent_agent, agents.recommendation_agent,
+                                                                   agents.response_cache)
+    return _async_coordination_agent
+
+async def _coordination_agent() -> AsyncCoordinationAgent:
+    if _async_coordination_agent is not None:
+        return _async_coordination_agent
+    # The first call loads the model and catalog; keep that off the event loop.
+    return await asyncio.get_running_loop().run_in_executor(None, get_async_coordination_agent)
+
+async def process_query_async(user_question: str, conversation_history: Optional[List[Dict[str, str]]] = None,
+                              user_id: Optional[str] = None, last_recommendations: Optional[list] = None) -> Dict[str, Any]:
+    try:
+        if conversation_history is None:
+            conversation_history = []
+
+        coordination_agent = await _coordination_agent()
+        result = await coordination_agent.handle_user_query(user_question, conversation_history, user_id, last_recommendations)
+
+        return {
+            'reply': result['reply'],
+            'products': result.get('products', [])
+        }
+
+    except Exception as e:
+        logger.exception("Error processing query with multi-agent system: %s", e)
+        return {
+            'reply': "Sorry, an error occurred while processing your request. Please try again later."
+        }
+
+async def process_query_stream_async(user_question: str, conversation_history: Optional[List[Dict[str, str]]] = None,
+                                     user_id: Optional[str] = None, last_recommendations: Optional[list] = None) -> AsyncIterator[Dict[str, Any]]:
+    try:
+        if conversation_history is None:
+            conversation_history = []
+
+        coordination_agent = await _coordination_agent()
+        async for event in coordination_agent.handle_user_query_stream(user_question, conversation_history, user_id, last_recommendations):
+            if event['type'] == 'done':
+                yield {'type': 'done', 'reply': event['reply'], 'products': event.get('products', [])}
+            else:
+                yield event
+
+    except Exception as e:
+        logger.exception("Error processing streamed query with multi-agent system: %s", e)
+        yield {
+            'type': 'error',
+            'reply': "Sorry, an error occurred while processing your request. Please try again later."
+        }
@@ -0,0 +1,104 @@
+"""Recall vs. latency of the approximate index backends against the exact flat index.
+
+Examples:
+    python -m benchmarks.ann_benchmark --synthetic 200000
+    python -m benchmarks.ann_benchmark --catalog --types ivf,hnsw --nprobe 1,8,32
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recommendation_engine import build_faiss_index, set_search_params
+
+def load_vectors(args):
+    if args.catalog:
+        from recommendation_engine import RecommendationEngine
+        engine = RecommendationEngine(index_type='flat')
+        return np.asarray(engine.vectors, dtype='float32')
+    rng = np.random.default_rng(args.seed)
+    # Clustered data is closer to real embeddings than uniform noise.
+    centers = rng.normal(size=(max(1, args.synthetic // 500), args.dimension)).astype('float32')
+    assignments = rng.integers(0, len(centers), size=args.synthetic)
+    vectors = centers[assignments] + 0.3 * rng.normal(size=(args.synthetic, args.dimension)).astype('float32')
+    return vectors.astype('float32')
+
+def make_queries(vectors, count, seed):
+    rng = np.random.default_rng(seed + 1)
+    rows = rng.integers(0, len(vectors), size=count)
+    noise = 0.05 * rng.normal(size=(count, vectors.shape[1])).astype('float32')
+    return (vectors[rows] + noise).astype('float32')
+
+def timed_search(index, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies) * 1000
+
+def recall_at_k(results, truth):
+    hits = sum(len(set(r) & set(t)) for r, t in zip(results, truth))
+    return hits / truth.size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--catalog', action='store_true', help='use the embedded products.json catalog')
+    parser.add_argument('--synthetic', type=int, default=100000, help='number of synthetic vectors')
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--types', default='ivf,ivfpq,hnsw')
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--pq-m', type=int, default=16)
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--ef-construction', type=int, default=200)
+    parser.add_argument('--nprobe', default='1,4,16,64')
+    parser.add_argument('--ef-search', default='16,32,64,128')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    ids = np.arange(len(vectors), dtype='int64')
+    queries = make_queries(vectors, args.queries, args.seed)
+    k = min(args.k, len(vectors))
+    print(f"{len(vectors)} vectors, dimension {vectors.shape[1]}, {len(queries)} queries, k={k}")
+
+    start = time.perf_counter()
+    flat = build_faiss_index(vectors, ids, 'flat')
+    flat_build = time.perf_counter() - start
+    truth, flat_latency = timed_search(flat, queries, k)
+
+    header = f"{'index':<8} {'knob':<14} {'build s':>8} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'qps':>9}"
+    print(header)
+    print('-' * len(header))
+
+    def report(name, knob, build_seconds, results, latency):
+        print(f"{name:<8} {knob:<14} {build_seconds:>8.2f} {recall_at_k(results, truth):>7.3f} "
+              f"{np.percentile(latency, 50):>8.3f} {np.percentile(latency, 99):>8.3f} "
+              f"{1000 / latency.mean():>9.0f}")
+
+    report('flat', '-', flat_build, truth, flat_latency)
+
+    for index_type in [t.strip() for t in args.types.split(',') if t.strip()]:
+        start = time.perf_counter()
+        index = build_faiss_index(vectors, ids, index_type, nlist=args.nlist, pq_m=args.pq_m,
+                                  hnsw_m=args.hnsw_m, ef_construction=args.ef_construction)
+        build_seconds = time.perf_counter() - start
+
+        if index_type == 'hnsw':
+            knobs = [('ef_search', int(v)) for v in args.ef_search.split(',')]
+        else:
+            knobs = [('nprobe', int(v)) for v in args.nprobe.split(',')]
+        for name, value in knobs:
+            set_search_params(index, **{name: value})
+            results, latency = timed_search(index, queries, k)
+            report(index_type, f"{name}={value}", build_seconds, results, latency)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""Latency percentiles and throughput for the chat API, text search, index builds and history reads.
+
+Runs self-contained: the LLM is a local stub (benchmarks/stub_llm.py), MySQL is replaced by SQLite
+(benchmarks/sqlite_db.py) and the catalog is synthetic (benchmarks/synthetic_catalog.py).
+
+Examples:
+    python -m benchmarks.load_benchmark --scenarios build --sizes 1000,10000,100000
+    python -m benchmarks.load_benchmark --scenarios chat,search --catalog-size 10000 --concurrency 16
+    python -m benchmarks.load_benchmark --scenarios chat --stream --llm-latency-ms 400 --llm-token-delay-ms 20
+    python -m benchmarks.load_benchmark --scenarios chat --url http://localhost:3000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic_catalog import ADJECTIVES, FEATURES, NOUNS, write_catalog
+
+SCENARIOS = ('build', 'search', 'history', 'chat')
+
+def make_queries(count, seed):
+    rng = random.Random(seed)
+    templates = [
+        'recommend a {adjective} {noun}',
+        'I need {article} {noun} with {feature}',
+        'looking for a {adjective} {noun} under ${price}',
+        'what {noun} would you suggest for {feature}'
+    ]
+    queries = []
+    for _ in range(count):
+        category = rng.choice(list(NOUNS))
+        noun = rng.choice(NOUNS[category]).lower()
+        queries.append(rng.choice(templates).format(
+            adjective=rng.choice(ADJECTIVES).lower(), noun=noun, feature=rng.choice(FEATURES),
+            price=rng.choice([50, 100, 200, 500, 1000]), article='an' if noun[0] in 'aeiou' else 'a'))
+    return queries
+
+def measure(fn, items, concurrency, warmup=0):
+    """Call fn on every item from concurrency threads; returns per-call latencies, errors and wall time.
+
+    fn signals failure by raising or returning False. The first warmup items run sequentially and
+    are not measured.
+    """
+    items = list(items)
+    for item in items[:warmup]:
+        fn(item)
+    items = items[warmup:]
+
+    def call(item):
+        start = time.perf_counter()
+        try:
+            ok = fn(item) is not False
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, items))
+    wall = time.perf_counter() - start
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    errors = sum(1 for _, ok in results if not ok)
+    return latencies, errors, wall
+
+class Report:
+    def __init__(self):
+        self.rows = []
+        header = (f"{'scenario':<24} {'n':>7} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+                  f"{'p99 ms':>9} {'max ms':>9} {'req/s':>9}")
+        print(header)
+        print('-' * len(header))
+
+    def add(self, name, latencies, errors, wall):
+        row = {
+            'scenario': name,
+            'requests': int(len(latencies)),
+            'errors': int(errors),
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            'max_ms': float(latencies.max()) if len(latencies) else 0.0,
+            'throughput': len(latencies) / wall if wall > 0 else 0.0
+        }
+        self.rows.append(row)
+        print(f"{name:<24} {row['requests']:>7} {row['errors']:>6} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+              f"{row['p99_ms']:>9.2f} {row['max_ms']:>9.2f} {row['throughput']:>9.1f}")
+
+def configure_environment(args, workdir):
+    """Point the app at the stub LLM, a synthetic catalog and local stores. Must run before the
+    application modules are imported, since they read their settings at import time."""
+    from benchmarks.stub_llm import start_stub_llm
+    catalog_path = write_catalog(os.path.join(workdir, f'products_{args.catalog_size}.json'),
+                                 args.catalog_size, args.seed)
+    _, llm_base = start_stub_llm(latency=args.llm_latency_ms / 1000, token_delay=args.llm_token_delay_ms / 1000)
+    os.environ.update({
+        'OPENAI_API_BASE': llm_base,
+        'OPENAI_API_KEY': 'benchmark',
+        'MODEL': 'benchmark-stub',
+        'PRODUCTS_PATH': catalog_path,
+        'RECOMMENDATION_CACHE_DIR': os.path.join(workdir, 'index'),
+        'RECOMMENDATION_INDEX': args.index_type,
+        'SESSION_BACKEND': 'memory',
+        'FLASK_SECRET_KEY': 'benchmark',
+        'WRITE_BEHIND_SPILL_DIR': os.path.join(workdir, 'spill')
+    })
+    from benchmarks import sqlite_db
+    sqlite_db.install(os.path.join(workdir, 'conversations.db'))
+
+def run_build(args, report, workdir):
+    """Cold build (encode, index, neighbour table) and warm load from the saved artifacts, per size."""
+    from recommendation_engine import RecommendationEngine
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        catalog_path = write_catalog(os.path.join(workdir, f'build_{size}.json'), size, args.seed)
+        cache_dir = os.path.join(workdir, f'build_index_{size}')
+        for phase in ('cold', 'warm'):
+            start = time.perf_counter()
+            engine = RecommendationEngine(product_path=catalog_path, cache_dir=cache_dir, index_type=args.index_type)
+            elapsed = time.perf_counter() - start
+            report.add(f"build {phase} {size}", np.array([elapsed * 1000]), 0, elapsed)
+            del engine
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.remove(catalog_path)
+
+def run_search(args, report):
+    from recommendation_engine import get_recommendation_engine
+    engine = get_recommendation_engine()
+    queries = make_queries(args.requests + args.warmup, args.seed)
+    report.add('recommend_by_text', *measure(lambda q: engine.recommend_by_text(q, 5), queries,
+                                             args.concurrency, args.warmup))
+    # The same queries again are answered by the embedding and result caches.
+    report.add('recommend_by_text cached', *measure(lambda q: engine.recommend_by_text(q, 5),
+                                                    queries[args.warmup:], args.concurrency))
+    filters = {'price_max': 200, 'categories': ['Shoes', 'Accessories']}
+    report.add('recommend_by_text filter', *measure(lambda q: engine.recommend_by_text(q, 5, filters),
+                                                    queries, args.concurrency, args.warmup))
+
+def seed_history(args):
+    """Write args.turns turns per conversation, a minute apart, and check one reads back in order."""
+    from database import get_conversation_history, log_turns
+    rng = random.Random(args.seed)
+    conversation_ids = [f'bench-{i:06d}' for i in range(args.conversations)]
+    start_time = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+    turns = []
+    for n, conversation_id in enumerate(conversation_ids):
+        for i, query in enumerate(make_queries(args.turns, rng.random())):
+            turns.append({
+                'created_at': (start_time - datetime.timedelta(minutes=args.turns - i, seconds=n)).isoformat(),
+                'seq': len(turns),
+                'user_id': conversation_id,
+                'conversation_id': conversation_id,
+                'user_content': query,
+                'assistant_content': f'Turn {i}: ' + 'Here are a few products you might like. ' * rng.randint(1, 6),
+                'products': [{'id': rng.randint(1, args.catalog_size)} for _ in range(3)]
+            })
+    for start in range(0, len(turns), 200):
+        if not log_turns(turns[start:start + 200]):
+            raise RuntimeError('Seeding conversation history failed')
+
+    expected = [(turn['user_content'], turn['assistant_content']) for turn in turns
+                if turn['conversation_id'] == conversation_ids[0]]
+    messages, _ = get_conversation_history(conversation_ids[0], limit=2 * args.turns)
+    contents = [message['content'] for message in messages]
+    if list(zip(contents[::2], contents[1::2])) != expected:
+        raise RuntimeError(f'Seeded conversation {conversation_ids[0]} reads back out of order')
+    return conversation_ids
+
+def run_history(args, report):
+    from database import get_all_conversations, get_conversation_history
+    conversation_ids = seed_history(args)
+    rng = random.Random(args.seed)
+    sample = [rng.choice(conversation_ids) for _ in range(args.requests + args.warmup)]
+
+    def read_history(conversation_id):
+        messages, _ = get_conversation_history(conversation_id, limit=50)
+        return bool(messages)
+
+    def list_page(_):
+        conversations, _ = get_all_conversations(limit=50)
+        return bool(conversations)
+
+    report.add('history read', *measure(read_history, sample, args.concurrency, args.warmup))
+    report.add('conversation list', *measure(list_page, sample, args.concurrency, args.warmup))
+
+def chat_client(args):
+    """A per-thread callable posting one question; each thread keeps its own session cookie."""
+    local = threading.local()
+    path = '/api/chat/stream' if args.stream else '/api/chat'
+    if args.url:
+        import requests
+
+        def post(question):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            response = local.session.post(args.url.rstrip('/') + path, json={'question': question},
+                                          timeout=60, stream=args.stream)
+            body = response.content.decode('utf-8')
+            return response.ok and ('event: done' in body if args.stream else 'reply' in body)
+        return post
+
+    from app import app
+    def post(question):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        response = local.client.post(path, json={'question': question})
+        body = response.get_data(as_text=True)
+        return response.status_code == 200 and ('event: done' in body if args.stream else 'reply' in body)
+    return post
+
+def run_chat(args, report):
+    post = chat_client(args)
+    queries = make_queries(args.requests + args.warmup, args.seed + 1)
+    name = 'chat stream' if args.stream else 'chat'
+    report.add(name if not args.url else f"{name} (remote)", *measure(post, queries, args.concurrency, args.warmup))
+    if not args.url:
+        from write_behind import get_turn_queue
+        get_turn_queue().stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default='build,search,history,chat', help=f"subset of {','.join(SCENARIOS)}")
+    parser.add_argument('--sizes', default='1000,10000', help='catalog sizes for the build scenario')
+    parser.add_argument('--catalog-size', type=int, default=10000, help='catalog size for the other scenarios')
+    parser.add_argument('--index-type', default='flat')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--conversations', type=int, default=1000, help='conversations seeded for history reads')
+    parser.add_argument('--turns', type=int, default=10, help='turns per seeded conversation')
+    parser.add_argument('--stream', action='store_true', help='use /api/chat/stream for the chat scenario')
+    parser.add_argument('--url', help='benchmark a running server instead of the in-process app (chat only)')
+    parser.add_argument('--llm-latency-ms', type=float, default=200.0, help='stub LLM delay before the first byte')
+    parser.add_argument('--llm-token-delay-ms', type=float, default=10.0, help='stub LLM delay per word')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='where catalogs, indexes and the SQLite file go (default: a temp dir)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='agent-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    print(f"catalog {args.catalog_size}, index {args.index_type}, concurrency {args.concurrency}, "
+          f"stub LLM {args.llm_latency_ms:.0f} ms + {args.llm_token_delay_ms:.0f} ms/word, workdir {workdir}")
+    configure_environment(args, workdir)
+
+    report = Report()
+    runners = {
+        'build': lambda: run_build(args, report, workdir),
+        'search': lambda: run_search(args, report),
+        'history': lambda: run_history(args, report),
+        'chat': lambda: run_chat(args, report)
+    }
+    for scenario in scenarios:
+        runners[scenario]()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'results': report.rows}, f, indent=2)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""SQLite stand-in for the MySQL connection pool in database.py, for benchmarks without a server.
+
+install() swaps the process's pool for one handing out SQLite connections. The few MySQL-only
+constructs database.py uses are rewritten per statement, so its functions run unchanged.
+"""
+import datetime
+import os
+import re
+import sqlite3
+
+from mysql.connector import Error
+
+import database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id VARCHAR(36) PRIMARY KEY,
+    user_id VARCHAR(36) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_message TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id VARCHAR(36) PRIMARY KEY,
+    conversation_id VARCHAR(36) NOT NULL REFERENCES conversations(conversation_id) ON DELETE CASCADE,
+    user_id VARCHAR(36) NOT NULL,
+    role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
+    content TEXT NOT NULL,
+    products TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at);
+CREATE INDEX IF NOT EXISTS idx_conversations_user_updated_at ON conversations (user_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_created_at ON messages (conversation_id, created_at);
+"""
+
+REWRITES = [
+    (re.compile(r'ON DUPLICATE KEY UPDATE'), 'ON CONFLICT DO UPDATE SET'),
+    (re.compile(r'VALUES\((\w+)\)'), r'excluded.\1'),
+    (re.compile(r'%s'), '?')
+]
+
+# MySQL hands TIMESTAMP(6) columns back as datetimes; do the same with microsecond precision.
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' ', timespec='microseconds'))
+sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.datetime.fromisoformat(raw.decode('ascii')))
+
+def translate(sql):
+    for pattern, replacement in REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+class SQLiteCursor:
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def execute(self, sql, params=()):
+        try:
+            self._cursor.execute(translate(sql), tuple(params))
+        except sqlite3.Error as e:
+            raise Error(msg=str(e))
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteConnection:
+    """The subset of the mysql.connector connection interface database.py relies on."""
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                           detect_types=sqlite3.PARSE_DECLTYPES)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA foreign_keys=ON')
+
+    @property
+    def in_transaction(self):
+        return self._connection.in_transaction
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self._connection.cursor(), dictionary)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._connection.close()
+
+class SQLiteConnectionPool(database.ConnectionPool):
+    def __init__(self, path, size=5, timeout=5.0):
+        super().__init__(size=size, timeout=timeout, health_check_interval=float('inf'), max_lifetime=float('inf'))
+        self.path = path
+
+    def _connect(self):
+        connection = SQLiteConnection(self.path)
+        self._bump('created')
+        return connection
+
+def install(path, size=None):
+    """Create the schema at path and route database.py through it for the rest of this process."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.close()
+    pool = SQLiteConnectionPool(path, size=size or int(os.getenv('DB_POOL_SIZE', '5')))
+    with database._pool_lock:
+        database._pool = pool
+    return pool
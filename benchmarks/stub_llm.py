@@ -0,0 +1,153 @@
+"""Local OpenAI-compatible chat completions server with a configurable delay, for benchmarks.
+
+Intent requests get a canned intent JSON reply; every other request gets a canned recommendation
+reply, streamed as server-sent events when the payload asks for `stream: true`. The first requests
+can be answered with error statuses (and a Retry-After header), or dropped without a response, to
+exercise client retries.
+
+Example:
+    python -m benchmarks.stub_llm --port 8089 --latency-ms 300 --token-delay-ms 20
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_INTENT = {
+    'intent': 'product_recommendation',
+    'parameters': {'categories': ['Electronics']},
+    'context': {}
+}
+DEFAULT_REPLY = ('Based on what you are looking for, here are a few products worth a look. '
+                 'Each of them is well reviewed and in stock, and I can compare them if you like.')
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _is_intent_request(self, payload):
+        messages = payload.get('messages') or [{}]
+        return 'intent analysis' in (messages[0].get('content') or '')
+
+    def _usage(self, payload, content):
+        prompt = sum(len(m.get('content') or '') for m in payload.get('messages', [])) // 4
+        completion = len(content) // 4
+        return {'prompt_tokens': prompt, 'completion_tokens': completion, 'total_tokens': prompt + completion}
+
+    def _write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_error(400)
+            return
+
+        settings = self.server.settings
+        with self.server.lock:
+            self.server.requests += 1
+            status = settings['failures'].pop(0) if settings['failures'] else None
+        if status == 0:
+            # The request was read, then the connection goes away: the client can't tell if it ran.
+            self.close_connection = True
+            return
+        if status is not None:
+            body = json.dumps({'error': {'message': f'stub failure {status}'}}).encode('utf-8')
+            self.send_response(status)
+            if settings['retry_after'] is not None:
+                self.send_header('Retry-After', str(settings['retry_after']))
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self._is_intent_request(payload):
+            content = json.dumps(settings['intent'], ensure_ascii=False)
+        else:
+            content = settings['reply']
+        time.sleep(settings['latency'])
+
+        if payload.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for word in content.split(' '):
+                chunk = {'choices': [{'delta': {'content': word + ' '}}]}
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                time.sleep(settings['token_delay'])
+            if (payload.get('stream_options') or {}).get('include_usage'):
+                chunk = {'choices': [], 'usage': self._usage(payload, content)}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self._write_chunk(b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+
+        # A non-streamed reply costs what generating every token would.
+        time.sleep(settings['token_delay'] * len(content.split(' ')))
+        body = json.dumps({
+            'choices': [{'message': {'role': 'assistant', 'content': content}}],
+            'usage': self._usage(payload, content)
+        }, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is routine under load.
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+def start_stub_llm(host='127.0.0.1', port=0, latency=0.0, token_delay=0.0, intent=None, reply=None,
+                   failures=None, retry_after=None):
+    """Serve in a daemon thread; returns (server, base URL). latency is the delay before the first
+    byte and token_delay the delay per word, both in seconds. failures lists the status codes the
+    first requests get, sent with a Retry-After of retry_after seconds when it is set (0 closes the
+    connection without a response); server.requests counts the requests received."""
+    server = StubLLMServer((host, port), StubLLMHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.settings = {
+        'latency': latency,
+        'token_delay': token_delay,
+        'intent': intent or DEFAULT_INTENT,
+        'reply': reply or DEFAULT_REPLY,
+        'failures': list(failures or []),
+        'retry_after': retry_after
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='delay before the first byte')
+    parser.add_argument('--token-delay-ms', type=float, default=0.0, help='delay per generated word')
+    parser.add_argument('--intent', help='intent JSON returned for intent requests')
+    parser.add_argument('--reply', help='text returned for response requests')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_llm(args.host, args.port, args.latency_ms / 1000, args.token_delay_ms / 1000,
+                                      json.loads(args.intent) if args.intent else None, args.reply)
+    print(f"Stub LLM listening on {base_url} (set OPENAI_API_BASE to it)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
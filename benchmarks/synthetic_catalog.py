@@ -0,0 +1,94 @@
+"""Synthetic product catalogs with the products.json schema, from a thousand to a million items.
+
+Products recombine the brands and categories of the shipped catalog with generated names and
+descriptions, so embeddings cluster by category the way real ones do.
+
+Example:
+    python -m benchmarks.synthetic_catalog --count 100000 --output /tmp/products_100k.json
+"""
+import argparse
+import json
+import os
+import random
+
+BASE_CATALOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'products.json')
+
+NOUNS = {
+    'Electronics': ['Phone', 'Laptop', 'Tablet', 'Headphones', 'Smartwatch', 'Speaker', 'Monitor', 'Camera'],
+    'Games': ['Console', 'Controller', 'Headset', 'Board Game', 'VR Headset', 'Racing Wheel'],
+    'Shoes': ['Running Shoes', 'Sneakers', 'Hiking Boots', 'Sandals', 'Basketball Shoes', 'Loafers'],
+    'Home Decor': ['Lamp', 'Vase', 'Wall Clock', 'Rug', 'Cushion', 'Mirror', 'Candle Set'],
+    'Accessories': ['Watch', 'Wallet', 'Backpack', 'Sunglasses', 'Belt', 'Handbag'],
+    'Office': ['Desk Chair', 'Standing Desk', 'Notebook', 'Desk Organizer', 'Keyboard', 'Pen Set']
+}
+ADJECTIVES = ['Lightweight', 'Premium', 'Compact', 'Wireless', 'Classic', 'Ergonomic', 'Durable', 'Smart',
+              'Portable', 'Vintage', 'Waterproof', 'Minimalist', 'Pro', 'Ultra', 'Eco-Friendly']
+FEATURES = ['long battery life', 'a non-slip sole', 'fast charging', 'noise cancellation', 'a handcrafted finish',
+            'breathable materials', 'a two-year warranty', 'a high-resolution display', 'soft-touch fabric',
+            'adjustable height', 'a scratch-resistant coating', 'all-day comfort']
+PRICE_RANGES = {
+    'Electronics': (49, 2499),
+    'Games': (19, 699),
+    'Shoes': (25, 320),
+    'Home Decor': (9, 450),
+    'Accessories': (15, 1500),
+    'Office': (5, 900)
+}
+
+def load_base_catalog(path=BASE_CATALOG):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def iter_products(count, seed=0, base_catalog=None):
+    """Yield count products with ids 1..count, deterministic for a given seed."""
+    rng = random.Random(seed)
+    base = base_catalog if base_catalog is not None else load_base_catalog()
+    brands = sorted({product['brand'] for product in base})
+    image_urls = [product['image_url'] for product in base]
+    categories = list(NOUNS)
+
+    for product_id in range(1, count + 1):
+        category = rng.choice(categories)
+        brand = rng.choice(brands)
+        noun = rng.choice(NOUNS[category])
+        adjective = rng.choice(ADJECTIVES)
+        low, high = PRICE_RANGES[category]
+        yield {
+            'id': product_id,
+            'image_url': rng.choice(image_urls),
+            'name': f"{brand} {adjective} {noun} {rng.randint(1, 999)}",
+            'description': f"{adjective} {noun.lower()} with {rng.choice(FEATURES)} and {rng.choice(FEATURES)}",
+            'brand': brand,
+            'category': category,
+            'sku': str(rng.randint(10000, 99999)),
+            'price': f"${rng.uniform(low, high):.2f}",
+            'qty': str(rng.randint(0, 1000))
+        }
+
+def generate_catalog(count, seed=0):
+    return list(iter_products(count, seed))
+
+def write_catalog(path, count, seed=0):
+    """Stream the catalog to path as a JSON array without holding it in memory."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for i, product in enumerate(iter_products(count, seed)):
+            f.write(',\n' if i else '\n')
+            f.write(json.dumps(product, ensure_ascii=False))
+        f.write('\n]\n')
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+    write_catalog(args.output, args.count, args.seed)
+    print(f"Wrote {args.count} products to {args.output}")
+
+if __name__ == '__main__':
+    main()
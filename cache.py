@@ -0,0 +1,179 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+class LRUCache:
+    """Thread-safe size-bounded LRU cache with an optional per-entry TTL in seconds."""
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class SemanticCache:
+    """Thread-safe size-bounded LRU cache looked up by vector similarity.
+
+    Entries are grouped by an exact key; get() returns the value of the most similar entry under
+    that key whose cosine similarity reaches the threshold. Entries can carry tags (e.g. product
+    ids) so everything derived from a changed item can be dropped with invalidate().
+    """
+    def __init__(self, max_size=1024, ttl=None, threshold=0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._by_key = {}
+        self._by_tag = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype='float32').ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _remove(self, entry_id):
+        key, _, _, tags, _ = self._entries.pop(entry_id)
+        group = self._by_key.get(key)
+        if group is not None:
+            group.discard(entry_id)
+            if not group:
+                del self._by_key[key]
+        for tag in tags:
+            tagged = self._by_tag.get(tag)
+            if tagged is not None:
+                tagged.discard(entry_id)
+                if not tagged:
+                    del self._by_tag[tag]
+
+    def get(self, key, vector, default=None):
+        vector = self._normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            best_id = None
+            best_similarity = self.threshold
+            for entry_id in list(self._by_key.get(key, ())):
+                _, entry_vector, _, _, expires_at = self._entries[entry_id]
+                if expires_at is not None and expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                similarity = float(np.dot(entry_vector, vector))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2]
+
+    def set(self, key, vector, value, tags=()):
+        if self.max_size <= 0:
+            return
+        vector = self._normalize(vector)
+        vector.setflags(write=False)
+        tags = frozenset(tags)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (key, vector, value, tags, expires_at)
+            self._by_key.setdefault(key, set()).add(entry_id)
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        """Drop every entry carrying any of the tags; returns how many were dropped."""
+        with self._lock:
+            entry_ids = set()
+            for tag in tags:
+                entry_ids.update(self._by_tag.get(tag, ()))
+            for entry_id in entry_ids:
+                self._remove(entry_id)
+            self.invalidations += len(entry_ids)
+            return len(entry_ids)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_key.clear()
+            self._by_tag.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
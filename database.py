@@ -1,40 +1,294 @@
 import mysql.connector
 from mysql.connector import Error
+import base64
 import datetime
+import logging
+import os
+import queue
+import threading
+import time
 import uuid
 import json
+import itertools
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class ConnectionPool:
+    """
+    有界MySQL连接池：借出时做健康检查，失效或超龄的连接自动重建
+    """
+    def __init__(self, size=5, timeout=5.0, health_check_interval=30.0, max_lifetime=3600.0, **config):
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+        self.config = config
+        self.pid = os.getpid()
+        # 后进先出，优先复用最近用过的（最可能仍然存活的）连接
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'in_use': 0,
+            'wait_time_total': 0.0
+        }
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _connect(self):
+        connection = mysql.connector.connect(**self.config)
+        self._bump('created')
+        logger.debug('Connected to MySQL database')
+        return connection
+
+    def _discard(self, connection):
+        self._bump('discarded')
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def _checkout(self):
+        now = time.time()
+        while True:
+            try:
+                connection, created_at, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect(), time.time()
+
+            if now - created_at > self.max_lifetime:
+                self._discard(connection)
+                continue
+
+            # 空闲过久的连接可能已被服务端断开，先ping一次，失败则原地重连
+            if now - last_used > self.health_check_interval:
+                try:
+                    if connection.is_connected():
+                        self._bump('reused')
+                    else:
+                        connection.reconnect(attempts=1, delay=0)
+                        self._bump('reconnects')
+                        created_at = time.time()
+                except Error:
+                    self._discard(connection)
+                    continue
+            else:
+                self._bump('reused')
+            return connection, created_at
+
+    def acquire(self):
+        """
+        借出一个连接；池满时最多等待timeout秒
+        """
+        start = time.time()
+        if not self._slots.acquire(blocking=False):
+            self._bump('waits')
+            if not self._slots.acquire(timeout=self.timeout):
+                self._bump('timeouts')
+                raise Error(msg=f"Timed out after {self.timeout}s waiting for a pooled MySQL connection")
+        self._bump('wait_time_total', time.time() - start)
+
+        try:
+            connection, created_at = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._bump('checkouts')
+        self._bump('in_use')
+        return PooledConnection(self, connection, created_at)
+
+    def release(self, connection, created_at):
+        """
+        归还连接；只检查本地状态不ping服务端：未提交的事务会被回滚，回滚失败（连接已断开）则丢弃，
+        空闲连接是否失效留给_checkout按health_check_interval检查
+        """
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle.put((connection, created_at, time.time()))
+        except Error:
+            self._discard(connection)
+        finally:
+            self._bump('in_use', -1)
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'] = self.size
+        stats['idle'] = self._idle.qsize()
+        stats['pid'] = self.pid
+        return stats
+
+class PooledConnection:
+    """
+    借出连接的代理，close()时归还连接池而不是断开
+    """
+    def __init__(self, pool, connection, created_at):
+        self._pool = pool
+        self._connection = connection
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._connection, self._created_at)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    获取当前进程的连接池（fork之后的子进程会重建自己的连接池）
+    """
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool(
+                    size=int(os.getenv('DB_POOL_SIZE', '5')),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', '5')),
+                    health_check_interval=float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30')),
+                    max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),
+                    host=os.getenv('DB_HOST', 'sjc1.clusters.zeabur.com'),
+                    port=int(os.getenv('DB_PORT', '27888')),
+                    user=os.getenv('DB_USER', 'root'),
+                    password=os.getenv('DB_PASSWORD', '2hKk0nzQ7lM9TZE3LOo6ay54fw18GvXS'),
+                    database=os.getenv('DB_NAME', 'zeabur'),
+                    # 消息时间戳由应用按UTC生成后显式写入，会话时区需与之一致
+                    time_zone=os.getenv('DB_TIME_ZONE', '+00:00')
+                )
+    return _pool
+
+def get_pool_stats():
+    """
+    获取连接池指标
+    """
+    return get_pool().stats()
 
 def create_connection():
     """
-    创建MySQL数据库连接
+    从连接池借出MySQL数据库连接，用完后调用close()归还
     """
     try:
-        connection = mysql.connector.connect(
-            host='sjc1.clusters.zeabur.com',
-            port=27888,
-            user='root',
-            password='2hKk0nzQ7lM9TZE3LOo6ay54fw18GvXS',
-            database='zeabur'
-        )
-        if connection.is_connected():
-            print('Connected to MySQL database')
-            return connection
+        return get_pool().acquire()
     except Error as e:
-        print(f"Error connecting to MySQL: {e}")
+        logger.error("Error connecting to MySQL: %s", e)
     return None
 
+def close_connection(connection, cursor=None):
+    """
+    关闭游标并将连接归还连接池
+    """
+    try:
+        if cursor is not None:
+            cursor.close()
+    except Error:
+        pass
+    finally:
+        connection.close()
+
+def ensure_timestamp_precision(cursor, table, column, precision=6, on_update=False):
+    """
+    TIMESTAMP列的小数秒精度不足时修改列定义（旧表创建时只精确到秒）
+    """
+    check_column = """
+    SELECT datetime_precision FROM information_schema.columns
+    WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """
+    cursor.execute(check_column, (table, column))
+    row = cursor.fetchone()
+    if row is None or (row[0] or 0) >= precision:
+        return False
+    logger.info("Changing %s.%s to TIMESTAMP(%s)", table, column, precision)
+    definition = f"TIMESTAMP({precision}) DEFAULT CURRENT_TIMESTAMP({precision})"
+    if on_update:
+        definition += f" ON UPDATE CURRENT_TIMESTAMP({precision})"
+    cursor.execute(f"ALTER TABLE {table} MODIFY {column} {definition}")
+    return True
+
+def ensure_index(cursor, table, index_name, columns):
+    """
+    索引不存在时创建（MySQL不支持CREATE INDEX IF NOT EXISTS）
+    """
+    check_index = """
+    SELECT 1 FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    LIMIT 1
+    """
+    cursor.execute(check_index, (table, index_name))
+    if cursor.fetchone():
+        return False
+    logger.info("Creating index %s on %s", index_name, table)
+    cursor.execute(f"CREATE INDEX {index_name} ON {table} ({', '.join(columns)})")
+    return True
+
+def encode_cursor(values):
+    """
+    将分页游标（最后一行的排序键）编码为不透明字符串
+    """
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor_token, types):
+    """
+    解码分页游标，types为各位置的期望类型（datetime位置按ISO字符串还原为时间戳）；
+    无效游标或个数、类型不符时返回None
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor_token.encode('ascii')))
+        if not isinstance(values, list) or len(values) != len(types):
+            return None
+        position = []
+        for value, expected in zip(values, types):
+            if expected is datetime.datetime:
+                value = datetime.datetime.fromisoformat(value)
+            elif not isinstance(value, expected) or isinstance(value, bool):
+                return None
+            position.append(value)
+        return position
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def clamp_page_size(limit, default=DEFAULT_PAGE_SIZE):
+    try:
+        limit = int(limit) if limit is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
 def create_tables():
     """
     创建必要的数据库表
     """
     connection = create_connection()
     if connection is None:
-        print("Connection is None, cannot create tables")
+        logger.warning("Connection is None, cannot create tables")
         return False
     
+    cursor = None
     try:
         cursor = connection.cursor()
-        print("Cursor created successfully")
+        logger.debug("Cursor created successfully")
         
         # 创建conversations表
         create_conversations_table = """
@@ -42,13 +296,13 @@ def create_tables():
             conversation_id VARCHAR(36) PRIMARY KEY,
             user_id VARCHAR(36) NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
             last_message TEXT
         )
         """
-        print("Executing create conversations table")
+        logger.debug("Executing create conversations table")
         cursor.execute(create_conversations_table)
-        print("Conversations table created or exists")
+        logger.debug("Conversations table created or exists")
         
         # 创建messages表
         create_messages_table = """
@@ -59,26 +313,35 @@ def create_tables():
             role ENUM('user', 'assistant') NOT NULL,
             content TEXT NOT NULL,
             products JSON,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6),
             FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id) ON DELETE CASCADE
         )
         """
-        print("Executing create messages table")
+        logger.debug("Executing create messages table")
         cursor.execute(create_messages_table)
-        print("Messages table created or exists")
+        logger.debug("Messages table created or exists")
+
+        # 迁移：消息按时间排序，同一秒内的多轮对话需要微秒精度才能保持先后顺序
+        ensure_timestamp_precision(cursor, 'conversations', 'updated_at', on_update=True)
+        if ensure_timestamp_precision(cursor, 'messages', 'created_at'):
+            # 旧记录同一轮的问答时间戳相同，把助手回复后移1微秒，按(created_at, message_id)排序时仍排在提问之后
+            cursor.execute("UPDATE messages SET created_at = created_at + INTERVAL 1 MICROSECOND WHERE role = 'assistant'")
+
+        # 迁移：为列表分页和历史消息查询补充二级索引
+        ensure_index(cursor, 'conversations', 'idx_conversations_updated_at', ['updated_at'])
+        ensure_index(cursor, 'conversations', 'idx_conversations_user_updated_at', ['user_id', 'updated_at'])
+        ensure_index(cursor, 'messages', 'idx_messages_conversation_created_at', ['conversation_id', 'created_at'])
         
         connection.commit()
-        print('Tables created successfully')
+        logger.info('Tables created successfully')
         return True
     except Error as e:
-        print(f"Error creating tables: {e}")
+        logger.error("Error creating tables: %s", e)
         return False
     finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
-            print("Connection closed")
+        close_connection(connection, cursor)
 
+@timed('db_write')
 def log_conversation(user_id, role, content, conversation_id=None, products=None):
     """
     记录对话消息到数据库
@@ -87,6 +350,7 @@ def log_conversation(user_id, role, content, conversation_id=None, products=None
     if connection is None:
         return False
     
+    cursor = None
     try:
         cursor = connection.cursor()
         
@@ -128,60 +392,210 @@ def log_conversation(user_id, role, content, conversation_id=None, products=None
         connection.commit()
         return True
     except Error as e:
-        print(f"Error logging conversation: {e}")
+        logger.error("Error logging conversation: %s", e)
         return False
     finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        close_connection(connection, cursor)
+
+_stamp_lock = threading.Lock()
+_last_stamp = None
+# 同一轮中助手回复相对用户消息的时间偏移
+ASSISTANT_OFFSET = datetime.timedelta(microseconds=1)
+_sequence = itertools.count()
+
+def next_turn_stamp():
+    """
+    生成一轮对话的时间戳（UTC）和序号：同一进程内严格递增，
+    先发生的轮次即使和后面的轮次在同一批中写库，时间戳也一定更早。
+    每轮占用两个微秒：助手回复写在时间戳+1微秒，不会和下一轮的用户消息重叠
+    """
+    global _last_stamp
+    with _stamp_lock:
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if _last_stamp is not None and now <= _last_stamp:
+            now = _last_stamp + datetime.timedelta(microseconds=1)
+        _last_stamp = now + ASSISTANT_OFFSET
+        return now, next(_sequence)
+
+def _turn_order(turn):
+    return turn['created_at'], turn.get('seq', 0)
+
+def log_turn(user_id, user_content, assistant_content, conversation_id=None, products=None):
+    """
+    在一个事务中记录一轮对话（用户消息+助手回复）
+    """
+    return log_turns([{
+        'user_id': user_id,
+        'conversation_id': conversation_id,
+        'user_content': user_content,
+        'assistant_content': assistant_content,
+        'products': products
+    }])
+
+@timed('db_write')
+def log_turns(turns):
+    """
+    在一个事务中批量记录多轮对话（可跨用户）：
+    用一条多行INSERT ... ON DUPLICATE KEY UPDATE upsert对话记录，再用一条多行INSERT写入所有消息。
+    每轮的created_at（入队时生成）显式写入，批次内和重放的旧记录都按它排序，而不是按写库时间；
+    助手回复的created_at晚1微秒，历史消息只按(created_at, message_id)排序即可保持一问一答的顺序
+    """
+    if not turns:
+        return True
+
+    stamped = []
+    for turn in turns:
+        if turn.get('created_at'):
+            created_at = turn['created_at']
+            if not isinstance(created_at, datetime.datetime):
+                created_at = datetime.datetime.fromisoformat(created_at)
+            stamped.append(dict(turn, created_at=created_at))
+        else:
+            created_at, seq = next_turn_stamp()
+            stamped.append(dict(turn, created_at=created_at, seq=seq))
+    turns = sorted(stamped, key=_turn_order)
+
+    connection = create_connection()
+    if connection is None:
+        return False
+
+    cursor = None
+    try:
+        cursor = connection.cursor()
+
+        # 同一对话在批次中出现多次时只保留最后一条last_message
+        conversations = {}
+        message_rows = []
+        for turn in turns:
+            user_id = turn['user_id']
+            conversation_id = turn.get('conversation_id') or user_id
+            products = turn.get('products')
+            products_json = json.dumps(products) if products else None
+
+            created_at = turn['created_at']
+            conversations[conversation_id] = (conversation_id, user_id, turn['assistant_content'], created_at, created_at)
+            message_rows.append((str(uuid.uuid4()), conversation_id, user_id, 'user', turn['user_content'], None, created_at))
+            message_rows.append((str(uuid.uuid4()), conversation_id, user_id, 'assistant', turn['assistant_content'], products_json, created_at + ASSISTANT_OFFSET))
+
+        # 重放的旧记录不能覆盖更新的last_message；last_message须在updated_at之前赋值（MySQL按顺序求值）
+        upsert_conversations = f"""
+        INSERT INTO conversations (conversation_id, user_id, last_message, created_at, updated_at)
+        VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(conversations))}
+        ON DUPLICATE KEY UPDATE
+            last_message = CASE WHEN VALUES(updated_at) >= updated_at THEN VALUES(last_message) ELSE last_message END,
+            updated_at = CASE WHEN VALUES(updated_at) > updated_at THEN VALUES(updated_at) ELSE updated_at END
+        """
+        cursor.execute(upsert_conversations, [value for row in conversations.values() for value in row])
+
+        insert_messages = f"""
+        INSERT INTO messages (message_id, conversation_id, user_id, role, content, products, created_at)
+        VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(message_rows))}
+        """
+        cursor.execute(insert_messages, [value for row in message_rows for value in row])
+
+        connection.commit()
+        return True
+    except Error as e:
+        logger.error("Error logging conversation turns: %s", e)
+        return False
+    finally:
+        close_connection(connection, cursor)
 
-def get_all_conversations():
+@timed('db_read')
+def get_all_conversations(user_id=None, limit=None, cursor_token=None):
     """
-    获取所有对话
+    按更新时间倒序分页获取对话（keyset分页），可按用户过滤
+    返回 (对话列表, 下一页游标)，没有更多数据时游标为None
     """
+    limit = clamp_page_size(limit)
     connection = create_connection()
     if connection is None:
-        return []
+        return [], None
     
+    cursor = None
     try:
         cursor = connection.cursor(dictionary=True)
+
+        conditions = []
+        params = []
+        if user_id:
+            conditions.append("user_id = %s")
+            params.append(user_id)
+        if cursor_token:
+            position = decode_cursor(cursor_token, (datetime.datetime, str))
+            if position is None:
+                return [], None
+            updated_at, conversation_id = position
+            conditions.append("(updated_at < %s OR (updated_at = %s AND conversation_id < %s))")
+            params.extend([updated_at, updated_at, conversation_id])
         
-        get_conversations = """
+        get_conversations = f"""
         SELECT conversation_id, user_id, created_at, updated_at, last_message
         FROM conversations
-        ORDER BY updated_at DESC
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY updated_at DESC, conversation_id DESC
+        LIMIT %s
         """
-        cursor.execute(get_conversations)
+        params.append(limit + 1)
+        cursor.execute(get_conversations, params)
         conversations = cursor.fetchall()
+
+        next_cursor = None
+        if len(conversations) > limit:
+            conversations = conversations[:limit]
+            last = conversations[-1]
+            next_cursor = encode_cursor([last['updated_at'], last['conversation_id']])
         
-        return conversations
+        return conversations, next_cursor
     except Error as e:
-        print(f"Error getting conversations: {e}")
-        return []
+        logger.error("Error getting conversations: %s", e)
+        return [], None
     finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        close_connection(connection, cursor)
 
-def get_conversation_history(conversation_id):
+@timed('db_read')
+def get_conversation_history(conversation_id, limit=None, cursor_token=None):
     """
-    获取特定对话的历史消息
+    按时间正序分页获取特定对话的历史消息（keyset分页）
+    返回 (消息列表, 下一页游标)，没有更多数据时游标为None
     """
+    limit = clamp_page_size(limit)
     connection = create_connection()
     if connection is None:
-        return []
+        return [], None
     
+    cursor = None
     try:
         cursor = connection.cursor(dictionary=True)
+
+        # 助手回复的created_at晚于用户消息，(created_at, message_id)即可唯一确定游标位置；
+        # 二级索引(conversation_id, created_at)隐含主键message_id，排序和created_at >= 的范围条件都能走索引
+        conditions = ["conversation_id = %s"]
+        params = [conversation_id]
+        if cursor_token:
+            position = decode_cursor(cursor_token, (datetime.datetime, str))
+            if position is None:
+                return [], None
+            created_at, message_id = position
+            conditions.append("created_at >= %s AND (created_at > %s OR message_id > %s)")
+            params.extend([created_at, created_at, message_id])
         
-        get_messages = """
+        get_messages = f"""
         SELECT message_id, conversation_id, user_id, role, content, products, created_at
         FROM messages
-        WHERE conversation_id = %s
-        ORDER BY created_at ASC, role ASC
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at ASC, message_id ASC
+        LIMIT %s
         """
-        cursor.execute(get_messages, (conversation_id,))
+        params.append(limit + 1)
+        cursor.execute(get_messages, params)
         messages = cursor.fetchall()
+
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            last = messages[-1]
+            next_cursor = encode_cursor([last['created_at'], last['message_id']])
         
         # 将JSON字符串转换为Python对象
         for msg in messages:
@@ -193,15 +607,14 @@ def get_conversation_history(conversation_id):
             else:
                 msg['products'] = None
         
-        return messages
+        return messages, next_cursor
     except Error as e:
-        print(f"Error getting conversation history: {e}")
-        return []
+        logger.error("Error getting conversation history: %s", e)
+        return [], None
     finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        close_connection(connection, cursor)
 
+@timed('db_write')
 def delete_conversation(conversation_id):
     """
     删除对话及其所有消息
@@ -210,6 +623,7 @@ def delete_conversation(conversation_id):
     if connection is None:
         return False
     
+    cursor = None
     try:
         cursor = connection.cursor()
         
@@ -219,9 +633,7 @@ def delete_conversation(conversation_id):
         
         return True
     except Error as e:
-        print(f"Error deleting conversation: {e}")
+        logger.error("Error deleting conversation: %s", e)
         return False
     finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        close_connection(connection, cursor)
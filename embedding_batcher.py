@@ -0,0 +1,117 @@
+import os
+import queue
+import threading
+import logging
+import time
+from concurrent.futures import Future, InvalidStateError, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text encode calls into batched model calls.
+
+    Callers block on encode(); a worker thread takes the first pending text, keeps collecting
+    for up to max_wait seconds or until max_batch_size texts are queued, encodes them in one
+    call and hands each caller its row. A caller whose batch hasn't come back within timeout
+    seconds encodes its text directly instead of waiting on the worker indefinitely.
+    """
+    def __init__(self, encode_fn, max_batch_size=32, max_wait=0.005, timeout=10.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.batches = 0
+        self.texts = 0
+        self.max_observed_batch = 0
+        self.timeouts = 0
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so a worker process starts its own.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+            self._thread.start()
+
+    def encode(self, text):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            if not future.cancel() and future.done():
+                return future.result()
+        logger.warning("Embedding batch didn't finish within %.1fs, encoding directly", self.timeout)
+        with self._lock:
+            self.timeouts += 1
+        return self.encode_fn([text])[0]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Any failure, not only in the model call, must reach every waiting caller.
+            try:
+                self._encode_batch(batch)
+            except Exception as e:
+                for _, future in batch:
+                    _resolve(future, exception=e)
+
+    def _encode_batch(self, batch):
+        # Callers that timed out have cancelled their futures and encode on their own.
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        vectors = self.encode_fn(unique_texts)
+        if len(vectors) != len(unique_texts):
+            raise ValueError(f"Encoder returned {len(vectors)} vectors for {len(unique_texts)} texts")
+
+        rows = {text: vectors[i] for i, text in enumerate(unique_texts)}
+        for text, future in batch:
+            _resolve(future, result=rows[text])
+
+        with self._lock:
+            self.batches += 1
+            self.texts += len(batch)
+            self.max_observed_batch = max(self.max_observed_batch, len(batch))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'texts': self.texts,
+                'mean_batch_size': self.texts / self.batches if self.batches else 0.0,
+                'max_batch_size': self.max_observed_batch,
+                'timeouts': self.timeouts,
+                'pending': self._queue.qsize()
+            }
+
+def _resolve(future, result=None, exception=None):
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
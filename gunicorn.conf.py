@@ -0,0 +1,72 @@
+# 生产环境启动配置：gunicorn -c gunicorn.conf.py app:app
+# ASGI入口（异步聊天接口）：GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi:application
+#
+# master进程先加载模型、商品目录和向量索引，再fork出worker，各worker以写时复制方式共享这部分内存。
+# 平滑重启：kill -HUP <master pid> 会逐个替换worker而不中断已建立的连接；由于启用了preload_app，
+# HUP不会重新加载代码，更新代码需用 kill -USR2 启动新master，确认正常后再对旧master发送 TERM。
+import os
+import time
+
+# master进程在fork之前只允许单线程推理：没有现成索引时preload会在master中编码商品（torch）并构建近邻表（faiss，OpenMP），
+# 若此时创建了OpenMP线程池，fork出的worker继承到失效的线程池，第一次推理就可能死锁。
+# 本文件在导入应用之前加载，OpenMP运行时初始化时读取的就是这里的值；worker启动后再在post_worker_init中恢复多线程。
+_configured_threads = os.environ.get('OMP_NUM_THREADS')
+os.environ['OMP_NUM_THREADS'] = '1'
+os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+def _set_inference_threads(num_threads):
+    import sys
+
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(num_threads)
+    if 'faiss' in sys.modules:
+        sys.modules['faiss'].omp_set_num_threads(num_threads)
+
+def _cpu_count():
+    # 容器内以可用的CPU集合为准
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '3000')}")
+workers = int(os.getenv('WEB_CONCURRENCY', str(_cpu_count())))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+# 每个worker的线程数即它同时处理的请求数；聊天请求大部分时间在等待LLM，可适当调大
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# 每个worker最多保持的连接数，超出的连接留在监听队列（backlog）中等待
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '100'))
+backlog = int(os.getenv('GUNICORN_BACKLOG', '256'))
+
+preload_app = True
+# 流式回复可能持续较久，超时需大于LLM的最长响应时间
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+# 处理一定数量的请求后替换worker，避免内存缓慢增长；加随机抖动以免所有worker同时重启
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+def when_ready(server):
+    # 在fork worker之前加载模型和索引；推理线程池无法跨fork使用，因此这里不做预热
+    from agents import preload
+    from database import create_tables
+
+    create_tables()
+    _set_inference_threads(1)
+    start = time.time()
+    preload(warm_up=False)
+    server.log.info("Preloaded recommendation engine and agents in %.1fs", time.time() - start)
+
+def post_worker_init(worker):
+    # 按worker数分配推理线程，避免多个worker同时占满所有核心；未设置时沿用启动时的OMP_NUM_THREADS
+    per_worker = max(1, _cpu_count() // max(1, worker.cfg.workers))
+    num_threads = int(os.getenv('TORCH_NUM_THREADS') or _configured_threads or str(per_worker))
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)
+    _set_inference_threads(num_threads)
+
+    from agents import start_warmup
+    start_warmup()
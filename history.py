@@ -0,0 +1,94 @@
+import os
+import re
+from typing import Dict, List, Optional
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+# CJK characters are roughly a token each; other text averages about four characters per token.
+CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+SENTENCE_END = re.compile(r'(?<=[.!?。！？])\s*')
+
+def estimate_tokens(text: str) -> int:
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def message_tokens(message: Dict[str, str]) -> int:
+    # Chat formats add a few tokens of framing per message.
+    return estimate_tokens(message.get('content') or '') + 4
+
+def is_summary(message: Dict[str, str]) -> bool:
+    return message.get('role') == 'system' and (message.get('content') or '').startswith(SUMMARY_PREFIX)
+
+def summarize_message(message: Dict[str, str], max_chars: int = 160) -> str:
+    """One line per message: its first sentence, clipped."""
+    text = ' '.join((message.get('content') or '').split())
+    first_sentence = SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(first_sentence) > max_chars:
+        first_sentence = first_sentence[:max_chars].rstrip() + '...'
+    speaker = 'User' if message.get('role') == 'user' else 'Assistant'
+    return f"- {speaker}: {first_sentence}"
+
+def compact_history(history: List[Dict[str, str]], recent_turns: Optional[int] = None,
+                    summary_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+    """Keep the last recent_turns exchanges verbatim and fold older messages into a leading
+    summary message. The summary is extended, not rebuilt, so each message is summarized once;
+    its oldest lines are dropped once it exceeds summary_tokens."""
+    if recent_turns is None:
+        recent_turns = int(os.getenv('HISTORY_RECENT_TURNS', '6'))
+    if summary_tokens is None:
+        summary_tokens = int(os.getenv('HISTORY_SUMMARY_TOKENS', '300'))
+
+    summary_lines = []
+    messages = history
+    if history and is_summary(history[0]):
+        summary_lines = history[0]['content'][len(SUMMARY_PREFIX):].strip().splitlines()
+        messages = history[1:]
+
+    keep = recent_turns * 2
+    if len(messages) <= keep:
+        return history
+
+    overflow = messages[:len(messages) - keep]
+    recent = messages[len(messages) - keep:]
+    summary_lines.extend(summarize_message(message) for message in overflow)
+
+    total = sum(estimate_tokens(line) for line in summary_lines)
+    while summary_lines and total > summary_tokens:
+        total -= estimate_tokens(summary_lines.pop(0))
+
+    if not summary_lines:
+        return list(recent)
+    summary = {'role': 'system', 'content': SUMMARY_PREFIX + '\n' + '\n'.join(summary_lines)}
+    return [summary] + list(recent)
+
+def history_window(history: List[Dict[str, str]], max_tokens: int, max_messages: int,
+                   current_question: Optional[str] = None) -> List[Dict[str, str]]:
+    """The newest messages that fit in max_tokens and max_messages, in order, preceded by the
+    running summary when it fits in what is left of the budget.
+
+    A trailing user message equal to current_question is left out, since callers append the
+    question to the prompt themselves.
+    """
+    summary = None
+    messages = history
+    if messages and is_summary(messages[0]):
+        summary = messages[0]
+        messages = messages[1:]
+    if current_question is not None and messages and messages[-1].get('role') == 'user' \
+            and messages[-1].get('content') == current_question:
+        messages = messages[:-1]
+
+    window = []
+    budget = max_tokens
+    for message in reversed(messages):
+        if len(window) >= max_messages:
+            break
+        cost = message_tokens(message)
+        if cost > budget:
+            break
+        window.append(message)
+        budget -= cost
+    window.reverse()
+
+    if summary is not None and message_tokens(summary) <= budget:
+        window.insert(0, summary)
+    return window
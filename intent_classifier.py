@@ -0,0 +1,283 @@
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from recommendation_engine import category_terms
+
+logger = logging.getLogger(__name__)
+
+# Anchored, high-precision patterns; anything that doesn't match the whole query goes to the next tier.
+INTENT_RULES = [
+    ('other', re.compile(
+        r"^(hi|hello|hey|hi there|hello there|thanks|thank you|thanks a lot|thank you very much|ok|okay|"
+        r"bye|goodbye|see you|good (morning|afternoon|evening)|你好|您好|嗨|哈喽|谢谢|多谢|谢谢你|好的|再见|拜拜)"
+        r"[\s!.,~。！，？?]*$",
+        re.IGNORECASE
+    )),
+    ('price_inquiry', re.compile(
+        r"^(how much (is|are|does|do|would) (it|this|that|they|these|those|this one|that one|the first one|the second one)( cost)?|"
+        r"what('s| is) the price( of (it|this|that|them|this one|that one))?|what do they cost|price|"
+        r"(它|这个|那个|这款|那款|这些|那些)?(要)?多少钱(啊|呢)?|(它|这个|那个|这款|那款)?的?价格(是)?(多少)?(呢)?)"
+        r"[\s!.,~。！，？?]*$",
+        re.IGNORECASE
+    ))
+]
+
+# Intents whose parameters can be read off the query locally. Product details, comparisons and
+# price questions name or refer to specific products, which only the LLM resolves.
+LOCAL_PARAMETER_INTENTS = {'product_recommendation', 'category_exploration', 'other'}
+
+# Words that only make sense against earlier turns ("cheaper ones?", "what about those?").
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(ones?|them|they|those|these|that|this|it|another|others?|more|else|also|instead|similar|"
+    r"cheaper|pricier|bigger|smaller|better|same)\b|还有|这些|那些|这个|那个|别的|其他|其它|更|再|换",
+    re.IGNORECASE
+)
+
+# Constraints the local extraction doesn't understand; the LLM handles these queries.
+UNPARSED_CONSTRAINT_PATTERN = re.compile(
+    r"\d|\b(cheap|affordable|budget|expensive|price[sd]?|cost|under|below|above|over|between)\b|便宜|贵|价|元|块",
+    re.IGNORECASE
+)
+
+NUMBER = r"\$?\s*(\d+(?:\.\d+)?)\s*(?:dollars|usd|元|块)?"
+PRICE_RANGE_PATTERNS = [
+    (re.compile(rf"\b(?:between|from)\s*{NUMBER}\s*(?:and|to|-)\s*{NUMBER}", re.IGNORECASE), ('min', 'max')),
+    (re.compile(rf"{NUMBER}\s*(?:到|至|-|~)\s*{NUMBER}"), ('min', 'max')),
+    (re.compile(rf"\b(?:under|below|less than|no more than|at most|up to|within)\s*{NUMBER}", re.IGNORECASE), ('max',)),
+    (re.compile(rf"(?:低于|少于|不超过|不到){NUMBER}|{NUMBER}\s*(?:以下|以内|之内)"), ('max',)),
+    (re.compile(rf"\b(?:over|above|more than|at least)\s*{NUMBER}", re.IGNORECASE), ('min',)),
+    (re.compile(rf"(?:高于|超过|至少){NUMBER}|{NUMBER}\s*以上"), ('min',))
+]
+
+# Chinese words for the catalog's categories, so the local tier filters Chinese queries too.
+CATEGORY_ALIASES = {
+    '鞋': 'shoes',
+    '电子': 'electronics',
+    '相机': 'camera',
+    '游戏': 'games',
+    '家居': 'home decor',
+    '配饰': 'accessories',
+    '办公': 'office'
+}
+
+# Labeled queries for the embedding tier; a query is only classified locally when it lands very
+# close to one of them and clearly closer to one intent than to any other.
+INTENT_EXAMPLES = {
+    'product_recommendation': [
+        'recommend some products',
+        'can you recommend a good laptop',
+        'I need a new pair of running shoes',
+        'suggest a gift for my mother',
+        'what headphones should I buy',
+        'I am looking for a phone',
+        '推荐一些运动鞋',
+        '推荐一款轻薄的笔记本电脑'
+    ],
+    'category_exploration': [
+        'what kinds of products do you sell',
+        'show me your home decor category',
+        'what categories do you have',
+        'browse electronics',
+        '你们有哪些类别的商品'
+    ],
+    'price_inquiry': [
+        'how much does it cost',
+        'what is the price of this product',
+        'is it expensive',
+        'is there anything cheaper',
+        '这个多少钱'
+    ],
+    'comparison': [
+        'compare these two products',
+        'which one is better',
+        'what is the difference between them',
+        '哪个更好'
+    ],
+    'product_details': [
+        'tell me more about this product',
+        'what are the specifications',
+        'does it have a warranty',
+        '介绍一下这个产品'
+    ],
+    'other': [
+        'how are you',
+        'what is the weather today',
+        'who are you',
+        'tell me a joke',
+        'how do I track my order'
+    ]
+}
+
+class IntentClassifier:
+    """Local tiers in front of the intent LLM: keyword rules, then nearest labeled example by
+    embedding similarity. classify() returns None when neither tier is confident enough, when the
+    query is a follow-up that needs the conversation, or when its parameters can't be extracted
+    locally."""
+    def __init__(self, recommendation_engine, examples: Optional[Dict[str, List[str]]] = None,
+                 threshold: Optional[float] = None, margin: Optional[float] = None, enabled: Optional[bool] = None):
+        self.recommendation_engine = recommendation_engine
+        self.examples = examples or INTENT_EXAMPLES
+        self.threshold = threshold if threshold is not None else float(os.getenv('INTENT_EMBEDDING_THRESHOLD', '0.8'))
+        self.margin = margin if margin is not None else float(os.getenv('INTENT_EMBEDDING_MARGIN', '0.05'))
+        self.enabled = enabled if enabled is not None else os.getenv('INTENT_FAST_PATH', '1') != '0'
+        self._labels = None
+        self._example_vectors = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rule_hits = 0
+        self.embedding_hits = 0
+        self.llm_fallbacks = 0
+        self.context_fallbacks = 0
+
+    def _intent(self, intent: str, parameters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {
+            "intent": intent,
+            "parameters": parameters or {},
+            "context": {}
+        }
+
+    def _price_range(self, text: str) -> Dict[str, float]:
+        price_range = {}
+        for pattern, bounds in PRICE_RANGE_PATTERNS:
+            for match in pattern.finditer(text):
+                values = [float(value) for value in match.groups() if value is not None]
+                for bound, value in zip(bounds, values):
+                    price_range.setdefault(bound, value)
+        return price_range
+
+    def extract_parameters(self, user_question: str) -> Optional[Dict[str, Any]]:
+        """Brands and categories the catalog knows, and a price range, read off the query in the
+        shape the intent LLM returns them. None when the query has constraints this can't parse."""
+        text = ' '.join(user_question.split())
+        parameters: Dict[str, Any] = {}
+
+        price_range = self._price_range(text)
+        if price_range:
+            parameters['price_range'] = price_range
+        elif UNPARSED_CONSTRAINT_PATTERN.search(text):
+            return None
+
+        attributes = self.recommendation_engine.attributes
+        folded = text.casefold()
+        brands = [brand for brand in attributes.brands
+                  if brand and re.search(rf"(?<!\w){re.escape(brand)}(?!\w)", folded)]
+        if brands:
+            parameters['brands'] = brands
+
+        terms = category_terms(' '.join([text] + [alias for word, alias in CATEGORY_ALIASES.items() if word in text]))
+        categories = []
+        for category in attributes.categories:
+            # 'Electronics, Camera' matches on either part; a multi-word part needs all its words.
+            parts = [category_terms(part) for part in category.split(',')]
+            if any(part and part <= terms for part in parts):
+                categories.append(category)
+        if categories:
+            parameters['categories'] = categories
+        return parameters
+
+    def _needs_context(self, user_question: str, conversation_history: Optional[List[Dict[str, str]]]) -> bool:
+        """A follow-up wording with earlier turns to refer to.
+
+        The app appends the current question to the history before classifying, so a trailing
+        user message equal to the question isn't an earlier turn.
+        """
+        previous = list(conversation_history or [])
+        if previous and previous[-1].get('role') == 'user' and previous[-1].get('content') == user_question:
+            previous.pop()
+        return bool(previous) and FOLLOW_UP_PATTERN.search(user_question) is not None
+
+    def _match_rules(self, user_question: str) -> Optional[str]:
+        text = ' '.join(user_question.split())
+        for intent, pattern in INTENT_RULES:
+            if pattern.match(text):
+                return intent
+        return None
+
+    def _normalize(self, vectors):
+        vectors = np.asarray(vectors, dtype='float32')
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _load_examples(self):
+        if self._example_vectors is None:
+            with self._lock:
+                if self._example_vectors is None:
+                    labels = []
+                    texts = []
+                    for intent, examples in self.examples.items():
+                        labels.extend([intent] * len(examples))
+                        texts.extend(examples)
+                    self._labels = np.asarray(labels)
+                    self._example_vectors = self._normalize(self.recommendation_engine.encode_texts(texts))
+        return self._labels, self._example_vectors
+
+    def warm_up(self) -> None:
+        """Embed the labeled examples now instead of on the first query."""
+        if self.enabled:
+            self._load_examples()
+
+    def _match_embedding(self, user_question: str) -> Optional[str]:
+        labels, example_vectors = self._load_examples()
+        query_vector = self._normalize(self.recommendation_engine.encode_query(user_question))
+        similarities = example_vectors @ query_vector
+
+        scores = {}
+        for label, similarity in zip(labels, similarities):
+            scores[label] = max(scores.get(label, -1.0), float(similarity))
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_intent, best_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+        if best_score >= self.threshold and best_score - runner_up >= self.margin:
+            return best_intent
+        return None
+
+    def classify(self, user_question: str,
+                 conversation_history: Optional[List[Dict[str, str]]] = None) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+
+        # The rules only match greetings and questions about "it"/"this", which need no parameters.
+        intent = self._match_rules(user_question)
+        parameters = None
+        source = 'rule_hits' if intent else None
+        if intent is None and self._needs_context(user_question, conversation_history):
+            source = 'context_fallbacks'
+        elif intent is None:
+            try:
+                intent = self._match_embedding(user_question)
+                if intent in LOCAL_PARAMETER_INTENTS:
+                    parameters = self.extract_parameters(user_question) if intent != 'other' else {}
+                if parameters is None:
+                    intent = None
+            except Exception as e:
+                logger.error("Error classifying intent locally: %s", e)
+                intent = None
+            source = 'embedding_hits' if intent else 'llm_fallbacks'
+
+        with self._lock:
+            self.requests += 1
+            setattr(self, source, getattr(self, source) + 1)
+            if source == 'context_fallbacks':
+                self.llm_fallbacks += 1
+
+        return self._intent(intent, parameters) if intent else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            bypassed = self.rule_hits + self.embedding_hits
+            return {
+                'enabled': self.enabled,
+                'requests': self.requests,
+                'rule_hits': self.rule_hits,
+                'embedding_hits': self.embedding_hits,
+                'llm_fallbacks': self.llm_fallbacks,
+                'context_fallbacks': self.context_fallbacks,
+                'bypass_rate': bypassed / self.requests if self.requests else 0.0,
+                'threshold': self.threshold,
+                'margin': self.margin
+            }
@@ -0,0 +1,290 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Transport errors raised before the request can have reached the model.
+ASYNC_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class BaseLLMClient:
+    """Connection settings and retry policy shared by the sync and async clients.
+
+    Failures that can't have produced a completion (failing to connect, 429 and 5xx) are retried
+    with full-jitter exponential backoff, honoring Retry-After when the server sends it. A read
+    timeout or a connection dropped after the request was sent means the upstream may still be
+    generating (and billing) the first completion, so those are only retried with
+    retry_read_timeouts. No retry starts after total_timeout seconds.
+    """
+    def __init__(self, api_base: str, api_key: str, pool_size: int = 20,
+                 connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 total_timeout: float = 30.0, retry_read_timeouts: bool = False):
+        self.api_base = api_base.rstrip('/')
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.total_timeout = total_timeout
+        self.retry_read_timeouts = retry_read_timeouts
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+
+    def _url(self, path: str) -> str:
+        return f"{self.api_base}/{path.lstrip('/')}"
+
+    def _parse_stream_line(self, line: str, on_usage: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[str]:
+        """Content delta of one SSE line; '' for lines without content, None at [DONE].
+
+        The usage chunk sent with stream_options.include_usage is handed to on_usage.
+        """
+        if not line or not line.startswith('data:'):
+            return ''
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return None
+        try:
+            chunk = json.loads(data)
+            if chunk.get('usage') and on_usage is not None:
+                on_usage(chunk['usage'])
+            choices = chunk.get('choices') or []
+            delta = choices[0].get('delta', {}) if choices else {}
+        except (ValueError, KeyError, IndexError, AttributeError) as e:
+            logger.error("Error parsing LLM stream chunk: %s", e)
+            return ''
+        return delta.get('content') or ''
+
+    def _retry_delay(self, attempt: int, response: Optional[Any] = None) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                try:
+                    return min(max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0), self.backoff_max)
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _next_retry(self, attempt: int, deadline: float, response: Optional[Any] = None) -> Optional[float]:
+        """Delay before the next attempt, or None when retries are exhausted or it would start past the deadline."""
+        if attempt >= self.max_retries:
+            return None
+        delay = self._retry_delay(attempt, response)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+class LLMClient(BaseLLMClient):
+    """Pooled, keep-alive HTTP client for an OpenAI-compatible chat completions API.
+
+    One requests.Session is shared by every agent so TCP/TLS connections are reused.
+    """
+    def __init__(self, api_base: str, api_key: str, **settings):
+        super().__init__(api_base, api_key, **settings)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @staticmethod
+    def _failed_to_connect(error: requests.RequestException) -> bool:
+        """True when the request failed while connecting, so the server never saw it."""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = error.args[0] if error.args else None
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+    def post(self, path: str, payload: Dict[str, Any], stream: bool = False) -> Optional[requests.Response]:
+        """POST with retries; returns the successful response, or None once retries are exhausted."""
+        url = self._url(path)
+        deadline = time.monotonic() + self.total_timeout
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                logger.warning("LLM request error (attempt %s): %s", attempt + 1, e)
+                # A connection dropped after the body was sent is as ambiguous as a read timeout.
+                retryable = self._failed_to_connect(e) or self.retry_read_timeouts
+                delay = self._next_retry(attempt, deadline) if retryable else None
+                if delay is None:
+                    return None
+                time.sleep(delay)
+                continue
+
+            if response.status_code == 200:
+                return response
+
+            delay = self._next_retry(attempt, deadline, response) if response.status_code in RETRY_STATUS_CODES else None
+            if delay is not None:
+                logger.warning("LLM request returned %s, retrying in %.2fs", response.status_code, delay)
+                response.close()
+                time.sleep(delay)
+                continue
+
+            logger.error("API request failed, status code: %s", response.status_code)
+            logger.error("Error message: %s", response.text)
+            return None
+        return None
+
+    def chat_completion(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = self.post('chat/completions', payload)
+        if response is None:
+            return None
+        try:
+            return response.json()
+        except ValueError as e:
+            logger.error("Error decoding LLM response: %s", e)
+            return None
+
+    def stream_chat_completion(self, payload: Dict[str, Any],
+                               on_usage: Optional[Callable[[Dict[str, Any]], None]] = None) -> Iterator[str]:
+        """Yield content deltas from a `stream: true` completion as server-sent events arrive.
+
+        Retries only cover establishing the stream; a failure mid-stream ends the iterator.
+        """
+        response = self.post('chat/completions', dict(payload, stream=True), stream=True)
+        if response is None:
+            return
+        # SSE bodies are UTF-8; chunk_size=None hands over bytes as they arrive instead of buffering 512.
+        response.encoding = 'utf-8'
+        try:
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                content = self._parse_stream_line(line, on_usage)
+                if content is None:
+                    break
+                if content:
+                    yield content
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logger.warning("LLM stream interrupted: %s", e)
+        finally:
+            response.close()
+
+class AsyncLLMClient(BaseLLMClient):
+    """asyncio counterpart of LLMClient built on a pooled httpx.AsyncClient."""
+    def __init__(self, api_base: str, api_key: str, **settings):
+        super().__init__(api_base, api_key, **settings)
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+
+    async def post(self, path: str, payload: Dict[str, Any], stream: bool = False) -> Optional[httpx.Response]:
+        """POST with retries; returns the successful response, or None once retries are exhausted."""
+        request = self.client.build_request('POST', self._url(path), json=payload)
+        deadline = time.monotonic() + self.total_timeout
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                logger.warning("LLM request error (attempt %s): %s", attempt + 1, e)
+                retryable = isinstance(e, ASYNC_RETRY_ERRORS) or (self.retry_read_timeouts and isinstance(e, httpx.ReadTimeout))
+                delay = self._next_retry(attempt, deadline) if retryable else None
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code == 200:
+                return response
+
+            await response.aread()
+            await response.aclose()
+            delay = self._next_retry(attempt, deadline, response) if response.status_code in RETRY_STATUS_CODES else None
+            if delay is not None:
+                logger.warning("LLM request returned %s, retrying in %.2fs", response.status_code, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            logger.error("API request failed, status code: %s", response.status_code)
+            logger.error("Error message: %s", response.text)
+            return None
+        return None
+
+    async def chat_completion(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = await self.post('chat/completions', payload)
+        if response is None:
+            return None
+        try:
+            return response.json()
+        except ValueError as e:
+            logger.error("Error decoding LLM response: %s", e)
+            return None
+
+    async def stream_chat_completion(self, payload: Dict[str, Any],
+                                     on_usage: Optional[Callable[[Dict[str, Any]], None]] = None) -> AsyncIterator[str]:
+        response = await self.post('chat/completions', dict(payload, stream=True), stream=True)
+        if response is None:
+            return
+        try:
+            async for line in response.aiter_lines():
+                content = self._parse_stream_line(line, on_usage)
+                if content is None:
+                    break
+                if content:
+                    yield content
+        except httpx.TransportError as e:
+            logger.warning("LLM stream interrupted: %s", e)
+        finally:
+            await response.aclose()
+
+def _client_settings() -> Dict[str, Any]:
+    return {
+        'pool_size': int(os.getenv('LLM_POOL_SIZE', '20')),
+        'connect_timeout': float(os.getenv('LLM_CONNECT_TIMEOUT', '3.05')),
+        'read_timeout': float(os.getenv('LLM_READ_TIMEOUT', '10')),
+        'max_retries': int(os.getenv('LLM_MAX_RETRIES', '3')),
+        'backoff_base': float(os.getenv('LLM_BACKOFF_BASE', '0.5')),
+        'backoff_max': float(os.getenv('LLM_BACKOFF_MAX', '8')),
+        'total_timeout': float(os.getenv('LLM_TOTAL_TIMEOUT', '30')),
+        'retry_read_timeouts': os.getenv('LLM_RETRY_READ_TIMEOUTS', '0') == '1'
+    }
+
+_clients: Dict[tuple, BaseLLMClient] = {}
+_clients_lock = threading.Lock()
+
+def get_llm_client(api_base: str, api_key: str) -> LLMClient:
+    """Shared client per API endpoint and process (pooled sockets must not cross a fork)."""
+    key = (api_base, api_key, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = LLMClient(api_base, api_key, **_client_settings())
+                _clients[key] = client
+    return client
+
+def get_async_llm_client(api_base: str, api_key: str) -> AsyncLLMClient:
+    """Shared async client per API endpoint, process and event loop (httpx pools are loop-bound)."""
+    key = ('async', api_base, api_key, os.getpid(), id(asyncio.get_running_loop()))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = AsyncLLMClient(api_base, api_key, **_client_settings())
+                _clients[key] = client
+    return client
@@ -0,0 +1,188 @@
+import functools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}')
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects, per label combination."""
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (made cumulative when rendered), then sum and count.
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(dict(labels, le="+Inf"))} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+class MetricsRegistry:
+    """Metrics owned by this process plus collectors that read other components' stats at scrape time.
+
+    Each worker process keeps its own registry, so a multi-worker deployment is scraped per worker.
+    """
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[tuple]]) -> None:
+        """collector() yields (name, type, help, [(labels, value), ...]) for gauges read on demand."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram('chat_stage_duration_seconds', 'Latency of each chat pipeline stage', ['stage'])
+REQUEST_SECONDS = registry.histogram('chat_request_duration_seconds', 'End-to-end chat request latency',
+                                     ['endpoint', 'outcome'])
+LLM_TOKENS = registry.counter('llm_tokens_total', 'Tokens reported by the LLM API', ['stage', 'kind'])
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage into chat_stage_duration_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug("stage=%s duration_ms=%.1f", stage, elapsed * 1000)
+
+def timed(stage: str):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_usage(stage: str, usage: Optional[Dict[str, Any]]) -> None:
+    if not usage:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        value = usage.get(kind)
+        if isinstance(value, (int, float)):
+            LLM_TOKENS.inc(value, stage=stage, kind=kind.split('_')[0])
+
+def stats_collector(prefix: str, help_text: str, read_stats: Callable[[], Dict[str, Any]],
+                    label: Optional[str] = None) -> Callable[[], Iterable[tuple]]:
+    """Expose the numeric fields of a component's stats() dict as gauges named <prefix>_<field>.
+
+    With label, read_stats returns {label value: stats dict} and each field becomes one family
+    with a sample per label value.
+    """
+    def collect():
+        stats = read_stats()
+        groups = stats.items() if label else [(None, stats)]
+        families: Dict[str, list] = {}
+        for label_value, fields in groups:
+            labels = {label: label_value} if label else {}
+            for field, value in fields.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                families.setdefault(field, []).append((labels, value))
+        for field, samples in families.items():
+            yield f'{prefix}_{field}', 'gauge', f'{help_text}: {field}', samples
+    return collect
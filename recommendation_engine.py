@@ -1,86 +1,1055 @@
+import copy
 import json
 import os
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
 os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
+from cache import LRUCache
+from embedding_batcher import EmbeddingBatcher
+from metrics import span
 
-class RecommendationEngine:
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+DEFAULT_PRODUCT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'products.json')
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), 'data', 'index_cache')
+# Bump when the product text template or index layout changes so stale artifacts are ignored.
+ARTIFACT_VERSION = 3
+INDEX_TYPES = ('flat', 'ivf', 'ivfpq', 'hnsw')
+FILTER_KEYS = ('price_min', 'price_max', 'brands', 'categories', 'min_qty')
+PRICE_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+DEFAULT_INDEX_PARAMS = {
+    'nlist': 1024,
+    'pq_m': 16,
+    'pq_nbits': 8,
+    'hnsw_m': 32,
+    'ef_construction': 200
+}
+
+def build_faiss_index(vectors, ids, index_type='flat', nlist=1024, pq_m=16, pq_nbits=8, hnsw_m=32, ef_construction=200):
+    """Build an id-mapped FAISS index of the given type.
+
+    flat is exact; ivf/ivfpq cluster the vectors into nlist lists (ivfpq also compresses them
+    with product quantization); hnsw builds a navigable small-world graph. Configurations the
+    data can't train (too few vectors for PQ, dimension not divisible by pq_m) fall back to ivf.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    ids = np.asarray(ids, dtype='int64')
+    count, dimension = vectors.shape
+
+    if index_type == 'ivfpq' and (count < 2 ** pq_nbits or dimension % pq_m != 0):
+        logger.warning("Can't train PQ%sx%s on %s vectors of dimension %s, using ivf", pq_m, pq_nbits, count, dimension)
+        index_type = 'ivf'
+    if index_type in ('ivf', 'ivfpq') and count == 0:
+        index_type = 'flat'
+
+    if index_type == 'flat':
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+    elif index_type == 'hnsw':
+        graph = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        graph.hnsw.efConstruction = ef_construction
+        index = faiss.IndexIDMap2(graph)
+    else:
+        # k-means wants roughly 39 training points per centroid.
+        nlist = max(1, min(nlist, count // 39))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == 'ivf':
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits)
+        index.train(vectors)
+
+    if count:
+        index.add_with_ids(vectors, ids)
+    return index
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply search-time knobs; knobs that don't apply to the index type are ignored."""
+    parameter_space = faiss.ParameterSpace()
+    for name, value in (('nprobe', nprobe), ('efSearch', ef_search)):
+        if value is None:
+            continue
+        try:
+            parameter_space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+    return index
+
+def parse_price(value):
+    """'$1,299.00' -> 1299.0; NaN when there is no number."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = PRICE_PATTERN.search(str(value or '').replace(',', ''))
+    return float(match.group()) if match else float('nan')
+
+def _filter_number(name, value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Filter {name} must be a number, got {value!r}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Filter {name} must be a number, got {value!r}") from None
+    if math.isnan(number):
+        raise ValueError(f"Filter {name} must be a number, got {value!r}")
+    return number
+
+def _filter_names(name, value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple, set)) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"Filter {name} must be a string or a list of strings, got {value!r}")
+    return list(value)
+
+def normalize_filters(filters):
+    """The FILTER_KEYS of a filters dict with numbers coerced to float and a single brand or
+    category wrapped in a list. Raises ValueError for values that can't be used."""
+    if filters is None:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError(f"Filters must be a mapping, got {type(filters).__name__}")
+    return {
+        'price_min': _filter_number('price_min', filters.get('price_min')),
+        'price_max': _filter_number('price_max', filters.get('price_max')),
+        'brands': _filter_names('brands', filters.get('brands')),
+        'categories': _filter_names('categories', filters.get('categories')),
+        'min_qty': _filter_number('min_qty', filters.get('min_qty'))
+    }
+
+def category_terms(text):
+    """Lower-cased words with a plural 's' stripped, so 'running shoes' meets 'Shoes'."""
+    terms = set()
+    for word in re.findall(r'\w+', str(text).casefold()):
+        terms.add(word[:-1] if len(word) > 3 and word.endswith('s') else word)
+    return terms
+
+class AttributeStore:
+    """Columnar product attributes aligned with catalog rows: parsed price and quantity plus
+    brand/category codes, so filters are NumPy masks instead of per-product Python checks."""
+    COLUMNS = (('price', np.nan), ('qty', -1), ('brand_codes', 0), ('category_codes', 0))
+
+    def __init__(self, products):
+        count = len(products)
+        self.price = np.full(count, np.nan, dtype='float64')
+        self.qty = np.full(count, -1, dtype='int64')
+        self.brand_codes = np.empty(count, dtype='int32')
+        self.category_codes = np.empty(count, dtype='int32')
+        self.brands = {}
+        self.categories = {}
+        self._category_terms = {}
+        for row, product in enumerate(products):
+            self.set_row(row, product)
+
+    def set_row(self, row, product):
+        self.price[row] = parse_price(product.get('price'))
+        try:
+            self.qty[row] = int(product.get('qty'))
+        except (TypeError, ValueError):
+            self.qty[row] = -1
+        brand = str(product.get('brand') or '').strip().casefold()
+        category = str(product.get('category') or '').strip().casefold()
+        self.brand_codes[row] = self.brands.setdefault(brand, len(self.brands))
+        if category not in self.categories:
+            self.categories[category] = len(self.categories)
+            self._category_terms[self.categories[category]] = category_terms(category)
+        self.category_codes[row] = self.categories[category]
+
+    def copy(self):
+        """An independent copy to patch for the next snapshot (arrays and code tables are copied)."""
+        store = copy.copy(self)
+        for name, _ in self.COLUMNS:
+            setattr(store, name, getattr(self, name).copy())
+        store.brands = dict(self.brands)
+        store.categories = dict(self.categories)
+        store._category_terms = dict(self._category_terms)
+        return store
+
+    def move_row(self, source, target):
+        for name, _ in self.COLUMNS:
+            column = getattr(self, name)
+            column[target] = column[source]
+
+    def resize(self, count):
+        """Truncate to count rows, or pad with empty rows to be filled with set_row."""
+        for name, fill in self.COLUMNS:
+            column = getattr(self, name)
+            if count <= len(column):
+                setattr(self, name, column[:count])
+            else:
+                padding = np.full(count - len(column), fill, dtype=column.dtype)
+                setattr(self, name, np.concatenate([column, padding]))
+
+    def brand_codes_for(self, brands):
+        names = (str(brand).strip().casefold() for brand in brands)
+        return [self.brands[name] for name in names if name in self.brands]
+
+    def category_codes_for(self, categories):
+        requested = set()
+        for category in categories:
+            requested |= category_terms(category)
+        return [code for code, terms in self._category_terms.items() if terms & requested]
+
+    def mask(self, price_min=None, price_max=None, brands=None, categories=None, min_qty=None):
+        """Boolean row mask for the constraints, or None when none of them applies.
+
+        Brands and categories the catalog doesn't know are ignored rather than matching nothing,
+        since they usually come from free-form intent extraction. Values are validated with
+        normalize_filters, so bad input raises ValueError.
+        """
+        filters = normalize_filters({'price_min': price_min, 'price_max': price_max, 'brands': brands,
+                                     'categories': categories, 'min_qty': min_qty})
+        price_min, price_max, min_qty = filters['price_min'], filters['price_max'], filters['min_qty']
+        brands, categories = filters['brands'], filters['categories']
+        mask = np.ones(len(self.price), dtype=bool)
+        constrained = False
+        if price_min is not None:
+            mask &= self.price >= price_min
+            constrained = True
+        if price_max is not None:
+            mask &= self.price <= price_max
+            constrained = True
+        if min_qty is not None:
+            mask &= self.qty >= min_qty
+            constrained = True
+        brand_codes = self.brand_codes_for(brands or [])
+        if brand_codes:
+            mask &= np.isin(self.brand_codes, brand_codes)
+            constrained = True
+        category_codes = self.category_codes_for(categories or [])
+        if category_codes:
+            mask &= np.isin(self.category_codes, category_codes)
+            constrained = True
+        return mask if constrained else None
+
+class NeighborTable:
+    """Precomputed top-k similar products per catalog row: int32 product ids (-1 padded) and
+    float16 similarity scores, best first."""
+    def __init__(self, ids, scores):
+        self.ids = ids
+        self.scores = scores
+
+    @property
+    def k(self):
+        return self.ids.shape[1]
+
+class ReadWriteLock:
+    """Any number of readers or one writer; a waiting writer holds off new readers.
+
+    FAISS indexes can be searched from many threads at once but not while ids are added or
+    removed, so searches read and in-place index updates write.
+    """
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.products = self._load_products()
-        self.product_texts = self._prepare_product_texts()
-        self.vectors = self.model.encode(self.product_texts)
-        self.index = self._create_faiss_index(self.vectors)
-    
-    def _load_products(self):
-        product_path = os.path.join(os.path.dirname(__file__), 'data', 'products.json')
-        with open(product_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
-    def _prepare_product_texts(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writer:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            while self._writer:
+                self._condition.wait()
+            self._writer = True
+            while self._readers:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+class CatalogState:
+    """Snapshot of the catalog and its index. Updates build a new snapshot and swap it in,
+    so a reader holding one never sees a half-applied change to its rows.
+
+    The FAISS index and the vector buffer are shared with the next snapshot and updated in
+    place (see derive), so a reader on an older snapshot may already score a replaced product
+    by its new vector, and skips ids its rows don't know yet.
+    """
+    def __init__(self, products, product_texts, vectors, index, version=0, neighbors=None):
+        self.products = products
+        self.product_texts = product_texts
+        self.vectors = vectors
+        # The vectors are a prefix of this buffer; later snapshots append into the spare rows.
+        self._vector_buffer = vectors
+        self.index = index
+        self.version = version
+        self.neighbors = neighbors
+        self.row_by_id = {product['id']: row for row, product in enumerate(products)}
+        # Columnar id store: FAISS returns arrays of product ids, map them to rows without a Python scan.
+        self.ids = np.array([product['id'] for product in products], dtype='int64')
+        self._id_order = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self._id_order]
+        self.attributes = AttributeStore(products)
+
+    def derive(self, products, product_texts, vectors, removed_ids):
+        """The next snapshot, with removed_ids dropped and products added or replaced by id.
+
+        Only changed rows are touched: a removed row is filled with the last row, the id map,
+        sorted ids and attribute arrays are copied and patched instead of rebuilt, and vectors
+        are written into the shared buffer (appended rows beyond this snapshot's prefix). The
+        buffer is copied only when it is read-only, full, or rows have to move. The index and
+        neighbour table are left to the caller.
+        """
+        state = copy.copy(self)
+        state.version = self.version + 1
+        state.neighbors = None
+        row_by_id = state.row_by_id = dict(self.row_by_id)
+        all_products = state.products = list(self.products)
+        all_texts = state.product_texts = list(self.product_texts)
+        ids = self.ids.copy()
+        attributes = state.attributes = self.attributes.copy()
+
+        count = len(all_products)
+        added_ids = [product['id'] for product in products if product['id'] not in row_by_id]
+        new_count = count - len(removed_ids) + len(added_ids)
+        buffer = self._vector_buffer
+        if removed_ids or not buffer.flags.writeable or new_count > len(buffer):
+            # Room to append about an eighth more rows before the buffer is copied again.
+            capacity = max(count, new_count + max(new_count // 8, 64))
+            buffer = np.empty((capacity, buffer.shape[1]), dtype='float32')
+            buffer[:count] = self.vectors
+        state._vector_buffer = buffer
+
+        moved_ids = []
+        for product_id in removed_ids:
+            row = row_by_id.pop(product_id)
+            last = len(all_products) - 1
+            if row != last:
+                all_products[row] = all_products[last]
+                all_texts[row] = all_texts[last]
+                ids[row] = ids[last]
+                buffer[row] = buffer[last]
+                attributes.move_row(last, row)
+                row_by_id[all_products[row]['id']] = row
+                moved_ids.append(all_products[row]['id'])
+            all_products.pop()
+            all_texts.pop()
+
+        ids = np.concatenate([ids[:len(all_products)], np.zeros(len(added_ids), dtype='int64')])
+        attributes.resize(new_count)
+        for product, text, vector in zip(products, product_texts, vectors):
+            row = row_by_id.get(product['id'])
+            if row is None:
+                row = row_by_id[product['id']] = len(all_products)
+                all_products.append(product)
+                all_texts.append(text)
+            else:
+                all_products[row] = product
+                all_texts[row] = text
+            ids[row] = product['id']
+            buffer[row] = vector
+            attributes.set_row(row, product)
+        state.ids = ids
+        state.vectors = buffer[:new_count]
+
+        sorted_ids, id_order = self._sorted_ids, self._id_order
+        if removed_ids:
+            positions = np.searchsorted(sorted_ids, np.asarray(removed_ids, dtype='int64'))
+            sorted_ids, id_order = np.delete(sorted_ids, positions), np.delete(id_order, positions)
+        if added_ids:
+            new_ids = np.sort(np.asarray(added_ids, dtype='int64'))
+            positions = np.searchsorted(sorted_ids, new_ids)
+            sorted_ids, id_order = np.insert(sorted_ids, positions, new_ids), np.insert(id_order, positions, 0)
+        touched_ids = moved_ids + added_ids
+        if touched_ids:
+            id_order[np.searchsorted(sorted_ids, np.asarray(touched_ids, dtype='int64'))] = \
+                [row_by_id[product_id] for product_id in touched_ids]
+        state._sorted_ids, state._id_order = sorted_ids, id_order
+        return state
+
+    def rows_for_ids(self, ids):
+        """Map an array of product ids to row positions; unknown ids map to -1."""
+        ids = np.asarray(ids, dtype='int64')
+        if not len(self._sorted_ids):
+            return np.full(ids.shape, -1, dtype='int64')
+        positions = np.clip(np.searchsorted(self._sorted_ids, ids), 0, len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[positions] == ids, self._id_order[positions], -1)
+
+class RecommendationEngine:
+    def __init__(self, model_name=None, product_path=None, cache_dir=None,
+                 index_type=None, index_params=None, search_params=None):
+        self.model_name = model_name or os.getenv('EMBEDDING_MODEL', DEFAULT_MODEL_NAME)
+        self.product_path = product_path or os.getenv('PRODUCTS_PATH', DEFAULT_PRODUCT_PATH)
+        self.cache_dir = cache_dir or os.getenv('RECOMMENDATION_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.index_type = index_type or os.getenv('RECOMMENDATION_INDEX', 'flat')
+        self.index_params = dict(DEFAULT_INDEX_PARAMS)
+        for name in DEFAULT_INDEX_PARAMS:
+            env_value = os.getenv(f"INDEX_{name.upper()}")
+            if env_value:
+                self.index_params[name] = int(env_value)
+        self.index_params.update(index_params or {})
+        self.search_params = {
+            'nprobe': int(os.getenv('INDEX_NPROBE', '16')),
+            'ef_search': int(os.getenv('INDEX_EF_SEARCH', '64'))
+        }
+        self.search_params.update(search_params or {})
+        # Imported here so that importing this module doesn't pull in torch.
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(self.model_name)
+        self._write_lock = threading.Lock()
+        self._index_lock = ReadWriteLock()
+        # Set while the live index is a read-only memory map of the saved artifact.
+        self._index_mapped = False
+        self._watcher = None
+        self._catalog_listeners = []
+        cache_ttl = float(os.getenv('QUERY_CACHE_TTL', '0')) or None
+        self._embedding_cache = LRUCache(int(os.getenv('EMBEDDING_CACHE_SIZE', '4096')), cache_ttl)
+        self._result_cache = LRUCache(int(os.getenv('RESULT_CACHE_SIZE', '4096')), cache_ttl)
+        # Filters leaving at most this many products are searched exactly over just those vectors.
+        self.filter_exact_max = int(os.getenv('FILTER_EXACT_MAX', '4096'))
+        self.batch_chunk_size = int(os.getenv('RECOMMENDATION_BATCH_CHUNK', '1024'))
+        self.neighbor_k = int(os.getenv('NEIGHBOR_TABLE_K', '20'))
+        batch_wait = float(os.getenv('EMBEDDING_BATCH_WAIT_MS', '5')) / 1000
+        self._batcher = None
+        if batch_wait > 0:
+            self._batcher = EmbeddingBatcher(self._encode, int(os.getenv('EMBEDDING_BATCH_SIZE', '32')), batch_wait,
+                                             float(os.getenv('EMBEDDING_BATCH_TIMEOUT', '10')))
+        products, self.catalog_hash, self.catalog_mtime = self._read_catalog()
+        product_texts = self._prepare_product_texts(products)
+        vectors, index, neighbors = self._load_or_build_index(products, product_texts)
+        self._state = CatalogState(products, product_texts, vectors, index, neighbors=neighbors)
+
+    @property
+    def products(self):
+        return self._state.products
+
+    @property
+    def product_texts(self):
+        return self._state.product_texts
+
+    @property
+    def vectors(self):
+        return self._state.vectors
+
+    @property
+    def index(self):
+        return self._state.index
+
+    @property
+    def version(self):
+        return self._state.version
+
+    @property
+    def attributes(self):
+        return self._state.attributes
+
+    def _read_catalog(self):
+        """The products file as (products, content hash, mtime)."""
+        mtime = os.path.getmtime(self.product_path)
+        with open(self.product_path, 'rb') as f:
+            raw = f.read()
+        return json.loads(raw.decode('utf-8')), hashlib.sha256(raw).hexdigest(), mtime
+
+    def _product_text(self, product):
+        return f"{product['name']} {product['description']} {product['brand']} {product['category']}"
+
+    def _prepare_product_texts(self, products):
         texts = []
-        for product in self.products:
-            text = f"{product['name']} {product['description']} {product['brand']} {product['category']}"
-            texts.append(text)
+        for product in products:
+            texts.append(self._product_text(product))
         return texts
+
+    def _encode(self, texts):
+        return np.asarray(self.model.encode(texts), dtype='float32')
     
-    def _create_faiss_index(self, vectors):
-        dimension = vectors.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        index.add(np.array(vectors).astype('float32'))
-        return index
+    def _create_faiss_index(self, vectors, ids):
+        # FAISS ids are product ids so rows can be removed and re-added individually.
+        index = build_faiss_index(vectors, ids, self.index_type, **self.index_params)
+        return set_search_params(index, **self.search_params)
+
+    def _update_index(self, index, remove_ids, add_vectors, add_ids, vectors, ids):
+        """Remove and (re-)add ids on the live index in place; searches wait only for the update itself."""
+        def apply(index):
+            if len(remove_ids):
+                index.remove_ids(np.asarray(remove_ids, dtype='int64'))
+            if len(add_ids):
+                index.add_with_ids(np.ascontiguousarray(add_vectors, dtype='float32'), np.asarray(add_ids, dtype='int64'))
+
+        try:
+            if self._index_mapped:
+                # A memory-mapped artifact can't grow; copy it once, later updates modify the copy.
+                index = faiss.clone_index(index)
+                apply(index)
+                self._index_mapped = False
+                return set_search_params(index, **self.search_params)
+            with self._index_lock.writing():
+                apply(index)
+            return index
+        except RuntimeError:
+            # HNSW graphs can't delete nodes (the removal fails before anything changes);
+            # rebuild from the stored vectors (no re-embedding).
+            return self._create_faiss_index(vectors, ids)
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Change search-time knobs; applies to the live index and to later rebuilds."""
+        if nprobe is not None:
+            self.search_params['nprobe'] = nprobe
+        if ef_search is not None:
+            self.search_params['ef_search'] = ef_search
+        with self._write_lock:
+            set_search_params(self._state.index, **self.search_params)
+            self._result_cache.clear()
+
+    def _swap_state(self, state, changed_ids=()):
+        self._state = state
+        # Results are keyed by catalog version too, clearing just frees the stale entries early.
+        self._result_cache.clear()
+        for listener in self._catalog_listeners:
+            try:
+                listener(changed_ids)
+            except Exception as e:
+                logger.error("Error notifying catalog listener: %s", e)
+
+    def add_catalog_listener(self, callback):
+        """Call callback(product_ids) after products are added, replaced or removed."""
+        self._catalog_listeners.append(callback)
+
+    def _normalize_query(self, text):
+        return ' '.join(text.casefold().split())
+
+    def encode_query(self, text):
+        """Embed a query, reusing the cached vector for repeated (normalized) text."""
+        key = self._normalize_query(text)
+        vector = self._embedding_cache.get(key)
+        if vector is None:
+            with span('embedding'):
+                vector = self._batcher.encode(text) if self._batcher else self._encode([text])[0]
+            vector.setflags(write=False)
+            self._embedding_cache.set(key, vector)
+        return vector
+
+    def encode_texts(self, texts):
+        """Embed a batch of texts in one model call, bypassing the query cache."""
+        return self._encode(list(texts))
+
+    def cache_stats(self):
+        stats = {
+            'embeddings': self._embedding_cache.stats(),
+            'results': self._result_cache.stats()
+        }
+        if self._batcher:
+            stats['batcher'] = self._batcher.stats()
+        return stats
+
+    def _artifact_key(self, catalog_hash=None):
+        index_spec = f"{self.index_type}:{sorted(self.index_params.items())}"
+        key = f"{catalog_hash or self.catalog_hash}:{self.model_name}:{index_spec}:{ARTIFACT_VERSION}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+    def _artifact_paths(self, catalog_hash=None):
+        prefix = os.path.join(self.cache_dir, self._artifact_key(catalog_hash))
+        return f"{prefix}.vectors.npy", f"{prefix}.faiss", f"{prefix}.neighbors.npz", f"{prefix}.ids.npy"
+
+    def _artifact_order(self, stored_ids, ids):
+        """Rows of artifacts saved in stored_ids order that line up with ids: a slice when the
+        order already matches, an index array when only the order differs, None otherwise.
+
+        After a reload the saved rows follow the engine's order (appended and compacted), not
+        the file's, so rows are always matched by product id, never by position.
+        """
+        stored_ids = np.asarray(stored_ids, dtype='int64')
+        if stored_ids.shape != ids.shape:
+            return None
+        if np.array_equal(stored_ids, ids):
+            return slice(None)
+        sorter = np.argsort(stored_ids, kind='stable')
+        positions = np.searchsorted(stored_ids, ids, sorter=sorter).clip(0, max(len(ids) - 1, 0))
+        order = sorter[positions]
+        if not np.array_equal(stored_ids[order], ids) or len(np.unique(order)) != len(order):
+            return None
+        return order
+
+    def _load_or_build_index(self, products, product_texts):
+        vectors_path, index_path, neighbors_path, ids_path = self._artifact_paths()
+        ids = np.array([product['id'] for product in products], dtype='int64')
+        if os.path.exists(vectors_path) and os.path.exists(index_path) and os.path.exists(ids_path):
+            try:
+                order = self._artifact_order(np.load(ids_path), ids)
+                vectors = np.load(vectors_path, mmap_mode='r')
+                index = set_search_params(self._read_index(index_path), **self.search_params)
+                if order is not None and index.ntotal == len(products) == vectors.shape[0]:
+                    logger.info("Loaded recommendation index artifacts from %s", self.cache_dir)
+                    if not isinstance(order, slice):
+                        # FAISS ids are product ids, so only the row-aligned arrays need reordering.
+                        vectors = np.ascontiguousarray(vectors[order])
+                    neighbors = self._load_neighbors(neighbors_path, ids)
+                    if neighbors is None and self.neighbor_k > 0:
+                        # Built from the stored vectors and index; nothing is re-embedded.
+                        neighbors = self._build_neighbors(vectors, ids, index)
+                        self._save_neighbors(neighbors, ids, neighbors_path)
+                    return vectors, index, neighbors
+            except (OSError, ValueError, RuntimeError) as e:
+                logger.error("Error loading recommendation index artifacts: %s", e)
+
+        vectors = self._encode(product_texts)
+        index = self._create_faiss_index(vectors, ids)
+        neighbors = self._build_neighbors(vectors, ids, index)
+        self._save_artifacts(vectors, index, neighbors, ids, vectors_path, index_path, neighbors_path, ids_path)
+        return vectors, index, neighbors
+
+    def _load_neighbors(self, neighbors_path, ids):
+        if self.neighbor_k <= 0 or not os.path.exists(neighbors_path):
+            return None
+        try:
+            with np.load(neighbors_path) as data:
+                order = self._artifact_order(data['row_ids'], ids)
+                if order is None:
+                    return None
+                neighbors = NeighborTable(data['ids'][order], data['scores'][order])
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Error loading neighbour table: %s", e)
+            return None
+        if neighbors.ids.shape != (len(ids), self.neighbor_k):
+            return None
+        return neighbors
+
+    def _save_neighbors(self, neighbors, row_ids, neighbors_path):
+        """Save the table with the product id of each row, so it is re-aligned by id on load."""
+        if neighbors is None:
+            return True
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{neighbors_path}.tmp-{os.getpid()}"
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, ids=neighbors.ids, scores=neighbors.scores, row_ids=np.asarray(row_ids, dtype='int64'))
+            os.replace(tmp_path, neighbors_path)
+            return True
+        except OSError as e:
+            logger.error("Error saving neighbour table: %s", e)
+            return False
+
+    def _read_index(self, index_path):
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            self._index_mapped = True
+            return index
+        except RuntimeError:
+            # Not every index type supports memory-mapped reads.
+            return faiss.read_index(index_path)
+
+    def _save_artifacts(self, vectors, index, neighbors, ids, vectors_path, index_path, neighbors_path, ids_path):
+        """Save the vectors, index and neighbour table together with the product id of each row.
+        Returns False if anything could not be written."""
+        # Write to temp files and rename so concurrent workers never read a partial artifact.
+        # The ids file is renamed last: without it the other files are never used.
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_suffix = f".tmp-{os.getpid()}"
+            with open(vectors_path + tmp_suffix, 'wb') as f:
+                np.save(f, vectors)
+            with open(ids_path + tmp_suffix, 'wb') as f:
+                np.save(f, np.asarray(ids, dtype='int64'))
+            faiss.write_index(index, index_path + tmp_suffix)
+            os.replace(vectors_path + tmp_suffix, vectors_path)
+            os.replace(index_path + tmp_suffix, index_path)
+            os.replace(ids_path + tmp_suffix, ids_path)
+        except (OSError, RuntimeError) as e:
+            logger.error("Error saving recommendation index artifacts: %s", e)
+            return False
+        return self._save_neighbors(neighbors, ids, neighbors_path)
+
+    def _neighbor_lists(self, index, query_vectors, query_ids, k):
+        """Top-k neighbours of each query product, excluding the product itself, as
+        (int32 ids, float16 scores); -1/0 pad rows with fewer than k neighbours."""
+        distances, ids = self._search_ids(index, query_vectors, k + 1)
+        distances = distances.astype('float64')
+        self_match = ids == np.asarray(query_ids, dtype='int64')[:, None]
+        distances[self_match | (ids < 0)] = np.inf
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        ids = np.take_along_axis(ids, order, axis=1)
+        missing = np.isinf(distances)
+        ids[missing] = -1
+        scores = np.where(missing, 0.0, 1 / (1 + np.where(missing, 0.0, distances)))
+        return ids.astype('int32'), scores.astype('float16')
+
+    def _build_neighbors(self, vectors, ids, index):
+        ids = np.asarray(ids, dtype='int64')
+        if self.neighbor_k <= 0:
+            return None
+        if len(ids) and (ids.max() > np.iinfo('int32').max or ids.min() < 0):
+            logger.warning("Product ids don't fit in int32, neighbour table disabled")
+            return None
+        return NeighborTable(*self._neighbor_lists(index, np.asarray(vectors, dtype='float32'), ids, self.neighbor_k))
+
+    def _update_neighbors(self, state, vectors, ids, index, changed_ids=(), removed_ids=()):
+        """Carry the neighbour table over to a new snapshot.
+
+        Rows whose list mentions a changed or removed product (and the changed products
+        themselves) are searched again; every other row keeps its list and only merges in the
+        exact scores of the changed products, which is all that can have moved.
+        """
+        table = state.neighbors
+        if table is None or table.k != self.neighbor_k:
+            return self._build_neighbors(vectors, ids, index)
+        ids = np.asarray(ids, dtype='int64')
+        if len(ids) and (ids.max() > np.iinfo('int32').max or ids.min() < 0):
+            return self._build_neighbors(vectors, ids, index)
+
+        count, k = len(ids), table.k
+        old_rows = state.rows_for_ids(ids)
+        carried = old_rows >= 0
+        neighbor_ids = np.full((count, k), -1, dtype='int32')
+        neighbor_scores = np.zeros((count, k), dtype='float16')
+        neighbor_ids[carried] = table.ids[old_rows[carried]]
+        neighbor_scores[carried] = table.scores[old_rows[carried]]
+
+        changed_ids = np.asarray(list(changed_ids), dtype='int64')
+        stale_ids = np.concatenate([changed_ids, np.asarray(list(removed_ids), dtype='int64')])
+        recompute = ~carried | np.isin(ids, changed_ids) | np.isin(neighbor_ids, stale_ids).any(axis=1)
+
+        merge_rows = np.flatnonzero(~recompute)
+        if len(changed_ids) and len(merge_rows):
+            changed_rows = np.flatnonzero(np.isin(ids, changed_ids))
+            changed_vectors = np.asarray(vectors[changed_rows], dtype='float32')
+            changed_norms = (changed_vectors ** 2).sum(axis=1)
+            candidate_ids = np.broadcast_to(ids[changed_rows].astype('int32'), (self.batch_chunk_size, len(changed_rows)))
+            for start in range(0, len(merge_rows), self.batch_chunk_size):
+                rows = merge_rows[start:start + self.batch_chunk_size]
+                row_vectors = np.asarray(vectors[rows], dtype='float32')
+                distances = (row_vectors ** 2).sum(axis=1)[:, None] - 2 * row_vectors @ changed_vectors.T + changed_norms
+                scores = np.concatenate([neighbor_scores[rows].astype('float32'), 1 / (1 + np.maximum(distances, 0))], axis=1)
+                merged_ids = np.concatenate([neighbor_ids[rows], candidate_ids[:len(rows)]], axis=1)
+                order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+                neighbor_ids[rows] = np.take_along_axis(merged_ids, order, axis=1)
+                neighbor_scores[rows] = np.take_along_axis(scores, order, axis=1)
+
+        recompute_rows = np.flatnonzero(recompute)
+        if len(recompute_rows):
+            query_vectors = np.asarray(vectors[recompute_rows], dtype='float32')
+            neighbor_ids[recompute_rows], neighbor_scores[recompute_rows] = self._neighbor_lists(
+                index, query_vectors, ids[recompute_rows], k)
+        return NeighborTable(neighbor_ids, neighbor_scores)
+
+    def _apply_changes(self, products, product_texts, vectors, removed_ids):
+        """Publish one new snapshot with products upserted and removed_ids dropped.
+        The caller holds the write lock."""
+        state = self._state
+        removed_ids = [pid for pid in dict.fromkeys(removed_ids) if pid in state.row_by_id]
+        if not products and not removed_ids:
+            return {'added': 0, 'updated': 0, 'removed': 0}
+
+        ids = np.array([product['id'] for product in products], dtype='int64')
+        existing_ids = [product['id'] for product in products if product['id'] in state.row_by_id]
+        new_state = state.derive(products, product_texts, vectors, removed_ids)
+        new_state.index = self._update_index(state.index, existing_ids + removed_ids, vectors, ids,
+                                             new_state.vectors, new_state.ids)
+        new_state.neighbors = self._update_neighbors(state, new_state.vectors, new_state.ids, new_state.index,
+                                                     changed_ids=ids, removed_ids=removed_ids)
+        self._swap_state(new_state, ids.tolist() + removed_ids)
+        return {'added': len(products) - len(existing_ids), 'updated': len(existing_ids), 'removed': len(removed_ids)}
+
+    def upsert_products(self, products):
+        """Add new products or replace existing ones by id, embedding only these rows."""
+        latest = {}
+        for product in products:
+            latest[product['id']] = product
+        if not latest:
+            return {'added': 0, 'updated': 0}
+
+        products = list(latest.values())
+        product_texts = self._prepare_product_texts(products)
+        new_vectors = self._encode(product_texts)
+
+        with self._write_lock:
+            summary = self._apply_changes(products, product_texts, new_vectors, [])
+        return {'added': summary['added'], 'updated': summary['updated']}
+
+    def remove_products(self, product_ids):
+        """Remove products by id; unknown ids are ignored."""
+        with self._write_lock:
+            summary = self._apply_changes([], [], [], product_ids)
+        return {'removed': summary['removed']}
+
+    def apply_catalog(self, products):
+        """Diff a full catalog against the loaded one and apply only the changes as one snapshot."""
+        # The diff is taken under the write lock (and embedded there too), so an upsert that lands
+        # in between can't be undone by a diff computed against an older snapshot.
+        with self._write_lock:
+            state = self._state
+            incoming = {product['id']: product for product in products}
+            changed = [product for pid, product in incoming.items()
+                       if pid not in state.row_by_id or state.products[state.row_by_id[pid]] != product]
+            removed = [pid for pid in state.row_by_id if pid not in incoming]
+            product_texts = self._prepare_product_texts(changed)
+            vectors = self._encode(product_texts) if changed else []
+            return self._apply_changes(changed, product_texts, vectors, removed)
+
+    def reload_catalog(self):
+        """Re-read the products file and apply the diff; a no-op when the file content is unchanged.
+
+        The file is only recorded as loaded once the diff is applied and saved, so a failed
+        reload is retried by the next call instead of being skipped as unchanged.
+        """
+        products, catalog_hash, mtime = self._read_catalog()
+        if catalog_hash == self.catalog_hash:
+            self.catalog_mtime = mtime
+            return {'added': 0, 'updated': 0, 'removed': 0}
+
+        summary = self.apply_catalog(products)
+        # Held while saving: the next update would modify the index and vector buffer in place.
+        with self._write_lock:
+            state = self._state
+            saved = self._save_artifacts(state.vectors, state.index, state.neighbors, state.ids,
+                                         *self._artifact_paths(catalog_hash))
+        if saved:
+            self.catalog_hash = catalog_hash
+            self.catalog_mtime = mtime
+        logger.info("Reloaded product catalog: %s", summary)
+        return summary
+
+    def start_catalog_watcher(self, interval):
+        """Poll the products file and apply changes in the background."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    if os.path.getmtime(self.product_path) != self.catalog_mtime:
+                        self.reload_catalog()
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error("Error reloading product catalog: %s", e)
+
+        self._watcher = threading.Thread(target=watch, name='catalog-watcher', daemon=True)
+        self._watcher.start()
     
-    def recommend_products(self, product_id, top_k=5):
-        product_index = None
-        for i, product in enumerate(self.products):
-            if product['id'] == product_id:
-                product_index = i
-                break
-        
-        if product_index is None:
-            raise ValueError(f"Didn't find product with id {product_id}.")
-        
-        query_vector = np.array([self.vectors[product_index]]).astype('float32')
-        
-        distances, indices = self.index.search(query_vector, top_k + 1)
-        
+    def _collect(self, state, distances, rows, top_k, exclude_row=None):
         recommended_products = []
-        for i in range(1, top_k + 1):
-            idx = indices[0][i]
+        for distance, row in zip(distances, rows):
+            if row < 0 or row == exclude_row:
+                continue
             recommended_products.append({
-                'product': self.products[idx],
-                'similarity': 1 / (1 + distances[0][i])
+                'product': state.products[row],
+                'similarity': 1 / (1 + distance)
             })
-        
+            if len(recommended_products) == top_k:
+                break
         return recommended_products
+
+    def _search_ids(self, index, query_vectors, k):
+        """One FAISS search per chunk of query rows; returns (distances, product ids) matrices."""
+        distances = np.empty((len(query_vectors), k), dtype='float32')
+        ids = np.empty((len(query_vectors), k), dtype='int64')
+        for start in range(0, len(query_vectors), self.batch_chunk_size):
+            end = start + self.batch_chunk_size
+            chunk = np.ascontiguousarray(query_vectors[start:end], dtype='float32')
+            with self._index_lock.reading():
+                distances[start:end], ids[start:end] = index.search(chunk, k)
+        return distances, ids
+
+    def _search_matrix(self, state, query_vectors, k):
+        with span('vector_search'):
+            distances, ids = self._search_ids(state.index, query_vectors, k)
+        return distances, state.rows_for_ids(ids)
+
+    def recommend_products(self, product_id, top_k=5):
+        if self._state.row_by_id.get(product_id) is None:
+            raise ValueError(f"Didn't find product with id {product_id}.")
+        return self.recommend_products_batch([product_id], top_k)[0]
+
+    def recommend_products_batch(self, product_ids, top_k=5):
+        """Similar products for many products in one matrix search, in request order.
+
+        Unknown ids give None. Each product is dropped from its own list by row rather than by
+        assuming it ranks first, so exact duplicates of it are still returned.
+        """
+        state = self._state
+        results = [None] * len(product_ids)
+        positions = []
+        query_rows = []
+        for position, product_id in enumerate(product_ids):
+            row = state.row_by_id.get(product_id)
+            if row is not None:
+                positions.append(position)
+                query_rows.append(row)
+        if not query_rows:
+            return results
+
+        if state.neighbors is not None and top_k <= state.neighbors.k:
+            # Item-to-item answers are precomputed; this is an array lookup, not a search.
+            neighbor_ids = state.neighbors.ids[query_rows, :top_k]
+            scores = state.neighbors.scores[query_rows, :top_k]
+            rows = state.rows_for_ids(np.where(neighbor_ids >= 0, neighbor_ids, -1))
+            for j, position in enumerate(positions):
+                results[position] = [
+                    {'product': state.products[row], 'similarity': float(score)}
+                    for row, score in zip(rows[j], scores[j]) if row >= 0
+                ]
+            return results
+
+        query_vectors = np.asarray(state.vectors[np.asarray(query_rows)], dtype='float32')
+        distances, rows = self._search_matrix(state, query_vectors, top_k + 1)
+        for j, position in enumerate(positions):
+            results[position] = self._collect(state, distances[j], rows[j], top_k, exclude_row=query_rows[j])
+        return results
     
-    def recommend_by_text(self, text, top_k=5):
-        query_vector = self.model.encode([text])
-        query_vector = np.array(query_vector).astype('float32')
+    def _filter_key(self, filters):
+        key = []
+        for name in FILTER_KEYS:
+            value = filters.get(name)
+            if isinstance(value, list):
+                value = tuple(sorted(v.casefold() for v in value))
+            key.append(value)
+        return tuple(key)
+
+    def _filtered_search(self, state, query_vector, mask, top_k):
+        """Nearest neighbours among the rows where mask is set, as (distances, rows)."""
+        allowed_rows = np.flatnonzero(mask)
+        k = min(top_k, len(allowed_rows))
+        if k == 0:
+            return np.empty(0, dtype='float32'), np.empty(0, dtype='int64')
+
+        if len(allowed_rows) > self.filter_exact_max:
+            # Let FAISS skip disallowed ids during the search itself.
+            selector = faiss.IDSelectorBatch(state.ids[allowed_rows])
+            if faiss.try_extract_index_ivf(state.index) is not None:
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=self.search_params['nprobe'])
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            with self._index_lock.reading():
+                distances, indices = state.index.search(query_vector, k, params=params)
+            rows = state.rows_for_ids(indices[0])
+            found = rows >= 0
+            # Graph and IVF searches can come up short under a selective filter; fall through to exact.
+            if found.sum() >= k:
+                return distances[0][found], rows[found]
 
-        distances, indices = self.index.search(query_vector, top_k)
+        candidates = np.asarray(state.vectors[allowed_rows], dtype='float32')
+        distances = ((candidates - query_vector) ** 2).sum(axis=1)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind='stable')]
+        return distances[top], allowed_rows[top]
+
+    def recommend_by_text(self, text, top_k=5, filters=None):
+        """Nearest products to the text. filters may hold price_min, price_max, brands,
+        categories and min_qty; they are applied during the search, not after it. Invalid filter
+        values raise ValueError."""
+        state = self._state
+        filters = normalize_filters(filters)
+        mask = state.attributes.mask(**filters) if filters else None
+        # Filters that constrain nothing share the unfiltered cache entry.
+        filter_key = self._filter_key(filters) if mask is not None else None
+        cache_key = (self._normalize_query(text), top_k, state.version, filter_key)
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        query_vector = self.encode_query(text)[None, :]
+
+        with span('vector_search'):
+            if mask is None:
+                with self._index_lock.reading():
+                    distances, indices = state.index.search(query_vector, top_k)
+                distances, rows = distances[0], state.rows_for_ids(indices[0])
+            else:
+                distances, rows = self._filtered_search(state, query_vector, mask, top_k)
         
-        recommended_products = []
-        for i in range(top_k):
-            idx = indices[0][i]
-            recommended_products.append({
-                'product': self.products[idx],
-                'similarity': 1 / (1 + distances[0][i])
-            })
+        recommended_products = self._collect(state, distances, rows, top_k)
         
+        self._result_cache.set(cache_key, tuple(recommended_products))
         return recommended_products
+
+    def encode_queries(self, texts):
+        """Embed many queries, encoding the ones not already cached in a single model call."""
+        keys = [self._normalize_query(text) for text in texts]
+        vectors = {}
+        missing = {}
+        for text, key in zip(texts, keys):
+            if key in vectors or key in missing:
+                continue
+            vector = self._embedding_cache.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+        if missing:
+            with span('embedding'):
+                encoded = self._encode(list(missing.values()))
+            for key, row in zip(missing, encoded):
+                vector = np.array(row)
+                vector.setflags(write=False)
+                self._embedding_cache.set(key, vector)
+                vectors[key] = vector
+        return np.vstack([vectors[key] for key in keys])
+
+    def recommend_by_texts(self, texts, top_k=5, filters=None):
+        """Batch form of recommend_by_text: one encode call and one matrix search for all texts."""
+        texts = list(texts)
+        if not texts:
+            return []
+        state = self._state
+        filters = normalize_filters(filters)
+        query_vectors = self.encode_queries(texts)
+        mask = state.attributes.mask(**filters) if filters else None
+        if mask is None:
+            distances, rows = self._search_matrix(state, query_vectors, top_k)
+            return [self._collect(state, distances[j], rows[j], top_k) for j in range(len(texts))]
+        return [self._collect(state, *self._filtered_search(state, query_vectors[j:j + 1], mask, top_k), top_k)
+                for j in range(len(texts))]
     
     def get_product_by_id(self, product_id):
-        for product in self.products:
-            if product['id'] == product_id:
-                return product
-        return None
+        state = self._state
+        row = state.row_by_id.get(product_id)
+        return state.products[row] if row is not None else None
+
+    def get_products_by_ids(self, product_ids):
+        """Look up many products at once, in request order; unknown or non-integer ids are skipped."""
+        state = self._state
+        ids = []
+        for product_id in product_ids:
+            try:
+                ids.append(int(product_id))
+            except (TypeError, ValueError):
+                continue
+        rows = state.rows_for_ids(list(dict.fromkeys(ids)))
+        return [state.products[row] for row in rows if row >= 0]
 
 engine = None
+_engine_lock = threading.Lock()
 
 def get_recommendation_engine():
+    """The shared engine, built on first use; concurrent first callers wait for a single build."""
     global engine
     if engine is None:
-        engine = RecommendationEngine()
-    return engine
\ No newline at end of file
+        with _engine_lock:
+            if engine is None:
+                engine = RecommendationEngine()
+    watch_interval = float(os.getenv('CATALOG_WATCH_INTERVAL', '0'))
+    if watch_interval > 0 and (engine._watcher is None or not engine._watcher.is_alive()):
+        # Threads don't survive fork, so this also starts the watcher in each worker forked
+        # from a process that built the engine.
+        with _engine_lock:
+            engine.start_catalog_watcher(watch_interval)
+    return engine
+
+def recommendation_engine_loaded():
+    return engine is not None
\ No newline at end of file
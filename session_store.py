@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'sessions.db')
+DEFAULT_SESSION_TTL = 7 * 24 * 3600
+
+class MemorySessionStore:
+    """Per-process LRU store; only suitable for a single worker."""
+    def __init__(self, max_size=10000, ttl=DEFAULT_SESSION_TTL):
+        self.ttl = ttl
+        self._cache = LRUCache(max_size, ttl)
+
+    def get(self, session_id):
+        # Stored as JSON so callers never share mutable state with the store.
+        raw = self._cache.get(session_id)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, session_id, data):
+        self._cache.set(session_id, json.dumps(data, ensure_ascii=False))
+
+    def delete(self, session_id):
+        self._cache.pop(session_id)
+
+class SQLiteSessionStore:
+    """Sessions in a local SQLite file (WAL mode), shared by every worker on the host."""
+    def __init__(self, path=DEFAULT_SQLITE_PATH, ttl=DEFAULT_SESSION_TTL, purge_every=500):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+
+    def _connection(self):
+        # sqlite3 connections can't cross threads or forks; keep one per thread and process.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, session_id):
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE session_id = ? AND expires_at > ?",
+            (session_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, session_id, data):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, expires_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(data, ensure_ascii=False), time.time() + self.ttl)
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                connection.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, session_id):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+class RedisSessionStore:
+    """Sessions in Redis (or any server speaking its protocol), shared across hosts."""
+    def __init__(self, url, ttl=DEFAULT_SESSION_TTL, prefix='session:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, session_id):
+        raw = self.client.get(self.prefix + session_id)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, session_id, data):
+        self.client.setex(self.prefix + session_id, int(self.ttl), json.dumps(data, ensure_ascii=False))
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+def create_session_store():
+    """Store selected by SESSION_BACKEND: sqlite (default), memory or redis."""
+    backend = os.getenv('SESSION_BACKEND', 'sqlite')
+    ttl = float(os.getenv('SESSION_TTL', str(DEFAULT_SESSION_TTL)))
+    if backend == 'redis':
+        try:
+            return RedisSessionStore(os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0'), ttl)
+        except ImportError:
+            logger.warning("redis package not installed, falling back to the SQLite session store")
+            backend = 'sqlite'
+    if backend == 'memory':
+        return MemorySessionStore(int(os.getenv('SESSION_MAX_ENTRIES', '10000')), ttl)
+    return SQLiteSessionStore(os.getenv('SESSION_SQLITE_PATH', DEFAULT_SQLITE_PATH), ttl)
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a store; the cookie only carries a signed session id."""
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session')
+
+    def new_sid(self):
+        return secrets.token_urlsafe(24)
+
+    def sid_from_cookie(self, app, cookie_value):
+        if not cookie_value:
+            return None
+        try:
+            return self._signer(app).unsign(cookie_value).decode('utf-8')
+        except BadSignature:
+            return None
+
+    def cookie_value(self, app, sid):
+        return self._signer(app).sign(sid).decode('utf-8')
+
+    def open_session(self, app, request):
+        sid = self.sid_from_cookie(app, request.cookies.get(self.get_cookie_name(app)))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=self.new_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified:
+            self.store.set(session.sid, dict(session))
+        if session.new or session.modified:
+            response.set_cookie(
+                name,
+                self.cookie_value(app, session.sid),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
@@ -9,8 +9,20 @@ document.addEventListener('DOMContentLoaded', function () {
     const chatHistory = document.querySelector('.chat-history');
     const searchInput = document.querySelector('.sidebar-search input');
     
+    // 对话列表分页状态：下一页游标、是否正在加载、最近一次从第一页加载的请求序号
+    let historyCursor = null;
+    let historyLoading = false;
+    let historyRequest = 0;
+
     // 加载对话历史
     loadConversationHistory();
+
+    // 滚动到列表底部时自动加载下一页
+    chatHistory.addEventListener('scroll', function () {
+        if (this.scrollTop + this.clientHeight >= this.scrollHeight - 50) {
+            loadMoreConversations();
+        }
+    });
     
     // 搜索对话
     searchInput.addEventListener('input', function() {
@@ -150,15 +162,27 @@ document.addEventListener('DOMContentLoaded', function () {
             });
     }
 
-    function loadConversationHistory() {
-        // 从服务器获取对话历史
-        fetch('/api/conversations')
+    function loadConversationHistory(cursor) {
+        // 从服务器获取对话历史；传入游标时追加下一页，否则从第一页重新加载
+        const requestId = cursor ? historyRequest : ++historyRequest;
+        const url = '/api/conversations' + (cursor ? `?cursor=${encodeURIComponent(cursor)}` : '');
+        historyLoading = true;
+        fetch(url)
             .then(response => response.json())
-            .then(conversations => {
-                const chatHistory = document.querySelector('.chat-history');
-                chatHistory.innerHTML = '';
+            .then(data => {
+                // 加载期间列表已从第一页刷新，丢弃这一页
+                if (requestId !== historyRequest) {
+                    return;
+                }
+                if (!cursor) {
+                    chatHistory.innerHTML = '';
+                }
+                const loadMoreBtn = chatHistory.querySelector('.chat-history-load-more');
+                if (loadMoreBtn) {
+                    loadMoreBtn.remove();
+                }
                 
-                conversations.forEach(conv => {
+                data.conversations.forEach(conv => {
                     const convItem = document.createElement('div');
                     convItem.className = 'chat-history-item';
                     convItem.dataset.conversationId = conv.conversation_id;
@@ -216,16 +240,51 @@ document.addEventListener('DOMContentLoaded', function () {
                         }
                     });
                 });
+
+                historyCursor = data.next_cursor || null;
+                if (historyCursor) {
+                    const moreBtn = document.createElement('button');
+                    moreBtn.className = 'chat-history-load-more';
+                    moreBtn.textContent = 'Load more';
+                    moreBtn.addEventListener('click', loadMoreConversations);
+                    chatHistory.appendChild(moreBtn);
+                }
+
+                // 新加载的对话也按当前搜索词过滤
+                if (searchInput.value) {
+                    searchInput.dispatchEvent(new Event('input'));
+                }
             })
             .catch(error => {
                 console.error('Error loading conversation history:', error);
+            })
+            .finally(() => {
+                if (requestId === historyRequest) {
+                    historyLoading = false;
+                }
+            });
+    }
+
+    function loadMoreConversations() {
+        if (historyCursor && !historyLoading) {
+            loadConversationHistory(historyCursor);
+        }
+    }
+
+    function fetchConversationMessages(conversationId, cursor, messages = []) {
+        // 按游标逐页获取对话消息，直到没有下一页
+        const url = `/api/conversations/${conversationId}` + (cursor ? `?cursor=${encodeURIComponent(cursor)}` : '');
+        return fetch(url)
+            .then(response => response.json())
+            .then(data => {
+                messages = messages.concat(data.messages);
+                return data.next_cursor ? fetchConversationMessages(conversationId, data.next_cursor, messages) : messages;
             });
     }
 
     function loadConversation(conversationId) {
         // 从服务器获取对话详情
-        fetch(`/api/conversations/${conversationId}`)
-            .then(response => response.json())
+        fetchConversationMessages(conversationId)
             .then(messages => {
                 chatMessages.innerHTML = '';
                 
@@ -284,27 +343,76 @@ document.addEventListener('DOMContentLoaded', function () {
         chatMessages.appendChild(typingIndicator);
         chatMessages.scrollTop = chatMessages.scrollHeight;
 
-        fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ question: message })
-        })
-            .then(response => response.json())
-            .then(data => {
-                typingIndicator.remove();
+        let messageElement = null;
+        let reply = '';
 
-                const messageElement = addMessage(data.reply, 'assistant');
+        function handleEvent(event, data) {
+            if (event === 'token') {
+                if (!messageElement) {
+                    typingIndicator.remove();
+                    messageElement = addMessage('', 'assistant');
+                }
+                reply += data.text;
+                messageElement.querySelector('.message-body').innerHTML = reply;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event === 'done') {
+                typingIndicator.remove();
+                if (!messageElement) {
+                    messageElement = addMessage(data.reply, 'assistant');
+                }
+                messageElement.querySelector('.message-body').innerHTML = data.reply;
 
                 addFeedbackButtons(messageElement, data.conversation_id);
 
                 if (data.products && data.products.length > 0) {
                     showRecommendedProducts(data.products);
                 }
-                
+
                 // 重新加载对话历史
                 loadConversationHistory();
+            } else if (event === 'error') {
+                typingIndicator.remove();
+                addMessage(data.reply, 'assistant');
+            }
+        }
+
+        // 以SSE流式接收回复：逐个token渲染，最后一个事件携带推荐商品
+        fetch('/api/chat/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ question: message })
+        })
+            .then(response => {
+                if (!response.headers.get('Content-Type').startsWith('text/event-stream')) {
+                    return response.json().then(data => handleEvent('error', data));
+                }
+
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+
+                function read() {
+                    return reader.read().then(({ done, value }) => {
+                        if (done) return;
+                        buffer += decoder.decode(value, { stream: true });
+                        const events = buffer.split('\n\n');
+                        buffer = events.pop();
+                        events.forEach(raw => {
+                            let event = 'message';
+                            let data = '';
+                            raw.split('\n').forEach(line => {
+                                if (line.startsWith('event:')) event = line.slice(6).trim();
+                                else if (line.startsWith('data:')) data += line.slice(5).trim();
+                            });
+                            if (data) handleEvent(event, JSON.parse(data));
+                        });
+                        return read();
+                    });
+                }
+
+                return read();
             })
             .catch(error => {
                 console.error('API request error:', error);
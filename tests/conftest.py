@@ -0,0 +1,31 @@
+import hashlib
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class HashingSentenceTransformer:
+    """Deterministic bag-of-words embeddings, so engine tests run without downloading a model."""
+    dimension = 64
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def encode(self, texts, **kwargs):
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % self.dimension] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+@pytest.fixture(autouse=True)
+def hashing_encoder(monkeypatch):
+    module = types.ModuleType('sentence_transformers')
+    module.SentenceTransformer = HashingSentenceTransformer
+    monkeypatch.setitem(sys.modules, 'sentence_transformers', module)
+    monkeypatch.setenv('EMBEDDING_BATCH_WAIT_MS', '0')
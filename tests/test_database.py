@@ -0,0 +1,46 @@
+from mysql.connector import Error
+
+from database import ConnectionPool
+
+class FakeConnection:
+    def __init__(self, in_transaction=False, rollback_error=False):
+        self.in_transaction = in_transaction
+        self.rollback_error = rollback_error
+        self.rolled_back = False
+        self.closed = False
+
+    def is_connected(self):
+        raise AssertionError("release must not ping the server")
+
+    def rollback(self):
+        if self.rollback_error:
+            raise Error(msg='Lost connection to MySQL server')
+        self.rolled_back = True
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+def release(connection):
+    pool = ConnectionPool(size=1)
+    pool._slots.acquire()
+    pool.release(connection, 0.0)
+    return pool.stats()
+
+def test_release_returns_idle_connections_without_a_ping():
+    connection = FakeConnection()
+    stats = release(connection)
+    assert stats['idle'] == 1 and stats['discarded'] == 0
+    assert not connection.rolled_back
+
+def test_release_rolls_back_open_transactions():
+    connection = FakeConnection(in_transaction=True)
+    stats = release(connection)
+    assert connection.rolled_back
+    assert stats['idle'] == 1
+
+def test_release_discards_connections_that_fail_to_roll_back():
+    connection = FakeConnection(in_transaction=True, rollback_error=True)
+    stats = release(connection)
+    assert connection.closed
+    assert stats['idle'] == 0 and stats['discarded'] == 1
@@ -0,0 +1,47 @@
+import threading
+
+import numpy as np
+import pytest
+
+from embedding_batcher import EmbeddingBatcher
+
+def encode(texts):
+    return np.array([[float(len(text))] for text in texts])
+
+def test_concurrent_calls_share_a_batch():
+    batcher = EmbeddingBatcher(encode, max_batch_size=8, max_wait=0.05)
+    results = {}
+    threads = [threading.Thread(target=lambda t=t: results.setdefault(t, batcher.encode(t))) for t in ('a', 'bb', 'ccc')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {text: vector[0] for text, vector in results.items()} == {'a': 1.0, 'bb': 2.0, 'ccc': 3.0}
+    assert batcher.stats()['batches'] == 1
+
+def test_a_bad_batch_fails_its_callers_and_the_worker_keeps_running():
+    calls = []
+
+    def short_encode(texts):
+        calls.append(texts)
+        return encode(texts)[:0] if len(calls) == 1 else encode(texts)
+
+    batcher = EmbeddingBatcher(short_encode, max_wait=0)
+    with pytest.raises(ValueError):
+        batcher.encode('x')
+    assert batcher.encode('yy')[0] == 2.0
+
+def test_a_stuck_worker_falls_back_to_a_direct_encode():
+    release = threading.Event()
+
+    def slow_encode(texts):
+        if threading.current_thread().name == 'embedding-batcher':
+            release.wait(5)
+        return encode(texts)
+
+    batcher = EmbeddingBatcher(slow_encode, max_wait=0, timeout=0.05)
+    try:
+        assert batcher.encode('abcd')[0] == 4.0
+        assert batcher.stats()['timeouts'] == 1
+    finally:
+        release.set()
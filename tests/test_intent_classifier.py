@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from intent_classifier import IntentClassifier
+from recommendation_engine import RecommendationEngine
+
+PRODUCTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'products.json')
+HISTORY = [
+    {'role': 'user', 'content': 'recommend running shoes'},
+    {'role': 'assistant', 'content': 'Here are some running shoes.'}
+]
+
+@pytest.fixture
+def classifier(tmp_path):
+    engine = RecommendationEngine(product_path=PRODUCTS_PATH, cache_dir=str(tmp_path / 'index'))
+    return IntentClassifier(engine, enabled=True)
+
+def test_extracts_brands_categories_and_price(classifier):
+    parameters = classifier.extract_parameters('recommend Nike running shoes under $150')
+    assert parameters == {'price_range': {'max': 150.0}, 'brands': ['nike'], 'categories': ['shoes']}
+    assert classifier.extract_parameters('一款500到1000元的相机') == {
+        'price_range': {'min': 500.0, 'max': 1000.0}, 'categories': ['electronics, camera']}
+    assert classifier.extract_parameters('suggest a gift for my mother') == {}
+
+def test_unparsed_constraints_go_to_the_llm(classifier, monkeypatch):
+    monkeypatch.setattr(classifier, '_match_embedding', lambda question: 'product_recommendation')
+    assert classifier.extract_parameters('an affordable laptop') is None
+    assert classifier.classify('an affordable laptop') is None
+    assert classifier.classify('recommend Sony headphones') == {
+        'intent': 'product_recommendation', 'parameters': {'brands': ['sony']}, 'context': {}}
+
+def test_product_specific_intents_go_to_the_llm(classifier, monkeypatch):
+    monkeypatch.setattr(classifier, '_match_embedding', lambda question: 'product_details')
+    assert classifier.classify('tell me more about the PlayStation 5') is None
+
+def test_follow_ups_are_classified_with_history(classifier, monkeypatch):
+    monkeypatch.setattr(classifier, '_match_embedding', lambda question: 'product_recommendation')
+    assert classifier.classify('cheaper ones?', HISTORY) is None
+    assert classifier.stats()['context_fallbacks'] == 1
+    # Greetings and a new, self-contained request don't depend on the earlier turns.
+    assert classifier.classify('thanks', HISTORY)['intent'] == 'other'
+    assert classifier.classify('recommend a Canon camera', HISTORY)['parameters']['brands'] == ['canon']
+
+def test_the_current_question_is_not_an_earlier_turn(classifier, monkeypatch):
+    monkeypatch.setattr(classifier, '_match_embedding', lambda question: 'product_recommendation')
+    # start_turn appends the question to the session history before it is classified.
+    question = 'recommend running shoes like this under $100'
+    result = classifier.classify(question, [{'role': 'user', 'content': question}])
+    assert result['intent'] == 'product_recommendation'
+    assert result['parameters'] == {'price_range': {'max': 100.0}, 'categories': ['shoes']}
+    assert classifier.stats()['context_fallbacks'] == 0
+    assert classifier.classify(question, HISTORY + [{'role': 'user', 'content': question}]) is None
+    assert classifier.stats()['context_fallbacks'] == 1
@@ -0,0 +1,100 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from benchmarks.stub_llm import DEFAULT_REPLY, start_stub_llm
+from llm_client import AsyncLLMClient, LLMClient
+
+PAYLOAD = {'model': 'stub', 'messages': [{'role': 'user', 'content': 'recommend shoes'}]}
+SETTINGS = {'backoff_base': 0.01, 'backoff_max': 1.0}
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**settings):
+        server, url = start_stub_llm(**settings)
+        servers.append(server)
+        return server, url
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def reply(result):
+    return result['choices'][0]['message']['content']
+
+def test_retries_server_errors_honoring_retry_after(stub):
+    server, url = stub(failures=[503, 429], retry_after=0.2)
+    client = LLMClient(url, 'key', **SETTINGS)
+    start = time.monotonic()
+    assert reply(client.chat_completion(PAYLOAD)) == DEFAULT_REPLY
+    assert server.requests == 3
+    assert time.monotonic() - start >= 0.4
+
+def test_client_errors_are_not_retried(stub):
+    server, url = stub(failures=[400])
+    assert LLMClient(url, 'key', **SETTINGS).chat_completion(PAYLOAD) is None
+    assert server.requests == 1
+
+def test_read_timeouts_are_not_retried_by_default(stub):
+    server, url = stub(latency=0.5)
+    assert LLMClient(url, 'key', read_timeout=0.1, **SETTINGS).chat_completion(PAYLOAD) is None
+    assert server.requests == 1
+    assert LLMClient(url, 'key', read_timeout=0.1, retry_read_timeouts=True, max_retries=1,
+                     **SETTINGS).chat_completion(PAYLOAD) is None
+    assert server.requests == 3
+
+def test_connection_dropped_after_sending_is_not_retried_by_default(stub):
+    server, url = stub(failures=[0])
+    assert LLMClient(url, 'key', **SETTINGS).chat_completion(PAYLOAD) is None
+    assert server.requests == 1
+    server, url = stub(failures=[0])
+    assert reply(LLMClient(url, 'key', retry_read_timeouts=True, **SETTINGS).chat_completion(PAYLOAD)) == DEFAULT_REPLY
+    assert server.requests == 2
+
+def test_refused_connections_are_retried(monkeypatch):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = LLMClient(f'http://127.0.0.1:{port}', 'key', max_retries=2, **SETTINGS)
+    attempts = []
+    send = client.session.post
+    monkeypatch.setattr(client.session, 'post', lambda *args, **kwargs: attempts.append(1) or send(*args, **kwargs))
+    assert client.chat_completion(PAYLOAD) is None
+    assert len(attempts) == 3
+
+def test_no_retry_starts_past_the_deadline(stub):
+    server, url = stub(failures=[503] * 5, retry_after=1)
+    start = time.monotonic()
+    assert LLMClient(url, 'key', total_timeout=0.5, **SETTINGS).chat_completion(PAYLOAD) is None
+    assert server.requests == 1
+    assert time.monotonic() - start < 0.5
+
+def test_stream_yields_content_and_usage(stub):
+    server, url = stub(failures=[502])
+    usage = []
+    tokens = list(LLMClient(url, 'key', **SETTINGS).stream_chat_completion(
+        dict(PAYLOAD, stream_options={'include_usage': True}), usage.append))
+    assert ''.join(tokens).strip() == DEFAULT_REPLY
+    assert usage and usage[0]['completion_tokens'] > 0
+    assert server.requests == 2
+
+def test_async_client_retries_and_streams(stub):
+    server, url = stub(failures=[503], retry_after=0)
+
+    async def run():
+        client = AsyncLLMClient(url, 'key', **SETTINGS)
+        try:
+            result = await client.chat_completion(PAYLOAD)
+            tokens = [token async for token in client.stream_chat_completion(PAYLOAD)]
+        finally:
+            await client.client.aclose()
+        return result, tokens
+
+    result, tokens = asyncio.run(run())
+    assert reply(result) == DEFAULT_REPLY
+    assert ''.join(tokens).strip() == DEFAULT_REPLY
+    assert server.requests == 3
@@ -0,0 +1,163 @@
+import json
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_catalog import generate_catalog
+from recommendation_engine import RecommendationEngine
+
+@pytest.fixture
+def catalog(tmp_path):
+    products = generate_catalog(60, seed=1)
+    path = tmp_path / 'products.json'
+    path.write_text(json.dumps(products), encoding='utf-8')
+    return path, products
+
+def write(path, products):
+    path.write_text(json.dumps(products), encoding='utf-8')
+
+def make_engine(path, cache_dir):
+    return RecommendationEngine(product_path=str(path), cache_dir=str(cache_dir))
+
+def assert_same_neighbors(engine, expected, product_id, top_k=5):
+    """Same scores in the same order; products tied on score may come back in either order."""
+    got = engine.recommend_products(product_id, top_k)
+    scores = {item['product']['id']: item['similarity'] for item in expected.recommend_products(product_id, 20)}
+    assert [round(item['similarity'], 3) for item in got] == \
+        [round(item['similarity'], 3) for item in expected.recommend_products(product_id, top_k)]
+    for item in got:
+        assert round(scores[item['product']['id']], 3) == round(item['similarity'], 3)
+
+def test_reorder_reload_restart_matches_fresh_build(catalog, tmp_path):
+    path, products = catalog
+    engine = make_engine(path, tmp_path / 'index')
+
+    # Rows end up in engine order (removed rows refilled from the end, new rows appended), not file order.
+    changed = list(reversed(products[5:])) + generate_catalog(70, seed=2)[60:]
+    changed[0] = dict(changed[0], description='waterproof hiking boots with a non-slip sole')
+    write(path, changed)
+    engine.reload_catalog()
+    assert [p['id'] for p in engine.products] != [p['id'] for p in changed]
+
+    restarted = make_engine(path, tmp_path / 'index')
+    fresh = make_engine(path, tmp_path / 'fresh')
+    assert restarted.catalog_hash == fresh.catalog_hash
+    for product in changed[:20]:
+        row = restarted._state.row_by_id[product['id']]
+        fresh_row = fresh._state.row_by_id[product['id']]
+        np.testing.assert_allclose(restarted._state.vectors[row], fresh._state.vectors[fresh_row], atol=1e-6)
+        assert_same_neighbors(restarted, fresh, product['id'])
+    assert restarted.recommend_by_text('hiking boots', 5) == fresh.recommend_by_text('hiking boots', 5)
+
+def test_failed_save_leaves_catalog_pending(catalog, tmp_path, monkeypatch):
+    path, products = catalog
+    engine = make_engine(path, tmp_path / 'index')
+    previous_hash = engine.catalog_hash
+
+    write(path, products[:-1])
+    monkeypatch.setattr(engine, '_save_artifacts', lambda *args: False)
+    engine.reload_catalog()
+    assert engine.catalog_hash == previous_hash
+    assert len(engine.products) == len(products) - 1
+
+    monkeypatch.undo()
+    engine.reload_catalog()
+    assert engine.catalog_hash != previous_hash
+
+def assert_same_table(engine, expected):
+    """Each product's neighbour scores match; ids may differ only among products tied on score."""
+    table, fresh_table = engine._state.neighbors, expected._state.neighbors
+    for product_id, row in engine._state.row_by_id.items():
+        fresh_row = expected._state.row_by_id[product_id]
+        np.testing.assert_allclose(table.scores[row].astype('float32'),
+                                   fresh_table.scores[fresh_row].astype('float32'), atol=2e-3)
+        fresh_scores = dict(zip(fresh_table.ids[fresh_row].tolist(), fresh_table.scores[fresh_row].tolist()))
+        for neighbor_id, score in zip(table.ids[row].tolist(), table.scores[row].tolist()):
+            if neighbor_id in fresh_scores:
+                assert abs(fresh_scores[neighbor_id] - score) < 2e-3
+            else:
+                assert abs(score - fresh_table.scores[fresh_row][-1]) < 2e-3
+
+def test_incremental_neighbor_table_matches_fresh_build(catalog, tmp_path, monkeypatch):
+    monkeypatch.setenv('NEIGHBOR_TABLE_K', '8')
+    path, products = catalog
+    engine = make_engine(path, tmp_path / 'index')
+
+    extra = generate_catalog(75, seed=3)[60:]
+    engine.upsert_products(extra)
+    engine.remove_products([p['id'] for p in products[10:20]])
+    updated = [dict(p, description=f"{p['description']} for trail running") for p in products[30:35]]
+    engine.upsert_products(updated)
+
+    current = products[:10] + products[20:30] + updated + products[35:] + extra
+    write(path, current)
+    fresh = make_engine(path, tmp_path / 'fresh')
+    assert_same_table(engine, fresh)
+
+def test_catalog_diff_is_one_patched_snapshot(catalog, tmp_path):
+    path, products = catalog
+    engine = make_engine(path, tmp_path / 'index')
+    before, index = engine._state, engine._state.index
+
+    updated = [dict(p, price='$1.00', brand='Acme') for p in products[40:45]]
+    current = products[:10] + products[20:40] + updated + products[45:] + generate_catalog(66, seed=4)[60:]
+    assert engine.apply_catalog(current) == {'added': 6, 'updated': 5, 'removed': 10}
+
+    state = engine._state
+    assert state.version == before.version + 1
+    assert state.index is index and index.ntotal == len(current)
+    # Patched lookups and attributes agree with a snapshot built from scratch over the same rows.
+    rebuilt = type(state)(state.products, state.product_texts, state.vectors, index)
+    assert state.row_by_id == rebuilt.row_by_id
+    np.testing.assert_array_equal(state.ids, rebuilt.ids)
+    np.testing.assert_array_equal(state.rows_for_ids(state.ids[::-1]), rebuilt.rows_for_ids(state.ids[::-1]))
+    assert (state.rows_for_ids([p['id'] for p in products[10:20]]) == -1).all()
+    np.testing.assert_array_equal(state.attributes.mask(brands=['acme']), rebuilt.attributes.mask(brands=['acme']))
+    np.testing.assert_array_equal(state.attributes.price, rebuilt.attributes.price)
+    np.testing.assert_array_equal(state.attributes.mask(categories=['shoes'], min_qty=1),
+                                  rebuilt.attributes.mask(categories=['shoes'], min_qty=1))
+    for product in current:
+        np.testing.assert_allclose(state.vectors[state.row_by_id[product['id']]],
+                                   engine._encode([engine._product_text(product)])[0], atol=1e-6)
+
+    # The previous snapshot still sees its own rows.
+    assert len(before.products) == len(products)
+    for product in products[:20]:
+        np.testing.assert_allclose(before.vectors[before.row_by_id[product['id']]],
+                                   engine._encode([engine._product_text(product)])[0], atol=1e-6)
+
+def test_neighbor_table_is_aligned_by_product_id(catalog, tmp_path):
+    path, products = catalog
+    engine = make_engine(path, tmp_path / 'index')
+    neighbors_path = engine._artifact_paths()[2]
+    with np.load(neighbors_path) as data:
+        ids, scores, row_ids = data['ids'], data['scores'], data['row_ids']
+
+    # Same shape, other products: rejected rather than trusted by shape.
+    with open(neighbors_path, 'wb') as f:
+        np.savez(f, ids=ids, scores=scores, row_ids=row_ids + 1000)
+    assert engine._load_neighbors(neighbors_path, engine._state.ids) is None
+
+    # Same products in another row order: re-aligned by id.
+    order = np.random.default_rng(0).permutation(len(row_ids))
+    with open(neighbors_path, 'wb') as f:
+        np.savez(f, ids=ids[order], scores=scores[order], row_ids=row_ids[order])
+    loaded = engine._load_neighbors(neighbors_path, engine._state.ids)
+    np.testing.assert_array_equal(loaded.ids, engine._state.neighbors.ids)
+    np.testing.assert_array_equal(loaded.scores, engine._state.neighbors.scores)
+
+def test_filters_are_coerced_and_validated(catalog, tmp_path):
+    path, products = catalog
+    engine = make_engine(path, tmp_path / 'index')
+    coerced = engine.recommend_by_texts(['shoes'], 5, {'price_min': '100', 'categories': 'Shoes', 'min_qty': '1'})[0]
+    expected = engine.recommend_by_texts(['shoes'], 5, {'price_min': 100, 'categories': ['Shoes'], 'min_qty': 1})[0]
+    assert coerced == expected
+    assert all(item['product']['category'] == 'Shoes' for item in coerced)
+    assert engine.recommend_by_text('shoes', 5, {'price_max': '50'}) == engine.recommend_by_text('shoes', 5, {'price_max': 50.0})
+
+    for filters in ({'price_min': 'cheap'}, {'price_max': [1]}, {'min_qty': True}, {'brands': [1, 2]},
+                    {'categories': {'name': 'Shoes'}}, ['price_min']):
+        with pytest.raises(ValueError):
+            engine.recommend_by_texts(['x'], 5, filters)
+        with pytest.raises(ValueError):
+            engine.recommend_by_text('x', 5, filters)
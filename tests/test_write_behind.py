@@ -0,0 +1,132 @@
+import base64
+import json
+import os
+
+import pytest
+
+import database
+from write_behind import WriteBehindQueue
+
+@pytest.fixture
+def sqlite_pool(tmp_path, monkeypatch):
+    from benchmarks import sqlite_db
+    # install() swaps database._pool directly; record the original with monkeypatch first so it comes back.
+    monkeypatch.setattr(database, '_pool', database._pool)
+    return sqlite_db.install(str(tmp_path / 'conversations.db'))
+
+def make_turn(conversation_id, n):
+    created_at, seq = database.next_turn_stamp()
+    return {
+        'created_at': created_at.isoformat(),
+        'seq': seq,
+        'user_id': conversation_id,
+        'conversation_id': conversation_id,
+        'user_content': f'question {n}',
+        'assistant_content': f'answer {n}',
+        'products': None
+    }
+
+def make_queue(tmp_path, flush_fn, **kwargs):
+    return WriteBehindQueue(flush_fn, batch_size=10, flush_interval=0.01, retry_interval=0.05,
+                            spill_dir=str(tmp_path / 'spill'), **kwargs)
+
+def test_turns_in_one_batch_keep_their_order(sqlite_pool):
+    turns = [make_turn('c1', n) for n in range(6)]
+    assert database.log_turns(list(reversed(turns)))
+
+    messages, _ = database.get_conversation_history('c1')
+    assert [m['content'] for m in messages] == [text for n in range(6) for text in (f'question {n}', f'answer {n}')]
+    conversations, _ = database.get_all_conversations()
+    assert conversations[0]['last_message'] == 'answer 5'
+
+def test_replayed_older_turn_does_not_replace_last_message(sqlite_pool):
+    older = make_turn('c1', 0)
+    assert database.log_turns([make_turn('c1', 1)])
+    assert database.log_turns([older])
+
+    messages, _ = database.get_conversation_history('c1')
+    assert [m['content'] for m in messages] == ['question 0', 'answer 0', 'question 1', 'answer 1']
+    conversations, _ = database.get_all_conversations()
+    assert conversations[0]['last_message'] == 'answer 1'
+
+def test_history_pages_keep_question_before_answer(sqlite_pool):
+    assert database.log_turns([make_turn('c1', n) for n in range(4)])
+
+    contents, cursor_token = [], None
+    while True:
+        # Odd page size so every other page boundary falls between a question and its answer.
+        messages, cursor_token = database.get_conversation_history('c1', limit=3, cursor_token=cursor_token)
+        contents.extend(m['content'] for m in messages)
+        if cursor_token is None:
+            break
+    assert contents == [text for n in range(4) for text in (f'question {n}', f'answer {n}')]
+
+@pytest.mark.parametrize('payload', [
+    ['2026-01-01T00:00:00'],
+    ['2026-01-01T00:00:00', 'm1', 2],
+    ['2026-01-01T00:00:00', 7],
+    ['yesterday', 'm1'],
+    {'created_at': '2026-01-01T00:00:00'},
+])
+def test_malformed_cursors_return_an_empty_page(sqlite_pool, payload):
+    assert database.log_turns([make_turn('c1', 0)])
+    cursor_token = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+    assert database.get_conversation_history('c1', cursor_token=cursor_token) == ([], None)
+    assert database.get_all_conversations(cursor_token=cursor_token) == ([], None)
+
+def test_rejected_rows_are_isolated(tmp_path):
+    written = []
+
+    def flush(batch):
+        if any(item.get('bad') for item in batch):
+            return False
+        written.extend(batch)
+        return True
+
+    queue = make_queue(tmp_path, flush)
+    batch = [{'n': n, 'bad': n == 3} for n in range(8)]
+    assert queue._write_batch(batch)
+    assert [item['n'] for item in written] == [0, 1, 2, 4, 5, 6, 7]
+    assert queue.stats()['rejected'] == 1
+    assert not os.path.exists(queue._spill_path())
+    with open(queue._rejected_path(), encoding='utf-8') as f:
+        assert [json.loads(line)['n'] for line in f] == [3]
+
+def test_failed_batches_are_retried_then_rejected(tmp_path):
+    queue = make_queue(tmp_path, lambda batch: False, max_attempts=2)
+    assert not queue._write_batch([{'n': 0}, {'n': 1}])
+    assert queue.stats()['rejected'] == 0
+    assert not queue._replay_spilled()
+    assert queue.stats()['rejected'] == 2
+    assert not os.path.exists(queue._spill_path())
+
+def test_spilled_items_are_written_before_newer_ones(tmp_path):
+    written = []
+
+    def flush(batch):
+        written.extend(item['n'] for item in batch)
+        return True
+
+    queue = make_queue(tmp_path, flush)
+    queue._spill([{'n': 0}, {'n': 1}])
+    queue.submit({'n': 2})
+    queue.stop()
+    assert written == [0, 1, 2]
+
+def test_files_left_by_a_crashed_replay_are_claimed_again(tmp_path):
+    written = []
+
+    def flush(batch):
+        written.extend(item['n'] for item in batch)
+        return True
+
+    queue = make_queue(tmp_path, flush)
+    os.makedirs(queue.spill_dir)
+    # A pid that can't be alive: the replaying worker was killed mid-replay.
+    dead_pid = 2 ** 22 + 1
+    with open(os.path.join(queue.spill_dir, f'spill-{dead_pid}.jsonl.replaying-{dead_pid}'), 'w') as f:
+        f.write(json.dumps({'n': 0}) + '\n')
+    assert queue._replay_spilled()
+    assert written == [0]
+    assert os.listdir(queue.spill_dir) == []
@@ -0,0 +1,329 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from database import log_turns, next_turn_stamp
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindQueue:
+    """
+    异步写回队列：请求线程只负责入队，后台线程按批次大小/时间间隔合并写库。
+    内存队列写满时溢出到磁盘（JSONL），写库失败的批次也会落盘，稍后先于新记录重放。
+    批次写库失败时二分定位被数据库拒绝的记录，将其移入rejected文件而不是反复重试整批。
+    """
+    def __init__(self, flush_fn, max_size=1000, batch_size=50, flush_interval=0.5,
+                 spill_dir=None, retry_interval=5.0, max_attempts=5):
+        self.flush_fn = flush_fn
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.spill_dir = spill_dir or os.path.join(os.path.dirname(__file__), 'data', 'write_behind')
+        self._queue = queue.Queue(maxsize=max_size)
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._last_replay = 0.0
+        self._stats = {
+            'enqueued': 0,
+            'flushed': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'spilled': 0,
+            'replayed': 0,
+            'rejected': 0
+        }
+        atexit.register(self.stop)
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _spill_path(self, pid=None):
+        return os.path.join(self.spill_dir, f"spill-{pid or os.getpid()}.jsonl")
+
+    def _rejected_path(self):
+        return os.path.join(self.spill_dir, f"rejected-{os.getpid()}.jsonl")
+
+    def _ensure_started(self):
+        # fork出的子进程不会继承父进程的线程，需要按pid重新启动
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._spill_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_size)
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def submit(self, item):
+        """
+        入队一条记录；队列已满时同步追加到溢出文件，不阻塞请求
+        """
+        self._ensure_started()
+        self._bump('enqueued')
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._spill([item])
+
+    def _append(self, path, items):
+        with self._spill_lock:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False, default=str) + '\n')
+
+    def _spill(self, items):
+        if not items:
+            return
+        try:
+            self._append(self._spill_path(), items)
+            self._bump('spilled', len(items))
+        except OSError as e:
+            logger.error("Error spilling %s write-behind items: %s", len(items), e)
+
+    def _reject(self, items):
+        """
+        数据库拒绝的记录写入rejected文件留待人工处理，不再重放
+        """
+        logger.error("Dropping %s write-behind items the database rejected", len(items))
+        self._bump('rejected', len(items))
+        try:
+            self._append(self._rejected_path(), items)
+        except OSError as e:
+            logger.error("Error saving %s rejected write-behind items: %s", len(items), e)
+
+    def _flush(self, batch):
+        if not batch:
+            return True
+        try:
+            ok = self.flush_fn(batch)
+        except Exception as e:
+            logger.error("Error flushing write-behind batch: %s", e)
+            ok = False
+        if ok:
+            self._bump('batches')
+            self._bump('flushed', len(batch))
+        else:
+            self._bump('failed_batches')
+        return ok
+
+    def _write(self, batch):
+        """
+        写入一个批次，返回未能写入的记录。整批失败时二分重试以定位坏记录；
+        若前一半全部失败，多半是数据库不可用，不再继续拆分
+        """
+        if self._flush(batch):
+            return []
+        if len(batch) == 1:
+            return list(batch)
+        middle = len(batch) // 2
+        failed = self._write(batch[:middle])
+        if middle > 1 and len(failed) == middle:
+            return failed + list(batch[middle:])
+        return failed + self._write(batch[middle:])
+
+    def _write_batch(self, batch):
+        """
+        写入批次并处理失败的记录：同批有记录写入成功说明数据库可用，失败的即为坏记录，直接拒绝；
+        否则落盘稍后重试，超过最大尝试次数后拒绝。返回数据库是否可用
+        """
+        failed = self._write(batch)
+        if not failed:
+            return True
+        if len(failed) < len(batch):
+            self._reject(failed)
+            return True
+        retry = []
+        exhausted = []
+        for item in failed:
+            item = dict(item, attempts=item.get('attempts', 0) + 1)
+            (exhausted if item['attempts'] >= self.max_attempts else retry).append(item)
+        if exhausted:
+            self._reject(exhausted)
+        self._spill(retry)
+        return False
+
+    def _claim_spill_files(self):
+        """
+        认领本进程以及已退出进程留下的溢出文件（重命名是原子操作，避免多个worker重复重放）。
+        重放中途退出的进程留下的 .replaying-<pid> 文件同样会被重新认领；其中已写库的批次会再写一次，
+        宁可重复也不丢失
+        """
+        claimed = []
+        paths = glob.glob(os.path.join(self.spill_dir, 'spill-*.jsonl'))
+        paths += glob.glob(os.path.join(self.spill_dir, 'spill-*.jsonl.replaying-*'))
+        for path in sorted(paths, key=_mtime):
+            name = os.path.basename(path)
+            spill_name, _, replayer = name.partition('.replaying-')
+            try:
+                owner = int(replayer or spill_name[len('spill-'):-len('.jsonl')])
+            except ValueError:
+                continue
+            if owner != os.getpid() and _pid_alive(owner):
+                continue
+            target = os.path.join(self.spill_dir, f"{spill_name}.replaying-{os.getpid()}")
+            try:
+                with self._spill_lock:
+                    if target != path and os.path.exists(target):
+                        continue
+                    os.rename(path, target)
+                claimed.append(target)
+            except OSError:
+                continue
+        return claimed
+
+    def _read_spill_file(self, path):
+        items = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        items.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        return items
+
+    def _replay_spilled(self):
+        """
+        按文件从旧到新重放溢出记录；数据库不可用时把剩余记录放回本进程的溢出文件并返回False
+        """
+        self._last_replay = time.time()
+        claimed = self._claim_spill_files()
+        for n, path in enumerate(claimed):
+            items = self._read_spill_file(path)
+            for i in range(0, len(items), self.batch_size):
+                batch = items[i:i + self.batch_size]
+                if not self._write_batch(batch):
+                    self._spill(items[i + self.batch_size:])
+                    os.remove(path)
+                    for rest in claimed[n + 1:]:
+                        self._spill(self._read_spill_file(rest))
+                        os.remove(rest)
+                    return False
+                self._bump('replayed', len(batch))
+            os.remove(path)
+        return True
+
+    def _collect(self):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            # 溢出文件中的记录更早，先于队列中的新记录写库
+            if time.time() - self._last_replay > self.retry_interval and not self._replay_spilled():
+                self._stop.wait(self.retry_interval)
+                continue
+            batch = self._collect()
+            if batch and not self._write_batch(batch):
+                self._stop.wait(self.retry_interval)
+        self._drain_remaining()
+
+    def _drain_remaining(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(batch), self.batch_size):
+            chunk = batch[i:i + self.batch_size]
+            if not self._write_batch(chunk):
+                self._spill(batch[i + self.batch_size:])
+                return
+
+    def stop(self, timeout=10.0):
+        """
+        停止后台线程：先把队列中剩余的记录写库，写不进去的落盘
+        """
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        stats['max_size'] = self.max_size
+        return stats
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+_turn_queue = None
+_turn_queue_lock = threading.Lock()
+
+def get_turn_queue():
+    """
+    获取对话持久化的写回队列
+    """
+    global _turn_queue
+    if _turn_queue is None:
+        with _turn_queue_lock:
+            if _turn_queue is None:
+                _turn_queue = WriteBehindQueue(
+                    log_turns,
+                    max_size=int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', '1000')),
+                    batch_size=int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '50')),
+                    flush_interval=float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.5')),
+                    spill_dir=os.getenv('WRITE_BEHIND_SPILL_DIR'),
+                    max_attempts=int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', '5'))
+                )
+    return _turn_queue
+
+def enqueue_turn(user_id, user_content, assistant_content, conversation_id=None, products=None):
+    """
+    将一轮对话交给后台线程异步写库；时间戳和序号在入队时生成，写库顺序不影响消息顺序
+    """
+    created_at, seq = next_turn_stamp()
+    get_turn_queue().submit({
+        'created_at': created_at.isoformat(),
+        'seq': seq,
+        'user_id': user_id,
+        'conversation_id': conversation_id,
+        'user_content': user_content,
+        'assistant_content': assistant_content,
+        'products': products
+    })